@@ -8,17 +8,69 @@ import sys
 import re
 import subprocess
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 from prettytable import PrettyTable
 
-def Count(sub):
-    couts = Counter()
-    for line in sub.stdout:
-        split = line.strip().decode('utf-8').split()
-        if("0x" not in split[0]):
+from codeindex import (CodeDumpParser, CodeIndex, Function, isCodeLine,
+                       isTraceLine)
+from tracereader import TraceReader
+
+unknownFunc = Function('unknown')
+unknownFunc.name = 'unknown'
+
+# Count the opcodes of every traced instruction. If profile is a dict, the
+# output must also contain the `--print-all-code` dump; each instruction is
+# then attributed to the code object containing its PC, and profile maps
+# each Function to a Counter of its opcodes.
+def Count(sub, profile=None):
+    counts = Counter()
+    dump = None
+    if profile is not None:
+        dump = CodeDumpParser(CodeIndex())
+        # The last range looked up; consecutive PCs are mostly in the same
+        # code object
+        lastStart, lastEnd, lastFunc = 1, 0, None
+    for line in TraceReader(sub.stdout):
+        if dump is not None and dump.skipLine():
+            continue
+        split = line.split()
+        if len(split) == 0:
+            continue
+        if not split[0].startswith(b"0x"):
+            if dump is not None:
+                dump.feedHeader(split)
+            continue
+        if dump is not None and (dump.inSafePoints or dump.inCode()):
+            # Static disassembly, not an executed instruction
+            if dump.inCode() and isCodeLine(split):
+                try:
+                    dump.addInstruction(int(split[0], 16), int(split[1], 16))
+                except ValueError:
+                    pass
             continue
-        if(len(split) >= 4):
-            couts.update([split[2]])
+        # RelocInfo, constant pool and other lines of the dump have no
+        # instruction word
+        if not isTraceLine(split):
+            continue
+        if dump is not None:
+            try:
+                pc = int(split[0], 16)
+            except ValueError:
+                continue
+            if not lastStart <= pc <= lastEnd:
+                found = dump.functions.lookupRange(pc)
+                if found is None:
+                    lastStart, lastEnd, lastFunc = 1, 0, unknownFunc
+                else:
+                    lastStart, lastEnd, lastFunc = found
+            func = lastFunc
+            if func not in profile:
+                profile[func] = Counter()
+            profile[func][split[2]] += 1
+        counts[split[2]] += 1
+    # Only the opcode keys are decoded, not every traced line
+    couts = Counter({k.decode(): v for k, v in counts.items()})
     cout = couts.items()
     cout = list(cout)
     cout.sort(key=lambda x: x[1], reverse=True)
@@ -29,39 +81,123 @@ def Count(sub):
 
     return num, cout
 
+# Count() of the trace saved in the tracecache.py cache directory path
+def CountCached(path):
+    import tracecache
+
+    cache = tracecache.loadDir(path)
+    couts = cache.opcodeCounter(cache.trace['op'])
+    cout = list(couts.items())
+    cout.sort(key=lambda x: x[1], reverse=True)
+    return sum(couts.values()), cout
+
 def ArgsInit():
     parser = argparse.ArgumentParser()
-    parser.add_argument('arch1', help="The path of an architecture executable d8.")
-    parser.add_argument('arch2', help="The path of an architecture executable d8.")
-    parser.add_argument('d8_object', nargs='+', help="The path to the target of d8 operation")
+    parser.add_argument('arch1', nargs='?',
+                        help="The path of an architecture executable d8.")
+    parser.add_argument('arch2', nargs='?',
+                        help="The path of an architecture executable d8.")
+    parser.add_argument('--arch', action='append', default=[], dest='archs',
+                        help="The path of another architecture executable d8 "
+                             "to compare. May be given multiple times.")
+    parser.add_argument('--per-function', action='store_true', default=False,
+                        dest='per_function',
+                        help="Also run with --print-all-code and break the "
+                             "counts down by code object and compiler tier")
+    parser.add_argument('--top', type=int, default=20,
+                        help="Number of code objects to list with --per-function")
+    parser.add_argument('--cache', action='append', default=[], metavar='DIR',
+                        help="Compare the traces saved in these tracecache.py "
+                             "cache directories instead of running d8. May "
+                             "be given multiple times.")
+    parser.add_argument('d8_object', nargs='*', help="The path to the target of d8 operation")
     args, unknown = parser.parse_known_args()
+    if args.cache:
+        if args.arch1 is not None or args.archs or args.per_function:
+            parser.error("--cache replaces the d8 runs and cannot be combined "
+                         "with d8 paths or --per-function")
+    elif args.arch1 is None or args.arch2 is None or not args.d8_object:
+        parser.error("the following arguments are required: arch1, arch2, "
+                     "d8_object")
     return args, unknown
 
 
-def Compare(arch1, arch2):
-    summary = PrettyTable(["Summary", arch1[2], arch2[2]])
-    summary.add_row(["count", arch1[0], arch2[0]])
+# Start every d8 at once and drain each pipe on its own thread, so the total
+# wall time is that of the slowest simulator run rather than the sum
+def RunAll(binaries, run_args, profiles=None):
+    subs = [subprocess.Popen([binary] + run_args, shell=False,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            for binary in binaries]
+    if profiles is None:
+        profiles = [None] * len(subs)
+    with ThreadPoolExecutor(max_workers=len(subs)) as pool:
+        results = list(pool.map(Count, subs, profiles))
+    for sub in subs:
+        sub.wait()
+    return [result + tuple([f"arch{i + 1}"])
+            for i, result in enumerate(results)]
+
+
+# Print the per-tier and per-code-object breakdown collected by Count()
+def PrintProfile(label, total, profile, top):
+    if total == 0:
+        return
+    funcs = [(func, sum(counter.values())) for func, counter in profile.items()]
+    funcs.sort(key=lambda x: x[1], reverse=True)
+
+    tiers = Counter()
+    for func, count in funcs:
+        tiers[func.tier()] += count
+    x = PrettyTable([f"{label}_tier", "ratio", "count"])
+    for tier, count in tiers.most_common():
+        x.add_row([tier, "{:.2%}".format(float(count) / total), count])
+    print(x)
+
+    x = PrettyTable([f"{label}_function", "tier", "ratio", "count", "top_instrs"])
+    x._max_width = {f"{label}_function": 40}
+    for func, count in funcs[:top]:
+        instrs = ' '.join(f"{k.decode()}:{v}"
+                          for k, v in profile[func].most_common(3))
+        x.add_row([func.name, func.tier(),
+                   "{:.2%}".format(float(count) / total), count, instrs])
+    print(x)
+
+
+def Compare(*archs):
+    summary = PrettyTable(["Summary"] + [arch[2] for arch in archs])
+    summary.add_row(["count"] + [arch[0] for arch in archs])
     print(summary)
 
-    x = PrettyTable(["arch1_instr","arch1_ratio","arch1_count","arch2_instr","arch2_ratio","arch2_count"])
-    for n, v in zip(arch1[1], arch2[1]):
-        row = [n[0], "{:.2%}".format(float(n[1]) / arch1[0]),n[1]]
-        row.extend([v[0], "{:.2%}".format(float(v[1]) / arch2[0]), v[1]])
+    header = []
+    for arch in archs:
+        header.extend([f"{arch[2]}_instr", f"{arch[2]}_ratio", f"{arch[2]}_count"])
+    x = PrettyTable(header)
+    for instrs in zip(*[arch[1] for arch in archs]):
+        row = []
+        for arch, n in zip(archs, instrs):
+            row.extend([n[0], "{:.2%}".format(float(n[1]) / arch[0]), n[1]])
         x.add_row(row)
     print(x)
 
 if __name__ == "__main__":
     args, run_args = ArgsInit()
+    if args.cache:
+        try:
+            results = [CountCached(path) + tuple([f"arch{i + 1}"])
+                       for i, path in enumerate(args.cache)]
+        except ValueError as e:
+            sys.exit(f"CountInstr.py: error: {e}")
+        Compare(*results)
+        sys.exit(0)
     run_args.append("--trace-sim")
-    run_args.insert(0, args.arch1)
+    binaries = [args.arch1, args.arch2] + args.archs
+    profiles = None
+    if args.per_function:
+        run_args.append("--print-all-code")
+        profiles = [{} for _ in binaries]
     run_args.extend(args.d8_object)
-    sub = subprocess.Popen(
-        run_args, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    risv = (Count(sub))+tuple(["arch1"])
-
-    run_args[0] = args.arch2
-    sub = subprocess.Popen(
-        run_args, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    mips64el = (Count(sub))+tuple(["arhc2"])
-    Compare(risv, mips64el)
-    pass
+    results = RunAll(binaries, run_args, profiles)
+    Compare(*results)
+    if profiles is not None:
+        for result, profile in zip(results, profiles):
+            PrintProfile(result[2], result[0], profile, args.top)
@@ -16,52 +16,55 @@
 #
 #   $ cctest --print-all-code -trace-sim test-interpreter-intrinsics/Call &> out
 #   $ analyze.py out
+#
+# With --checkpoint, the state of the analysis is saved every
+# --checkpoint-interval instructions, so later --at COUNT and --range A:B
+# queries only replay the log from the nearest checkpoint:
+#
+#   $ analyze.py --checkpoint out
+#   $ analyze.py --at 123456789 out
+#
+# With --profile PREFIX, the instructions executed between calls and returns
+# are attributed to the functions on the call stack instead, and written as
+# folded stacks and a Chrome trace (see callprofile.py):
+#
+#   $ analyze.py --profile out-profile out
+#
+# With --follow, the log is read as it is written, e.g. from a running test,
+# and a summary of every CallImpl is printed when it returns:
+#
+#   $ cctest --print-all-code -trace-sim test-interpreter-intrinsics/Call 2>&1 | analyze.py --follow -
+#
+# With --jobs N, the CallImpl entries of a log file are analyzed in N worker
+# processes, each starting with a fresh call stack and registers:
+#
+#   $ analyze.py --jobs 8 out
+#
+# With --defuse, every register write is recorded in <logfile>.defuse, so
+# defuse.py can find the instruction that last wrote a register before a
+# given count, or every write of a value:
+#
+#   $ analyze.py --defuse out > /dev/null
+#   $ defuse.py last a3 123456789 out
 
 import sys
 import argparse
+import io
+import multiprocessing
+import os
 import re
+import signal
 import struct
 import binascii
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-
-class Trampoline:
-    def __init__(self):
-        self.start = 0
-        self.end = 0
-
-        def __repr__(self):
-            return f"Trampoline: {self.start} - {self.end}"
-
-        def hasPC(self, pc):
-            if pc >= self.start and pc <= self.end:
-                return True
-            return False
-
-
-class Function:
-    def __init__(self, kind):
-        self.kind = kind
-        self.name = "unnamed"
-        self.compiler = ""
-        self.address = 0
-        self.trampoline = None
-        self.start = 0
-        self.end = 0
-
-    def __repr__(self):
-        return f"Function: {self.name}"
-
-    def __str__(self):
-        return self.name
-
-    # Returns a tuple with the first value indicating if the PC is within this
-    # function and the second indicating if it is in the trampoline
-    def hasPC(self, pc):
-        if pc >= self.start and pc <= self.end:
-            return True, False
-        elif self.trampoline.hasPC(pc):
-            return True, True
-        return False, False
+from callprofile import CallProfile
+from checkpoints import CheckpointWriter, Checkpoints
+from codeindex import CodeDumpParser, CodeIndex, Function
+import traceline
+from traceline import InstructionTrace
+from tracereader import TraceReader
 
 
 class Instruction:
@@ -96,177 +99,28 @@ class Instruction:
         if pc is None or offset is None or insnHex is None:
             return None
 
-        insn = words[3]
+        insn = words[3].decode()
         operands = []
         for idx in range(4, len(words)):
             word = words[idx]
-            parts = re.split('[\(\)]', word)
+            parts = re.split(rb'[\(\)]', word)
             for part in parts:
                 if len(part) > 0:
-                    operands.append(part.strip(','))
-            if not word.endswith(','):
+                    operands.append(part.strip(b',').decode())
+            if not word.endswith(b','):
                 # This is the last operand
                 break
         return cls(line, pc, insn, operands, offset)
 
 
-class InstructionTrace:
-    def __init__(self, line, pc, insn, operands, result, count):
-        self.line = line
-        self.pc = pc
-        self.insn = insn
-        self.operands = operands
-        self.result = result
-        self.count = count
-
-    def __repr__(self):
-        return f"{hex(self.pc)}\t{self.insn} {','.join(self.operands)}\t({insn.count})"
-
-    # Create an InstructionTrace from a line of the simulator trace, or if it
-    # does not look like an instruction, return None
-    # A normal instruction looks like:
-    #   0x00a0caf43be0   00000e37       lui       t3, 0x0               0000000000000000    (71)    int64:0       uint64:0
-    @classmethod
-    def fromLine(cls, line):
-        words = line.split()
-        if len(words) < 3:
-            return None
-        if not words[0].startswith('0x') or len(words[1]) != 8:
-            return None
-
-        insn = words[2]
-        pc = None
-        insnHex = None
-        try:
-            pc = int(words[0], 16)
-            insnHex = int(words[1], 16)
-        except ValueError:
-            pass
-        countRes = re.search('\(([1-9][0-9]* *)\)', line)
-        if pc is None or insnHex is None or (countRes is None and
-                                             not isControlFlow(insn)):
-            return None
-
-        count = -1
-        if countRes is not None:
-            count = int(countRes.group(1))
-        operands = []
-        result = None
-        if insn == 'ret' or insn == 'ecall':  # No operands
-            pass
-        else:
-            resIdx = 3
-            for idx in range(3, len(words)):
-                resIdx = idx + 1
-                word = words[idx]
-                parts = re.split('[\(\)]', word)
-                for part in parts:
-                    if len(part) > 0:
-                        operands.append(part.strip(','))
-                # Check for end of operands with special case for the rounding mode
-                if not word.startswith('[') and not word.endswith(','):
-                    # This is the last operand
-                    break
-
-            # Skip over the branch/jump destination
-            if resIdx + 1 < len(words) and words[resIdx] == '->':
-                resIdx += 2
-
-            # The result is the next word after the operands
-            if resIdx < len(words) and not isStore(insn) and not isBranch(insn):
-                result = int(words[resIdx], 16)
-            if args.target == 'mips' and (insn == 'bal' or insn == 'jalr'):
-                result = pc + 8
-
-        return cls(line, pc, insn, operands, result, count)
-
-    def isStore(self):
-        return isStore(self.insn)
-
-    def isBranch(self):
-        return isBranch(self.insn)
-
-    def isJump(self):
-        return isJump(self.insn)
-
-    def isJumpAndLink(self):
-        return isJumpAndLink(self.insn)
-
-    def isCall(self):
-        if self.insn == 'jalr' and \
-                ((args.target == 'riscv' and
-                  (self.operands[0] == 'ra' or len(self.operands) == 1)) or
-                 (args.target == 'mips' and self.operands[1] == 'ra')):
-            return True
-        return False
-
-    def isReturn(self):
-        if self.insn == 'ret' or (self.insn == 'jr' and self.operands[0] == 'ra'):
-            return True
-        return False
-
-    def jumpTarget(self):
-        if self.insn == 'j':             # j  4
-            return self.pc + int(self.operands[0])
-        elif self.insn == 'jal' and len(self.operands) == 2 and self.operands[0] == 'zero_reg':
-            return self.pc + int(self.operands[1])
-        elif self.insn == 'jr':
-            if len(self.operands) == 2:  # jr 4(t4)
-                return int(self.operands[0]) + registers[self.operands[1]]
-            else:                        # jr t4
-                return registers[self.operands[0]]
-        elif self.insn == 'jalr' and len(self.operands) == 3 and self.operands[0] == 'zero_reg':
-            return int(self.operands[1]) + registers[self.operands[2]]
-        else:
-            return None
-
-    def callTarget(self):
-        if not self.isCall():
-            return None
-        if args.target == 'riscv':
-            # jalr xN
-            if len(self.operands) == 1:
-                return registers[self.operands[0]]
-
-            offset = None
-            try:
-                int(self.operands[0])
-            except ValueError:
-                pass
-            # jalr M(xN)
-            if offset is not None:
-                return offset + registers[self.operands[1]]
-            else:  # jalr xM, xN
-                return registers[self.operands[1]]
-        elif args.target == 'mips':
-            return registers[self.operands[0]]
-        else:
-            return None
-
-    def getDestinationReg(self):
-        if len(self.operands) == 0:
-            return None
-        if self.isStore():
-            return None
-        elif self.isBranch():
-            return None
-        elif self.isJump():
-            return None
-        elif self.isJumpAndLink():
-            if len(self.operands) == 1:  # Implicit ra
-                return 'ra'
-            elif args.target == 'riscv':
-                return self.operands[0]
-            elif args.target == 'mips':
-                return self.operands[1]
-        return self.operands[0]
-
-
 unknownFunc = Function('unknown')
 unknownFunc.name = 'unknown'
 hostFunc = Function('host')
 hostFunc.name = 'host'
 
+# Return address of the outermost frame of a CallImpl
+END_OF_SIMULATION = 0xFFFFFFFFFFFFFFFE
+
 
 class FunctionCall:
     indentLevel = 0
@@ -278,7 +132,9 @@ class FunctionCall:
         self.sp = sp
         self.fp = fp
         self.indentLevel = FunctionCall.indentLevel
-        FunctionCall.indentLevel = FunctionCall.indentLevel + 1
+        # Frames beyond maxDepth are dropped, so the indentation stops there
+        if maxDepth is None or FunctionCall.indentLevel < maxDepth:
+            FunctionCall.indentLevel = FunctionCall.indentLevel + 1
 
     def returnFrom(self, ra=None, sp=None, fp=None):
         if ra is not None and ra != self.ra:
@@ -293,34 +149,6 @@ class FunctionCall:
         FunctionCall.indentLevel = FunctionCall.indentLevel - 1
 
 
-def isStore(s):
-    if s in ["sd", "sw", "sh", "sb", "fsd", "fsw"]:
-        return True
-    return False
-
-
-def isBranch(s):
-    if s[0] == 'b':
-        return True
-    return False
-
-
-def isJump(s):
-    if s == "j" or s == "jr":
-        return True
-    return False
-
-
-def isJumpAndLink(s):
-    if s[0:3] == "jal" or s == "bal":
-        return True
-    return False
-
-
-def isControlFlow(s):
-    return isBranch(s) or isJump(s) or isJumpAndLink(s) or s == 'ecall'
-
-
 def printArgs(indentLevel=0):
     print(
         f"### {'  ' * call.indentLevel}  sp={hex(registers['sp'])} fp={hex(registers['fp'])}")
@@ -372,164 +200,464 @@ def printReturnValues(indentLevel=0):
         print()
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--inline', action='store_true', default=False,
-                    dest='inline', help='Print comments inline with trace')
-parser.add_argument('--target', default='riscv',
-                    help='Specify the target architecture')
-parser.add_argument('--print-host-calls', action='store_true', default=False,
-                    dest='print_host_calls', help='Print info about calls to host functions')
-parser.add_argument('--fp', action='store_true', default=False,
-                    dest='fp', help='Print floating point arguments and return values')
-parser.add_argument('logfile', nargs=1)
-args = parser.parse_args()
+# Build the analysis state for a checkpoint. Functions are stored as their
+# start address, which identifies them among the checkpoint's code objects.
+def saveState():
+    def funcId(func):
+        if func is unknownFunc:
+            return -1
+        if func is hostFunc:
+            return -2
+        return func.start
+
+    frames = [(funcId(c.func), c.pc, c.ra, c.sp, c.fp, c.indentLevel)
+              for c in callStack]
+    return {'callStack': frames, 'registers': registers.toDict(),
+            'indentLevel': FunctionCall.indentLevel}
+
+
+# Restore the state of a checkpoint, rebuilding the code index from its code
+# objects. A frame's function is the last code object dumped at its start.
+def restoreState(saved, numFunctions, state):
+    global call, inTraceSim
+    byId = {-1: unknownFunc, -2: hostFunc}
+    for func in saved.functions[:numFunctions]:
+        functions.addFunction(func)
+        byId[func.start] = func
+    for funcId, pc, ra, sp, fp, indentLevel in state['callStack']:
+        func = byId[funcId]
+        call = FunctionCall(func, pc, ra, sp, fp)
+        call.indentLevel = indentLevel
+        callStack.append(call)
+    registers.update(state['registers'])
+    FunctionCall.indentLevel = state['indentLevel']
+    inTraceSim = True
 
-tracefile = open(args.logfile[0])
-functions = {}
-current = None
-inTrampoline = False
-inBody = False
-inSafePoints = False
-skip = 0
 
-inTraceSim = False
-callStack = []
-registers = {}
-
-nextLine = tracefile.readline()
-while nextLine:
-    line = nextLine
-    nextLine = tracefile.readline()
-    if skip > 0:
-        skip = skip - 1
-        continue
-
-    words = line.split()
-    if len(words) == 0:
-        continue
-
-    if words[0] == "kind":
-        # Start a new function
-        current = Function(words[2])
-    elif words[0] == "kind:":
-        # Start a new function
-        current = Function(words[1:])
-    elif words[0] == "name":
-        current.name = words[2]
-    elif words[0] == "compiler":
-        current.compiler = words[2]
-    elif words[0] == "compiler:":
-        current.compiler = words[1]
-    elif words[0] == "address":
-        current.address = words[2]
-    elif words[0] == "Trampoline":
-        current.trampoline = Trampoline()
-        inTrampoline = True
-    elif words[0] == "Instructions":
-        inTrampoline = False
-        inBody = True
-    elif words[0] == "Safepoints" or words[0] == "Deoptimization":
-        inBody = False
-        inSafePoints = True
-    elif words[0] == "RelocInfo":
-        inSafePoints = False
-        # End this function
-        inBody = False
-        functions[current.start] = current
-        if current.trampoline is not None:
-            functions[current.trampoline.start] = current
-        current = None
-        # skip the next line
-        skip = 1
-    elif words[0] == "---":
-        inTraceSim = False
-    elif words[0] == "CallImpl:":
-        # Record registers from the output
-        registers['a0'] = int(words[11], 16)
-        registers['a1'] = int(words[15], 16)
-        registers['a2'] = int(words[19], 16)
-        registers['a3'] = int(words[23], 16)
-        registers['a4'] = int(words[27], 16)
-        registers['a5'] = int(words[31], 16)
-        addr = int(words[7], 16)
-        func = functions[addr]
-        call = FunctionCall(func, addr, 0xFFFFFFFFFFFFFFFE)
-        callStack.append(call)
-        print(f"### Start in {func.name}")
-        inTraceSim = True
-    else:
-        if inSafePoints:
+# A CallImpl from the test, summarized in --follow mode when it returns
+class Segment:
+    def __init__(self, func, count):
+        self.func = func
+        self.start = count
+        self.calls = 0
+        self.maxDepth = 0
+
+    def report(self, count):
+        print(f"### End of {self.func.name}: {count - self.start} instructions, "
+              f"{self.calls} calls, max depth {self.maxDepth}")
+        sys.stdout.flush()
+
+
+def pushCall(call):
+    global droppedFrames
+    if len(callStack) == maxDepth and not droppedFrames:
+        print(f"### WARNING: Call stack deeper than {maxDepth} frames, "
+              "dropping the outermost ones", file=sys.stderr)
+        droppedFrames = True
+    callStack.append(call)
+    if profile is not None:
+        profile.enter(call.func, lastCount)
+    if segment is not None:
+        segment.calls += 1
+        segment.maxDepth = max(segment.maxDepth, len(callStack))
+
+
+def popCall():
+    call = callStack.pop()
+    if profile is not None:
+        profile.leave(lastCount)
+    return call
+
+
+def printCallStack(count):
+    print(f"### Call stack at {count}:")
+    for call in reversed(callStack):
+        print(f"###   {call.func.name} ({hex(call.pc)})")
+
+
+# Analyze the lines read by tracefile, printing the call trace
+def processLines(tracefile):
+    global inTraceSim, call, lastCount, segment
+    lines = iter(tracefile)
+    nextLine = next(lines, b'')
+    while nextLine:
+        line = nextLine
+        nextLine = next(lines, b'')
+        if dump.skipLine():
             continue
 
-        if not inTraceSim:
-            insn = Instruction.fromLine(line)
-            if insn is not None:
-                if insn.offset == 0:
-                    if inTrampoline:
-                        current.trampoline.start = insn.pc
-                    elif inBody:
-                        current.start = insn.pc
-                else:
-                    if inTrampoline:
-                        current.trampoline.end = insn.pc
-                    elif inBody:
-                        current.end = insn.pc
+        words = line.split()
+        if len(words) == 0:
+            continue
+
+        if dump.feedHeader(words):
+            pass
+        elif words[0] == b"---":
+            inTraceSim = False
+            if segment is not None:
+                segment.report(lastCount)
+                segment = None
+        elif words[0] == b"CallImpl:":
+            # Record registers from the output
+            registers['a0'] = int(words[11], 16)
+            registers['a1'] = int(words[15], 16)
+            registers['a2'] = int(words[19], 16)
+            registers['a3'] = int(words[23], 16)
+            registers['a4'] = int(words[27], 16)
+            registers['a5'] = int(words[31], 16)
+            addr = int(words[7], 16)
+            func = functions.lookup(addr) or unknownFunc
+            if args.follow:
+                if segment is not None:
+                    segment.report(lastCount)
+                segment = Segment(func, lastCount)
+            call = FunctionCall(func, addr, END_OF_SIMULATION)
+            pushCall(call)
+            print(f"### Start in {func.name}")
+            inTraceSim = True
         else:
-            insn = InstructionTrace.fromLine(line)
-            if insn is not None:
-                dest = insn.getDestinationReg()
-                if dest is not None and insn.result is not None:
-                    registers[dest] = insn.result
-
-                if insn.isCall():
-                    addr = insn.callTarget()
-                    if addr in functions.keys():
-                        func = functions[addr]
-                        call = FunctionCall(func, addr, insn.result,
-                                            registers['sp'], registers['fp'])
-                        callStack.append(call)
+            if dump.inSafePoints:
+                continue
+
+            if not inTraceSim:
+                insn = Instruction.fromLine(line)
+                if insn is not None:
+                    dump.addInstruction(insn.pc, insn.offset)
+            else:
+                insn = InstructionTrace.fromLine(line, words)
+                if insn is not None:
+                    decoded = insn.decoded
+                    if reportTo is not None and insn.count > 0:
+                        if insn.count > reportTo:
+                            break
+                        if sys.stdout is not stdout and reportFrom is not None \
+                                and insn.count >= reportFrom:
+                            sys.stdout.close()
+                            sys.stdout = stdout
+                    if insn.count > 0:
+                        lastCount = insn.count
+
+                    dest = decoded.dest
+                    if dest is not None and insn.result is not None:
+                        registers.values[dest] = insn.result
+                        if defuse is not None:
+                            # Control-flow lines may print no count; they
+                            # come right after the last line that printed one
+                            count = insn.count if insn.count > 0 else \
+                                lastCount + 1
+                            defuse.add(dest, count, decoded.pc, insn.result)
+
+                    if decoded.isCall:
+                        addr = insn.callTarget()
+                        func = functions.lookup(addr)
+                        if func is not None:
+                            call = FunctionCall(func, addr, insn.result,
+                                                registers['sp'], registers['fp'])
+                            pushCall(call)
+                            print(
+                                f"### {'  ' * call.indentLevel}Call {func.name} {insn.count}")
+                            printArgs(call.indentLevel)
+                        else:
+                            func = unknownFunc
+                            if nextLine and nextLine.startswith(b"Call to host function"):
+                                if not args.print_host_calls:
+                                    continue
+                                func = hostFunc
+                            call = FunctionCall(func, addr, insn.result,
+                                                registers['sp'], registers['fp'])
+                            pushCall(call)
+                            print(
+                                f"### {'  ' * call.indentLevel}Call {func.name} {insn.count}")
+                            printArgs(call.indentLevel)
+
+                    if decoded.isReturn and not callStack:
+                        # The frame was dropped by --max-depth
+                        FunctionCall.indentLevel = max(FunctionCall.indentLevel - 1,
+                                                       0)
+                    elif decoded.isReturn:
+                        call = popCall()
                         print(
-                            f"### {'  ' * call.indentLevel}Call {func.name} {insn.count}")
-                        printArgs(call.indentLevel)
-                    else:
-                        func = unknownFunc
-                        if nextLine and nextLine.startswith("Call to host function"):
-                            if not args.print_host_calls:
-                                continue
-                            func = hostFunc
-                        call = FunctionCall(func, addr, insn.result,
-                                            registers['sp'], registers['fp'])
-                        callStack.append(call)
+                            f"### {'  ' * call.indentLevel}Return from {call.func.name} {insn.count}")
+                        printReturnValues(call.indentLevel)
+                        call.returnFrom(registers['ra'],
+                                        registers['sp'], registers['fp'])
+                        if segment is not None and call.ra == END_OF_SIMULATION:
+                            segment.report(lastCount)
+                            segment = None
+
+                    # Only report jumps to the entry of a code object; a
+                    # return lands inside its caller
+                    func = None
+                    if decoded.jumpBase is not None:
+                        target = insn.jumpTarget()
+                        func = functions.lookup(target)
+                        if func is not None and target != func.start and \
+                                (func.trampoline is None or
+                                 target != func.trampoline.start):
+                            func = None
+                    if func is not None:
                         print(
-                            f"### {'  ' * call.indentLevel}Call {func.name} {insn.count}")
+                            f"### {'  ' * call.indentLevel}Jump to {func.name} {insn.count}")
                         printArgs(call.indentLevel)
 
-                if insn.isReturn():
-                    call = callStack.pop()
+                    if args.inline:
+                        print(line.decode(), end='')
+
+                    # Only checkpoint between code objects, so the dump parser
+                    # has no state to save
+                    if checkpoints is not None and insn.count > 0 and \
+                            checkpoints.due(insn.count) and nextLine and \
+                            dump.current is None:
+                        checkpoints.write(insn.count,
+                                          tracefile.tell() - len(nextLine),
+                                          saveState())
+
+                if words[0] == b"Returned" and args.print_host_calls and \
+                        callStack:
+                    prefix = 'a' if args.target == 'riscv' else 'v'
+                    registers[f'{prefix}1'] = int(words[1], 16)
+                    registers[f'{prefix}0'] = int(words[3], 16)
+                    call = popCall()
                     print(
-                        f"### {'  ' * call.indentLevel}Return from {call.func.name} {insn.count}")
+                        f"### {'  ' * call.indentLevel}Return from {call.func.name}")
                     printReturnValues(call.indentLevel)
-                    call.returnFrom(registers['ra'],
-                                    registers['sp'], registers['fp'])
+                    call.returnFrom()
+
+
+# Trace lines of executed instructions, which can never be headers
+TRACE_LINE_RE = re.compile(rb'[ \t]*0x')
+
+
+# Index pass for --jobs: feeds the lines of the log to a CodeDumpParser the
+# way processLines() does, without decoding the trace, and records where each
+# CallImpl starts. Returns the code objects in log order and an
+# (offset, numFunctions) pair for every CallImpl, numFunctions being the
+# number of code objects finished before it.
+def indexSegments(logfile):
+    parsed = []
+    parser = CodeDumpParser(CodeIndex(), parsed.append)
+    segments = []
+    inTraceSim = False
+    with TraceReader(logfile) as reader:
+        for line in reader:
+            if parser.skipLine():
+                continue
+            if inTraceSim and TRACE_LINE_RE.match(line):
+                continue
+            words = line.split()
+            if len(words) == 0:
+                continue
+            if parser.feedHeader(words):
+                pass
+            elif words[0] == b"---":
+                inTraceSim = False
+            elif words[0] == b"CallImpl:":
+                segments.append((reader.tell() - len(line), len(parsed)))
+                inTraceSim = True
+            elif not inTraceSim and not parser.inSafePoints:
+                insn = Instruction.fromLine(line)
+                if insn is not None:
+                    parser.addInstruction(insn.pc, insn.offset)
+    return parsed, segments
+
+
+# Code objects of the index pass, shared read-only with the forked workers
+indexedFunctions = []
+
+
+# Process pool worker for --jobs: analyzes the log from start to end, with
+# the first numFunctions indexed code objects, and returns its output
+def analyzeChunk(start, end, numFunctions):
+    global functions, dump, inTraceSim, lastCount
+    functions = CodeIndex()
+    for func in indexedFunctions[:numFunctions]:
+        functions.addFunction(func)
+    dump = CodeDumpParser(functions)
+    inTraceSim = False
+    lastCount = 0
+    callStack.clear()
+    registers.clear()
+    FunctionCall.indentLevel = 0
+
+    sys.stdout = io.StringIO()
+    try:
+        with TraceReader(args.logfile[0], start, end) as tracefile:
+            processLines(tracefile)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def analyzeParallel(logfile, jobs):
+    global indexedFunctions
+    indexedFunctions, segments = indexSegments(logfile)
+    size = os.path.getsize(logfile)
+
+    # Chunks start at CallImpl lines, the first one at the start of the log.
+    # Use a few chunks per worker so one long CallImpl does not stall the pool.
+    target = size // (jobs * 4) + 1
+    starts = [0]
+    numFunctions = [0]
+    for offset, num in segments:
+        if offset - starts[-1] >= target:
+            starts.append(offset)
+            numFunctions.append(num)
+    ends = starts[1:] + [size]
+
+    # The workers are forked, so they share the index without pickling it
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+        # map() yields in submission order, so the output is in log order
+        for text in pool.map(analyzeChunk, starts, ends, numFunctions):
+            sys.stdout.write(text)
 
-                if insn.jumpTarget() in functions:
-                    func = functions[insn.jumpTarget()]
-                    print(
-                        f"### {'  ' * call.indentLevel}Jump to {func.name} {insn.count}")
-                    printArgs(call.indentLevel)
-
-                if args.inline:
-                    print(line, end='')
-
-            if words[0] == "Returned" and args.print_host_calls:
-                prefix = 'a' if args.target == 'riscv' else 'v'
-                registers[f'{prefix}1'] = int(words[1], 16)
-                registers[f'{prefix}0'] = int(words[3], 16)
-                call = callStack.pop()
-                print(
-                    f"### {'  ' * call.indentLevel}Return from {call.func.name}")
-                printReturnValues(call.indentLevel)
-                call.returnFrom()
-    line = nextLine
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--inline', action='store_true', default=False,
+                    dest='inline', help='Print comments inline with trace')
+parser.add_argument('--target', default='riscv',
+                    help='Specify the target architecture')
+parser.add_argument('--print-host-calls', action='store_true', default=False,
+                    dest='print_host_calls', help='Print info about calls to host functions')
+parser.add_argument('--fp', action='store_true', default=False,
+                    dest='fp', help='Print floating point arguments and return values')
+parser.add_argument('--checkpoint', action='store_true', default=False,
+                    help='Write replay checkpoints to <logfile>.checkpoints')
+parser.add_argument('--checkpoint-interval', type=int, default=1000000,
+                    dest='checkpoint_interval',
+                    help='Instructions between checkpoints')
+parser.add_argument('--at', type=int, default=None, metavar='COUNT',
+                    help='Print the call stack after instruction COUNT, '
+                         'replaying from the nearest checkpoint')
+parser.add_argument('--range', default=None, metavar='A:B',
+                    help='Only report instructions A to B, replaying from '
+                         'the nearest checkpoint')
+parser.add_argument('--profile', default=None, metavar='PREFIX',
+                    help='Attribute instruction counts to functions and '
+                         'write PREFIX.folded and PREFIX.json')
+parser.add_argument('--follow', action='store_true', default=False,
+                    help='Analyze a log that is still being written, with '
+                         'bounded memory, and report each CallImpl when it '
+                         'returns; stop with Ctrl-C')
+parser.add_argument('--max-depth', type=int, default=None, dest='max_depth',
+                    metavar='N',
+                    help='Keep at most N frames on the call stack '
+                         '(default: unlimited, 10000 with --follow unless '
+                         '--profile is given)')
+parser.add_argument('-j', '--jobs', type=int, default=1, dest='jobs',
+                    help='Number of worker processes analyzing the CallImpl '
+                         'entries of the log')
+parser.add_argument('--defuse', action='store_true', default=False,
+                    help='Record every register write in <logfile>.defuse '
+                         'for defuse.py queries')
+parser.add_argument('logfile', nargs=1, help="Log file, or '-' to read from stdin")
+args = parser.parse_args()
+traceline.target = args.target
+if args.profile is not None and (args.at is not None or
+                                 args.range is not None or
+                                 args.max_depth is not None):
+    parser.error('--profile replays the whole log with its complete call '
+                 'stack and cannot be combined with --at, --range or '
+                 '--max-depth')
+if args.follow and (args.checkpoint or args.at is not None or
+                    args.range is not None):
+    parser.error('--follow cannot be combined with --checkpoint, --at or '
+                 '--range')
+if args.checkpoint and args.logfile[0] == '-':
+    parser.error('--checkpoint needs a log file to index and cannot read '
+                 'from stdin')
+if args.jobs > 1 and (args.logfile[0] == '-' or args.follow or
+                      args.checkpoint or args.profile is not None or
+                      args.at is not None or args.range is not None):
+    parser.error('--jobs needs a log file and cannot be combined with '
+                 '--follow, --checkpoint, --profile, --at or --range')
+if args.defuse and (args.logfile[0] == '-' or args.follow or args.jobs > 1 or
+                    args.at is not None or args.range is not None):
+    parser.error('--defuse needs the whole log file and cannot be combined '
+                 'with --follow, --jobs, --at or --range')
+maxDepth = args.max_depth
+if maxDepth is None and args.follow and args.profile is None:
+    maxDepth = 10000
+
+# Maps every PC inside a function body or trampoline to its Function
+functions = CodeIndex()
+
+inTraceSim = False
+# Returns that are never seen would grow the stack without bound, so the
+# outermost frames beyond maxDepth are forgotten
+callStack = deque(maxlen=maxDepth)
+# Whether a frame was dropped for maxDepth yet
+droppedFrames = False
+registers = traceline.registers
+
+# Report only instructions in [reportFrom, reportTo]
+reportFrom = None
+reportTo = None
+if args.at is not None:
+    reportTo = args.at
+elif args.range is not None:
+    reportFrom, reportTo = (int(n) for n in args.range.split(':'))
+
+checkpoints = None
+start = 0
+if reportTo is not None:
+    first = reportFrom if reportFrom is not None else reportTo
+    try:
+        saved = Checkpoints(args.logfile[0])
+    except (OSError, ValueError) as e:
+        print(f"### No usable checkpoints ({e}), replaying from the start",
+              file=sys.stderr)
+        saved = None
+    # the state just before the first reported instruction
+    nearest = saved.nearest(first - 1) if saved is not None else None
+    if nearest is not None:
+        count, start, numFunctions, state = nearest
+        restoreState(saved, numFunctions, state)
+        saved = None
+elif args.checkpoint:
+    checkpoints = CheckpointWriter(args.logfile[0], args.checkpoint_interval)
+
+dump = CodeDumpParser(functions, checkpoints.addFunction
+                      if checkpoints is not None else None)
+
+profile = CallProfile(args.profile) if args.profile is not None else None
+defuse = None
+if args.defuse:
+    from defuse import DefUseWriter
+    defuse = DefUseWriter(args.logfile[0], registers)
+# Count of the last traced instruction
+lastCount = 0
+# The CallImpl being traced, in --follow mode
+segment = None
+
+stdout = sys.stdout
+if reportTo is not None or profile is not None:
+    # Replay silently up to the first reported instruction
+    sys.stdout = open(os.devnull, 'w')
+
+if args.jobs > 1:
+    analyzeParallel(args.logfile[0], args.jobs)
+    sys.exit(0)
+
+tracefile = TraceReader(args.logfile[0], start, follow=args.follow)
+if args.follow:
+    # Finish the lines read so far and print the final reports on Ctrl-C
+    signal.signal(signal.SIGINT, lambda signum, frame: tracefile.stop())
+
+processLines(tracefile)
 
 tracefile.close()
+if segment is not None:
+    segment.report(lastCount)
+if checkpoints is not None:
+    checkpoints.close()
+if defuse is not None:
+    defuse.close()
+if sys.stdout is not stdout:
+    sys.stdout.close()
+    sys.stdout = stdout
+if args.at is not None:
+    printCallStack(args.at)
+if profile is not None:
+    profile.close(lastCount)
+    profile.report()
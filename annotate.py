@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Hot-spot annotated disassembly of a `--print-all-code` / `--trace-sim` log,
+# in the style of `perf annotate`.
+#
+# The pcs of the traced instructions are collected in array.array batches.
+# Every code object of the dump owns one hit counter per 2-byte slot of its
+# body and trampoline. A batch is mapped to the code objects dumped before it
+# with np.searchsorted over their start addresses, and counted with
+# np.bincount over the slot indexes. Batches are flushed before each new code
+# object is added, since it may reuse the addresses of an older one.
+#
+# The hottest code objects are then printed with their disassembly, including
+# the `--code-comments` lines, and the share of the object's hits of each
+# instruction:
+#
+#   $ cctest --print-all-code --code-comments -trace-sim test-interpreter-intrinsics/Call &> out
+#   $ annotate.py --top 5 out
+#
+# This tool requires NumPy.
+
+import argparse
+import array
+import re
+import time
+
+import numpy as np
+from prettytable import PrettyTable
+
+from codeindex import CodeDumpParser, CodeIndex
+from tracereader import TraceReader
+
+# Executed pcs buffered before they are counted
+BATCH_SIZE = 1 << 20
+
+# pc of a simulator trace line:
+#   0x00a0caf43be0   00000e37       lui       t3, 0x0   0000000000000000    (71)
+TRACE_PC_RE = re.compile(rb'\s*0x([0-9a-fA-F]+)[ \t]+[0-9a-fA-F]{8}[ \t]')
+
+
+# A code object of the dump and the hit counter slots of its address ranges
+class CodeObject:
+    __slots__ = ['func', 'lines', 'ranges', 'hits']
+
+    def __init__(self, func, lines):
+        self.func = func
+        # (pc, text) of each disassembly line, pc is None for comments
+        self.lines = lines
+        # (start, first slot, number of slots) of the body and trampoline
+        self.ranges = []
+        self.hits = 0
+
+    # Slot counting the instruction at pc, or None
+    def slot(self, pc):
+        for start, base, slots in self.ranges:
+            if start <= pc and (pc - start) >> 1 < slots:
+                return base + ((pc - start) >> 1)
+        return None
+
+
+class HotSpots:
+    def __init__(self):
+        # Maps every pc of the live code objects to its first slot
+        self.index = CodeIndex()
+        self.codes = []
+        # First slot of each code object, parallel to codes
+        self.bases = []
+        self.numSlots = 0
+        self.counts = np.zeros(1024, dtype=np.int64)
+        self.pending = array.array('Q')
+        self.total = 0
+        self.unknown = 0
+        self.lines = []
+        # searchsorted arrays of the index, rebuilt when it changes
+        self.starts = None
+        self.ends = None
+        self.slotBases = None
+
+    # Called by CodeDumpParser when a code object is complete, with the lines
+    # collected since the previous one
+    def addFunction(self, func):
+        self.flush()
+        code = CodeObject(func, self.lines)
+        self.lines = []
+        ranges = [(func.start, func.end)]
+        if func.trampoline is not None:
+            ranges.append((func.trampoline.start, func.trampoline.end))
+        for start, end in ranges:
+            if start == 0:
+                # no instructions
+                continue
+            slots = (max(end - start, 0) >> 1) + 1
+            code.ranges.append((start, self.numSlots, slots))
+            self.index.add(start, end, self.numSlots)
+            self.numSlots += slots
+        if not code.ranges:
+            return
+        self.codes.append(code)
+        self.bases.append(code.ranges[0][1])
+        self.starts = None
+
+    def addPC(self, pc):
+        self.pending.append(pc)
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    # Count the pending pcs in the slots of the code objects they belong to
+    def flush(self):
+        if not self.pending:
+            return
+        pcs = np.frombuffer(self.pending, dtype=np.uint64)
+        self.total += len(pcs)
+        if self.starts is None:
+            self.starts = np.array(self.index.starts, dtype=np.uint64)
+            self.ends = np.array(self.index.ends, dtype=np.uint64)
+            self.slotBases = np.array(self.index.objects, dtype=np.int64)
+        idx = np.searchsorted(self.starts, pcs, side='right') - 1
+        known = idx >= 0
+        idx[~known] = 0
+        if len(self.starts):
+            known &= pcs <= self.ends[idx]
+        else:
+            known[:] = False
+        idx = idx[known]
+        slots = self.slotBases[idx] + \
+            ((pcs[known] - self.starts[idx]) >> 1).astype(np.int64)
+        self.unknown += len(pcs) - len(slots)
+        if len(slots):
+            lo = int(slots.min())
+            hist = np.bincount(slots - lo)
+            if lo + len(hist) > len(self.counts):
+                counts = np.zeros(max(2 * len(self.counts), lo + len(hist)),
+                                  dtype=np.int64)
+                counts[:len(self.counts)] = self.counts
+                self.counts = counts
+            self.counts[lo:lo + len(hist)] += hist
+        self.pending = array.array('Q')
+
+    # Compute the total hits of every code object
+    def close(self):
+        self.flush()
+        if self.codes:
+            counts = self.counts
+            if len(counts) < self.numSlots:
+                counts = np.zeros(self.numSlots, dtype=np.int64)
+                counts[:len(self.counts)] = self.counts
+                self.counts = counts
+            totals = np.add.reduceat(counts[:self.numSlots], self.bases)
+            for code, hits in zip(self.codes, totals):
+                code.hits = int(hits)
+
+    def hottest(self, top):
+        ranked = sorted((code for code in self.codes if code.hits > 0),
+                        key=lambda code: code.hits, reverse=True)
+        return ranked[:top]
+
+
+# Parse the code dumps and count the traced pcs of logfile
+def collect(logfile):
+    hotSpots = HotSpots()
+    dump = CodeDumpParser(hotSpots)
+    inTraceSim = False
+    addPC = hotSpots.addPC
+    match = TRACE_PC_RE.match
+    with TraceReader(logfile) as reader:
+        for line in reader:
+            if inTraceSim:
+                m = match(line)
+                if m is not None:
+                    addPC(int(m.group(1), 16))
+                    continue
+            if dump.skipLine():
+                continue
+            words = line.split()
+            if len(words) == 0:
+                continue
+            if dump.feedHeader(words):
+                pass
+            elif words[0] == b"---":
+                inTraceSim = False
+            elif words[0] == b"CallImpl:":
+                inTraceSim = True
+            elif not inTraceSim and dump.inCode():
+                if words[0] == b"--":
+                    hotSpots.lines.append((None, line.rstrip().decode()))
+                elif words[0].startswith(b"0x") and len(words) >= 3:
+                    try:
+                        pc = int(words[0], 16)
+                        offset = int(words[1], 16)
+                    except ValueError:
+                        continue
+                    dump.addInstruction(pc, offset)
+                    hotSpots.lines.append((pc, line.rstrip().decode()))
+    hotSpots.close()
+    return hotSpots
+
+
+def printSummary(hotSpots, codes):
+    total = hotSpots.total or 1
+    tbl = PrettyTable(["Function", "Tier", "Address", "Hits", "Ratio"])
+    tbl.align["Function"] = "l"
+    for code in codes:
+        tbl.add_row([code.func.name, code.func.tier(), code.func.address,
+                     code.hits, "{:.2%}".format(code.hits / total)])
+    print(f"### {hotSpots.total} instructions traced, {hotSpots.unknown} "
+          f"outside the dumped code objects")
+    print(tbl)
+
+
+# Print the disassembly of code with the hits of each instruction, as a share
+# of the hits of the code object. Instructions below minPercent are left
+# blank.
+def printAnnotated(hotSpots, code, minPercent):
+    counts = hotSpots.counts
+    print()
+    print(f"### {code.func.name} ({code.func.tier()}, {code.func.address}): "
+          f"{code.hits} hits, "
+          "{:.2%} of all instructions".format(code.hits / (hotSpots.total or 1)))
+    print(" Percent      Hits")
+    for pc, text in code.lines:
+        hits = 0
+        if pc is not None:
+            slot = code.slot(pc)
+            if slot is not None:
+                hits = int(counts[slot])
+        percent = 100.0 * hits / code.hits
+        if hits > 0 and percent >= minPercent:
+            print(f"{percent:7.2f}% {hits:9d}  {text}")
+        else:
+            print(f"{'':18}  {text}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of code objects to annotate')
+    parser.add_argument('--min-percent', type=float, default=0.0,
+                        dest='min_percent',
+                        help='only show the hits of instructions with at '
+                             'least this share of their code object')
+    parser.add_argument('logfile', nargs=1,
+                        help="Log file, or '-' to read from stdin")
+    args = parser.parse_args()
+
+    startTime = time.time()
+    hotSpots = collect(args.logfile[0])
+    codes = hotSpots.hottest(args.top)
+    printSummary(hotSpots, codes)
+    for code in codes:
+        printAnnotated(hotSpots, code, args.min_percent)
+    print()
+    print('time cost -- {:.2f}s'.format(time.time() - startTime))
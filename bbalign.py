@@ -0,0 +1,178 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Alignment of the basic blocks of two code dumps of the same function, e.g.
+# the RISC-V and the MIPS build of a shortfruit.py case.
+#
+# Blocks are matched in three rounds, each with difflib's SequenceMatcher so
+# the order of the blocks is kept:
+#
+#   1. identical blocks: same label shape (the label with its numbers
+#      masked) and same contents, so a block inserted on one side and the
+#      renumbering after it do not pair the wrong blocks
+#   2. the remaining blocks by their code comment label
+#   3. what is left, in order, by label shape and content similarity,
+#      maximizing the total score of the pairs
+#
+# Contents are any comparable sequence per block; shortfruit.py uses the
+# instruction classes of costmodel.py, which are the same on both
+# architectures.
+#
+# Each pair gets a status, seen from the first dump:
+#
+#   same      matched, same size
+#   resized   matched, different size
+#   added     only in the first dump
+#   removed   only in the second dump
+
+import re
+from difflib import SequenceMatcher
+
+# unmatched runs up to this many block pairs are paired optimally, longer
+# ones greedily, looking up to WINDOW blocks ahead in the second dump
+MAX_DP_CELLS = 40000
+WINDOW = 16
+
+# minimum score for pairing blocks of unmatched runs: label shape match
+# counts 0.5, content similarity up to 1
+THRESHOLD = 0.5
+
+
+def label_shape(label):
+    return re.sub(r'[0-9]+', 'N', label)
+
+
+class BlockPair:
+    __slots__ = ['first', 'second', 'status']
+
+    def __init__(self, first, second, status):
+        self.first = first
+        self.second = second
+        self.status = status
+
+    def label(self):
+        return self.first if self.first is not None else self.second
+
+
+def _score(label1, label2, content1, content2):
+    score = 0.5 if label_shape(label1) == label_shape(label2) else 0
+    if content1 is not None and content2 is not None:
+        if content1 or content2:
+            score += SequenceMatcher(None, content1, content2,
+                                     autojunk=False).ratio()
+        else:
+            score += 1
+    return score
+
+
+# Pair the blocks of the unmatched runs i1..i2 and j1..j2 in order. Returns
+# (i, j) index pairs where either side may be None.
+def _pair_run(labels1, labels2, contents1, contents2, i1, i2, j1, j2):
+    def score(i, k):
+        return _score(labels1[i], labels2[k],
+                      contents1[i] if contents1 else None,
+                      contents2[k] if contents2 else None)
+
+    if (i2 - i1) * (j2 - j1) > MAX_DP_CELLS:
+        return _pair_run_greedy(score, i1, i2, j1, j2)
+
+    # best[i][k]: highest total (score - THRESHOLD) of an ordered pairing of
+    # the first i and k blocks of the runs
+    m, n = i2 - i1, j2 - j1
+    best = [[0.0] * (n + 1) for _ in range(m + 1)]
+    for i in range(1, m + 1):
+        row, prev = best[i], best[i - 1]
+        for k in range(1, n + 1):
+            gain = score(i1 + i - 1, j1 + k - 1) - THRESHOLD
+            row[k] = max(prev[k], row[k - 1],
+                         prev[k - 1] + gain if gain >= 0 else prev[k - 1])
+    pairs = []
+    i, k = m, n
+    while i > 0 or k > 0:
+        if i > 0 and k > 0:
+            gain = score(i1 + i - 1, j1 + k - 1) - THRESHOLD
+            if gain >= 0 and best[i][k] == best[i - 1][k - 1] + gain:
+                pairs.append((i1 + i - 1, j1 + k - 1))
+                i, k = i - 1, k - 1
+                continue
+        if i > 0 and best[i][k] == best[i - 1][k]:
+            pairs.append((i1 + i - 1, None))
+            i -= 1
+        else:
+            pairs.append((None, j1 + k - 1))
+            k -= 1
+    pairs.reverse()
+    return pairs
+
+
+# Pairing for runs too long for _pair_run: each block of the first run takes
+# the best scoring block within WINDOW blocks after the last pair
+def _pair_run_greedy(score, i1, i2, j1, j2):
+    pairs = []
+    j = j1
+    for i in range(i1, i2):
+        best, best_score = None, THRESHOLD
+        for k in range(j, min(j + WINDOW, j2)):
+            s = score(i, k)
+            if s > best_score or (best is None and s == best_score):
+                best, best_score = k, s
+        if best is None:
+            pairs.append((i, None))
+            continue
+        pairs.extend((None, k) for k in range(j, best))
+        pairs.append((i, best))
+        j = best + 1
+    pairs.extend((None, k) for k in range(j, j2))
+    return pairs
+
+
+def _align_labels(labels1, labels2, contents1, contents2, i1, i2, j1, j2):
+    matcher = SequenceMatcher(None, labels1[i1:i2], labels2[j1:j2],
+                              autojunk=False)
+    pairs = []
+    for tag, a1, a2, b1, b2 in matcher.get_opcodes():
+        if tag == 'equal':
+            pairs.extend(zip(range(i1 + a1, i1 + a2), range(j1 + b1, j1 + b2)))
+        else:
+            pairs.extend(_pair_run(labels1, labels2, contents1, contents2,
+                                   i1 + a1, i1 + a2, j1 + b1, j1 + b2))
+    return pairs
+
+
+# Align two block lists. labels are the block labels in code order; contents,
+# if given, are per-block sequences used to pair blocks whose labels differ
+# and to tell resized blocks. Returns (i, j) index pairs in code order, with
+# None on the side a block is missing from.
+def align(labels1, labels2, contents1=None, contents2=None):
+    if contents1 is None or contents2 is None:
+        return _align_labels(labels1, labels2, None, None,
+                             0, len(labels1), 0, len(labels2))
+    # identical blocks first, so renumbered labels do not pair the wrong
+    # blocks; the rest by label
+    tokens1 = [(label_shape(l), tuple(c)) for l, c in zip(labels1, contents1)]
+    tokens2 = [(label_shape(l), tuple(c)) for l, c in zip(labels2, contents2)]
+    matcher = SequenceMatcher(None, tokens1, tokens2, autojunk=False)
+    pairs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            pairs.extend(zip(range(i1, i2), range(j1, j2)))
+        else:
+            pairs.extend(_align_labels(labels1, labels2, contents1, contents2,
+                                       i1, i2, j1, j2))
+    return pairs
+
+
+# Like align(), but returns BlockPairs of labels with their status. sizes1
+# and sizes2 (e.g. instruction counts or costs) tell resized blocks.
+def diff_blocks(labels1, labels2, sizes1, sizes2, contents1=None, contents2=None):
+    result = []
+    for i, j in align(labels1, labels2, contents1, contents2):
+        if j is None:
+            result.append(BlockPair(labels1[i], None, 'added'))
+        elif i is None:
+            result.append(BlockPair(None, labels2[j], 'removed'))
+        else:
+            status = 'same' if sizes1[i] == sizes2[j] else 'resized'
+            result.append(BlockPair(labels1[i], labels2[j], status))
+    return result
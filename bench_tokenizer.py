@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Times the single-pass trace line tokenizer of analyze.py (traceline.py)
+# against the tokenizer it replaced, on the lines of a recorded trace, and
+# reports every line where the two disagree.
+#
+#   $ bench_tokenizer.py out.log
+
+import argparse
+import re
+import sys
+import time
+
+import traceline
+from mnemonics import isBranch, isControlFlow, isStore
+from traceline import InstructionTrace
+from tracereader import TraceReader
+
+
+# The tokenizer that InstructionTrace.fromLine() replaced, kept as it was.
+# It works on decoded lines and decodes each one from scratch.
+class BaselineInstructionTrace:
+    def __init__(self, line, pc, insn, operands, result, count):
+        self.line = line
+        self.pc = pc
+        self.insn = insn
+        self.operands = operands
+        self.result = result
+        self.count = count
+
+    # Create an InstructionTrace from a line of the simulator trace, or if it
+    # does not look like an instruction, return None
+    # A normal instruction looks like:
+    #   0x00a0caf43be0   00000e37       lui       t3, 0x0               0000000000000000    (71)    int64:0       uint64:0
+    @classmethod
+    def fromLine(cls, line):
+        words = line.split()
+        if len(words) < 3:
+            return None
+        if not words[0].startswith('0x') or len(words[1]) != 8:
+            return None
+
+        insn = words[2]
+        pc = None
+        insnHex = None
+        try:
+            pc = int(words[0], 16)
+            insnHex = int(words[1], 16)
+        except ValueError:
+            pass
+        countRes = re.search(r'\(([1-9][0-9]* *)\)', line)
+        if pc is None or insnHex is None or (countRes is None and
+                                             not isControlFlow(insn)):
+            return None
+
+        count = -1
+        if countRes is not None:
+            count = int(countRes.group(1))
+        operands = []
+        result = None
+        if insn == 'ret' or insn == 'ecall':  # No operands
+            pass
+        else:
+            resIdx = 3
+            for idx in range(3, len(words)):
+                resIdx = idx + 1
+                word = words[idx]
+                parts = re.split(r'[\(\)]', word)
+                for part in parts:
+                    if len(part) > 0:
+                        operands.append(part.strip(','))
+                # Check for end of operands with special case for the rounding mode
+                if not word.startswith('[') and not word.endswith(','):
+                    # This is the last operand
+                    break
+
+            # Skip over the branch/jump destination
+            if resIdx + 1 < len(words) and words[resIdx] == '->':
+                resIdx += 2
+
+            # The result is the next word after the operands
+            if resIdx < len(words) and not isStore(insn) and not isBranch(insn):
+                result = int(words[resIdx], 16)
+            if traceline.target == 'mips' and (insn == 'bal' or insn == 'jalr'):
+                result = pc + 8
+
+        return cls(line, pc, insn, operands, result, count)
+
+
+# BaselineInstructionTrace.fromLine(), with the exceptions it raises on
+# lines it cannot parse as the result
+def baselineFromLine(line):
+    try:
+        return BaselineInstructionTrace.fromLine(line)
+    except (ValueError, IndexError) as e:
+        return e
+
+
+# The fields both tokenizers produce for a line, or the repr of the exception
+# the baseline raised on it
+def fields(insn):
+    if insn is None or isinstance(insn, Exception):
+        return insn and repr(insn)
+    return (insn.pc, insn.insn, insn.operands, insn.result, insn.count)
+
+
+# Yield (line, baseline fields, single pass fields) for every line of sample
+# that the two tokenizers read differently
+def mismatches(sample):
+    for line in sample:
+        old = fields(baselineFromLine(line.decode(errors='replace')))
+        new = fields(InstructionTrace.fromLine(line))
+        if old != new:
+            yield line, old, new
+
+
+# Time both tokenizers on the lines of logfile and check they agree on every
+# line. The baseline read the log as text, so it gets the lines decoded; the
+# decoding is not timed.
+def benchmark(logfile, runs=5):
+    with TraceReader(logfile) as reader:
+        sample = list(reader)
+    textSample = [line.decode(errors='replace') for line in sample]
+
+    print(f"{len(sample)} lines, best of {runs} runs")
+    baseline = None
+    for name, fn, lines in [("baseline", baselineFromLine, textSample),
+                            ("single pass", InstructionTrace.fromLine, sample)]:
+        best = None
+        for _ in range(runs):
+            traceline.decodedInstructions.clear()
+            startTime = time.perf_counter()
+            for line in lines:
+                fn(line)
+            elapsed = time.perf_counter() - startTime
+            best = elapsed if best is None else min(best, elapsed)
+        if baseline is None:
+            baseline = best
+        print(f"{name:12} {best:.3f}s {len(sample) / best:12,.0f} lines/s "
+              f"{baseline / best:6.2f}x")
+
+    for line, old, new in mismatches(sample):
+        print(f"Mismatch: {line.decode(errors='replace').strip()} "
+              f"({old!r} != {new!r})")
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--target', default='riscv',
+                    help='Specify the target architecture')
+parser.add_argument('--runs', type=int, default=5,
+                    help='Number of timed runs of each tokenizer')
+parser.add_argument('logfile', help="Log file, or '-' to read from stdin")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    traceline.target = args.target
+    benchmark(args.logfile, args.runs)
+    sys.exit(0)
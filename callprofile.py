@@ -0,0 +1,171 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Simulated instruction profile for analyze.py --profile.
+#
+# analyze.py reconstructs every call and return from the simulator trace.
+# The instruction counts between them are attributed to the code objects on
+# the call stack:
+#
+#   inclusive  instructions from the call to the matching return, callees
+#              included; recursive calls only count in their outermost frame
+#   exclusive  inclusive minus the inclusive counts of the direct callees
+#
+# and written as
+#
+#   <prefix>.folded  one line per distinct call stack, `outer;inner count`
+#                    with its exclusive count, for flamegraph.pl or speedscope
+#   <prefix>.json    Chrome trace events (chrome://tracing, Perfetto), one
+#                    complete event per call, 1 instruction shown as 1us
+#
+# Events are buffered and written BATCH_SIZE at a time.
+#
+#   profile = CallProfile('out')
+#   profile.enter(func, count)
+#   profile.leave(count)
+#   profile.close(lastCount)
+#   profile.report()
+
+import json
+
+from prettytable import PrettyTable
+
+BATCH_SIZE = 4096
+
+
+# A node of the call tree, i.e. one distinct call stack
+class CallNode:
+    __slots__ = ['name', 'children', 'exclusive']
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.exclusive = 0
+
+
+class FunctionStats:
+    __slots__ = ['func', 'event', 'calls', 'inclusive', 'exclusive', 'active']
+
+    def __init__(self, func):
+        self.func = func
+        # the constant part of its trace events
+        self.event = json.dumps({'name': func.name, 'cat': func.tier(),
+                                 'ph': 'X', 'pid': 1, 'tid': 1})[:-1]
+        self.calls = 0
+        self.inclusive = 0
+        self.exclusive = 0
+        # number of frames of this function on the stack
+        self.active = 0
+
+
+class Frame:
+    __slots__ = ['stats', 'node', 'start', 'callees']
+
+    def __init__(self, stats, node, start):
+        self.stats = stats
+        self.node = node
+        self.start = start
+        # inclusive count of the direct callees
+        self.callees = 0
+
+
+def foldedName(name):
+    return name.replace(';', ':').replace('\n', ' ')
+
+
+class CallProfile:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.root = CallNode(None)
+        self.frames = []
+        self.stats = {}
+        self.total = 0
+        self.events = []
+        self.eventCount = 0
+        self.traceFile = open(prefix + '.json', 'w')
+        self.traceFile.write('[\n')
+
+    def enter(self, func, count):
+        stats = self.stats.get(func)
+        if stats is None:
+            stats = self.stats[func] = FunctionStats(func)
+        parent = self.frames[-1].node if self.frames else self.root
+        node = parent.children.get(func.name)
+        if node is None:
+            node = parent.children[func.name] = CallNode(func.name)
+        stats.calls += 1
+        stats.active += 1
+        self.frames.append(Frame(stats, node, count))
+
+    def leave(self, count):
+        frame = self.frames.pop()
+        inclusive = max(count - frame.start, 0)
+        exclusive = max(inclusive - frame.callees, 0)
+        stats = frame.stats
+        stats.active -= 1
+        if stats.active == 0:
+            stats.inclusive += inclusive
+        stats.exclusive += exclusive
+        frame.node.exclusive += exclusive
+        if self.frames:
+            self.frames[-1].callees += inclusive
+        else:
+            self.total += inclusive
+
+        self.events.append(f'{stats.event}, "ts": {frame.start}, '
+                           f'"dur": {inclusive}}}')
+        if len(self.events) >= BATCH_SIZE:
+            self.flushEvents()
+
+    def flushEvents(self):
+        if not self.events:
+            return
+        sep = ',\n' if self.eventCount > 0 else ''
+        self.traceFile.write(sep + ',\n'.join(self.events))
+        self.eventCount += len(self.events)
+        self.events = []
+
+    # Close the frames still on the stack at count and write the outputs
+    def close(self, count):
+        while self.frames:
+            self.leave(count)
+        self.flushEvents()
+        self.traceFile.write('\n]\n')
+        self.traceFile.close()
+
+        with open(self.prefix + '.folded', 'w') as f:
+            batch = []
+            stack = [(self.root, '')]
+            while stack:
+                node, path = stack.pop()
+                if node is not self.root:
+                    path = path + ';' + foldedName(node.name) if path \
+                        else foldedName(node.name)
+                    if node.exclusive > 0:
+                        batch.append(f'{path} {node.exclusive}\n')
+                        if len(batch) >= BATCH_SIZE:
+                            f.write(''.join(batch))
+                            batch = []
+                for child in reversed(list(node.children.values())):
+                    stack.append((child, path))
+            f.write(''.join(batch))
+
+    # Print the functions by exclusive count
+    def report(self, limit=50):
+        total = self.total or 1
+        tbl = PrettyTable(["Function", "Tier", "Calls", "Inclusive", "Incl %",
+                           "Exclusive", "Excl %"])
+        tbl.align["Function"] = "l"
+        ranked = sorted(self.stats.values(), key=lambda s: s.exclusive,
+                        reverse=True)
+        for stats in ranked[:limit]:
+            tbl.add_row([stats.func.name, stats.func.tier(), stats.calls,
+                         stats.inclusive,
+                         "{:.2%}".format(stats.inclusive / total),
+                         stats.exclusive,
+                         "{:.2%}".format(stats.exclusive / total)])
+        print(f"### Profile: {self.total} instructions in {len(self.stats)} "
+              f"functions, {self.eventCount} calls")
+        print(tbl)
+        print(f"### Wrote {self.prefix}.folded and {self.prefix}.json")
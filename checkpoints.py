@@ -0,0 +1,102 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Replay checkpoints for analyze.py.
+#
+# While analyze.py runs with --checkpoint it appends a stream of pickled
+# records to <logfile>.checkpoints:
+#
+#   ('header', meta)        log size/mtime and format version
+#   ('function', Function)  every code object, in the order it was parsed
+#   ('checkpoint', count, offset, numFunctions, state)
+#                           the analysis state after the instruction with
+#                           simulator count `count`; offset is the byte
+#                           offset of the next line, numFunctions the number
+#                           of code objects parsed so far. The state refers
+#                           to code objects by their start address.
+#
+# A query for instruction count N rebuilds the code index from the first
+# numFunctions code objects of the nearest checkpoint at or before N,
+# restores its state and replays only the log from its offset. The file is
+# written under a temporary name and renamed when the run completes.
+
+import bisect
+import os
+import pickle
+
+FORMAT_VERSION = 2
+
+
+def checkpointPath(logfile):
+    return logfile + '.checkpoints'
+
+
+def _logKey(logfile):
+    st = os.stat(logfile)
+    return {'size': st.st_size, 'mtime': st.st_mtime_ns,
+            'version': FORMAT_VERSION}
+
+
+class CheckpointWriter:
+    def __init__(self, logfile, interval, path=None):
+        self.path = path or checkpointPath(logfile)
+        self.tmp = self.path + '.tmp'
+        self.interval = interval
+        self.nextCount = interval
+        self.numFunctions = 0
+        self.file = open(self.tmp, 'wb')
+        self.__dump(('header', _logKey(logfile)))
+
+    # Each record is a separate pickle, so readers can stop at any record
+    def __dump(self, record):
+        pickle.dump(record, self.file, pickle.HIGHEST_PROTOCOL)
+
+    # Record a code object; returns its index
+    def addFunction(self, func):
+        index = self.numFunctions
+        self.numFunctions += 1
+        self.__dump(('function', func))
+        return index
+
+    def due(self, count):
+        return count >= self.nextCount
+
+    def write(self, count, offset, state):
+        self.__dump(('checkpoint', count, offset, self.numFunctions, state))
+        self.nextCount = count + self.interval
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp, self.path)
+
+
+class Checkpoints:
+    def __init__(self, logfile, path=None):
+        self.path = path or checkpointPath(logfile)
+        self.functions = []
+        self.counts = []
+        self.checkpoints = []
+        with open(self.path, 'rb') as f:
+            kind, meta = pickle.load(f)
+            if kind != 'header' or meta != _logKey(logfile):
+                raise ValueError(f'{self.path} does not match {logfile}; '
+                                 'rerun with --checkpoint')
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                if record[0] == 'function':
+                    self.functions.append(record[1])
+                else:
+                    self.counts.append(record[1])
+                    self.checkpoints.append(record[1:])
+
+    # (count, offset, numFunctions, state) of the last checkpoint at or
+    # before count, or None
+    def nearest(self, count):
+        idx = bisect.bisect_right(self.counts, count) - 1
+        if idx < 0:
+            return None
+        return self.checkpoints[idx]
@@ -0,0 +1,232 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Code objects from the `--print-all-code` dump, and a sorted interval index
+# used to map an arbitrary PC from the simulator trace to the code object
+# (function body or trampoline) that contains it.
+#
+# The ranges held by the index are always disjoint. When a new code object is
+# added whose range overlaps existing entries (because the code was recompiled
+# or moved and the address range was reused), the overlapping entries are
+# dropped, so a lookup always returns the most recently added code object.
+
+import bisect
+
+
+class Trampoline:
+    def __init__(self):
+        self.start = 0
+        self.end = 0
+
+    def __repr__(self):
+        return f"Trampoline: {self.start} - {self.end}"
+
+    def hasPC(self, pc):
+        if pc >= self.start and pc <= self.end:
+            return True
+        return False
+
+
+class Function:
+    def __init__(self, kind):
+        self.kind = kind
+        self.name = "unnamed"
+        self.compiler = ""
+        self.address = 0
+        self.trampoline = None
+        self.start = 0
+        self.end = 0
+
+    def __repr__(self):
+        return f"Function: {self.name}"
+
+    def __str__(self):
+        return self.name
+
+    # Returns a tuple with the first value indicating if the PC is within this
+    # function and the second indicating if it is in the trampoline
+    def hasPC(self, pc):
+        if pc >= self.start and pc <= self.end:
+            return True, False
+        elif self.trampoline is not None and self.trampoline.hasPC(pc):
+            return True, True
+        return False, False
+
+    # The compiler tier that produced this code, falling back to its kind
+    def tier(self):
+        return self.compiler or self.kind
+
+
+class CodeIndex:
+    def __init__(self):
+        # Parallel arrays sorted by start address. Ranges are inclusive at
+        # both ends, matching Function.hasPC.
+        self.starts = []
+        self.ends = []
+        self.objects = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __contains__(self, pc):
+        return self.lookup(pc) is not None
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends, self.objects))
+
+    # Add the range [start, end] for obj, evicting any entries that overlap it
+    def add(self, start, end, obj):
+        if end < start:
+            end = start
+        lo = bisect.bisect_left(self.starts, start)
+        # The entry just before may still extend into the new range
+        if lo > 0 and self.ends[lo - 1] >= start:
+            lo -= 1
+        hi = bisect.bisect_right(self.starts, end, lo)
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+        self.objects[lo:hi] = [obj]
+
+    # Add the body and trampoline ranges of a Function
+    def addFunction(self, func):
+        self.add(func.start, func.end, func)
+        if func.trampoline is not None:
+            self.add(func.trampoline.start, func.trampoline.end, func)
+
+    # Remove every entry that overlaps [start, end] and return the objects
+    # that were removed
+    def remove(self, start, end):
+        lo = bisect.bisect_left(self.starts, start)
+        if lo > 0 and self.ends[lo - 1] >= start:
+            lo -= 1
+        hi = bisect.bisect_right(self.starts, end, lo)
+        removed = self.objects[lo:hi]
+        del self.starts[lo:hi]
+        del self.ends[lo:hi]
+        del self.objects[lo:hi]
+        return removed
+
+    # Return (start, end, object) for the range containing pc, or None. Lets
+    # callers cache the range and skip the search for the following PCs.
+    def lookupRange(self, pc):
+        idx = bisect.bisect_right(self.starts, pc) - 1
+        if idx >= 0 and pc <= self.ends[idx]:
+            return self.starts[idx], self.ends[idx], self.objects[idx]
+        return None
+
+    # Return the code object containing pc, or None
+    def lookup(self, pc):
+        if pc is None:
+            return None
+        idx = bisect.bisect_right(self.starts, pc) - 1
+        if idx >= 0 and pc <= self.ends[idx]:
+            return self.objects[idx]
+        return None
+
+
+_HEX_DIGITS = frozenset(b'0123456789abcdefABCDEF')
+
+
+def isHexWord(word, length):
+    return len(word) == length and _HEX_DIGITS.issuperset(word)
+
+
+# Whether the split line is an instruction of a code dump:
+#   0x55a1aa324b38   178  00008393       mv        t2, ra
+def isCodeLine(words):
+    return len(words) >= 4 and words[0].startswith(b'0x') and \
+        isHexWord(words[2], 8)
+
+
+# Whether the split line is an instruction executed by the simulator:
+#   0x00a0caf43be0   00000e37       lui       t3, 0x0   0000000000000000    (71)
+def isTraceLine(words):
+    return len(words) >= 3 and words[0].startswith(b'0x') and \
+        isHexWord(words[1], 8)
+
+
+# Incremental parser for the code object sections of `--print-all-code`
+# output. Callers split each line and hand it to feedHeader(); instruction
+# lines inside a body or trampoline are passed to addInstruction(). Completed
+# code objects are added to the CodeIndex when their RelocInfo is reached,
+# and passed to onFinish if given.
+class CodeDumpParser:
+    def __init__(self, functions, onFinish=None):
+        self.functions = functions
+        self.onFinish = onFinish
+        self.current = None
+        self.inTrampoline = False
+        self.inBody = False
+        self.inSafePoints = False
+        self.skip = 0
+
+    # Returns True if this line must be ignored. Call it for every line,
+    # including blank ones, before feedHeader().
+    def skipLine(self):
+        if self.skip > 0:
+            self.skip = self.skip - 1
+            return True
+        return False
+
+    # Whether instruction lines currently belong to a code object
+    def inCode(self):
+        return self.inTrampoline or self.inBody
+
+    # Handle a code object header line. Returns False if words is not one.
+    def feedHeader(self, words):
+        key = words[0]
+        if key == b"kind":
+            # Start a new function
+            self.current = Function(words[2].decode())
+        elif key == b"kind:":
+            # Start a new function
+            self.current = Function(b' '.join(words[1:]).decode())
+        elif key == b"name":
+            self.current.name = words[2].decode()
+        elif key == b"compiler":
+            self.current.compiler = words[2].decode()
+        elif key == b"compiler:":
+            self.current.compiler = words[1].decode()
+        elif key == b"address":
+            self.current.address = words[2].decode()
+        elif key == b"Trampoline":
+            self.current.trampoline = Trampoline()
+            self.inTrampoline = True
+        elif key == b"Instructions":
+            self.inTrampoline = False
+            self.inBody = True
+        elif key == b"Safepoints" or key == b"Deoptimization":
+            self.inBody = False
+            self.inSafePoints = True
+        elif key == b"RelocInfo":
+            self.inSafePoints = False
+            # End this function
+            self.inBody = False
+            self.finish()
+            # skip the next line
+            self.skip = 1
+        else:
+            return False
+        return True
+
+    # Record an instruction of the code object being parsed
+    def addInstruction(self, pc, offset):
+        current = self.current
+        if offset == 0:
+            if self.inTrampoline:
+                current.trampoline.start = pc
+            elif self.inBody:
+                current.start = pc
+        else:
+            if self.inTrampoline:
+                current.trampoline.end = pc
+            elif self.inBody:
+                current.end = pc
+
+    def finish(self):
+        current = self.current
+        self.functions.addFunction(current)
+        if self.onFinish is not None:
+            self.onFinish(current)
+        self.current = None
@@ -5,12 +5,23 @@
 # found in the LICENSE file.
 
 import sys
+import array
+import io
+import os
 import re
 import time
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import argparse
 from prettytable import PrettyTable
 
+from tracereader import TraceReader, splitRanges
+
+# Fixed input of --benchmark, so that timings are comparable between runs
+BENCHMARK_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'testdata', 'convertible.log')
+
 def isIntN(x, n):
     limit = (1 << (n-1))
     return -limit <= x < limit
@@ -18,9 +29,19 @@ def isIntN(x, n):
 def isUIntN(x, n):
     return (x >> n) == 0
 
+# The value of the n-bit two's complement field x, e.g. of an immediate that
+# the disassembler prints in hex
+def signExtend(x, n):
+    sign = 1 << (n-1)
+    return (x ^ sign) - sign
+
+# x8 is printed as fp
 def is3BitReg(reg):
-    return bool(re.match(r'^f?(s[01]|a[0-5])$', reg))
+    return bool(re.match(r'^(fp|f?(s[01]|a[0-5]))$', reg))
 
+# Reference constraint table: one lambda per compressed form. This is the
+# readable specification; compressTo() uses the compiled predicates below and
+# --benchmark checks both against each other.
 instr2constraint = {}
 for instr in ['nop', 'ebreak', 'mv']:
     instr2constraint[instr] = ((lambda *args: True, 'c.' + instr), )
@@ -44,11 +65,20 @@ for instr in ['ld', 'fld', 'sd', 'fsd']:
                                     and is3BitReg(rs)
                                     and isUIntN(int(offset), 8)
                                     and (int(offset) & 0x7) == 0, 'c.'+instr))
-for instr in ['jalr', 'jr']:
-    instr2constraint[instr] = ((lambda *args: len(args) == 1, 'c.'+instr), )
+# jalr xN and jr xN, or with an explicit zero offset: jalr ra, 0(xN), jr 0(xN)
+for instr in ['jalr']:
+    instr2constraint[instr] = ((lambda *args: len(args) == 1
+                                    or (len(args) == 3 and args[0] == 'ra'
+                                        and args[1] == '0'), 'c.'+instr), )
+for instr in ['jr']:
+    instr2constraint[instr] = ((lambda *args: len(args) == 1
+                                    or (len(args) == 2 and args[0] == '0'),
+                                'c.'+instr), )
+for instr in ['ret']:
+    instr2constraint[instr] = ((lambda *args: True, 'c.jr'), )
 for instr in ['j']:
     instr2constraint[instr] = ((lambda *args: len(args) == 1
-                                    and isUIntN(int(args[0]), 12)
+                                    and isIntN(int(args[0]), 12)
                                     and (int(args[0]) & 0x1) == 0, 'c.'+instr), )
 for instr in ['beq', 'bne']:
     instr2constraint[instr] = ((lambda rs1, rs2, offset:
@@ -56,7 +86,7 @@ for instr in ['beq', 'bne']:
                                     and is3BitReg(rs1) \
                                     and isIntN(int(offset), 9)
                                     and (int(offset) & 0x1) == 0, 'c.'+instr), )
-for instr in ['and', 'or', 'xor', 'sub', 'andw', 'subw']:
+for instr in ['and', 'or', 'xor', 'sub', 'subw']:
     instr2constraint[instr] = ((lambda rd, rs1, rs2:
                                     rd == rs1 \
                                     and is3BitReg(rd) \
@@ -64,13 +94,15 @@ for instr in ['and', 'or', 'xor', 'sub', 'andw', 'subw']:
 for instr in ['andi']:
     instr2constraint[instr] = ((lambda rd, rs, imm: rd == rs \
                                     and is3BitReg(rd) \
-                                    and isIntN(int(imm, 16), 6), 'c.'+instr), )
+                                    and isIntN(signExtend(int(imm, 16), 12), 6),
+                                'c.'+instr), )
 for instr in ['li']:
     instr2constraint[instr] = ((lambda rd, imm: isIntN(int(imm), 6), 'c.'+instr), )
 for instr in ['lui']:
     instr2constraint[instr] = ((lambda rd, imm:
                                     (rd != 'zero_reg' and rd != 'sp')
-                                    and isUIntN(int(imm, 16), 6), 'c.'+instr), )
+                                    and isIntN(signExtend(int(imm, 16), 20), 6)
+                                    and int(imm, 16) != 0, 'c.'+instr), )
 for instr in ['slli']:
     instr2constraint[instr] = ((lambda rd, rs, shamt:
                                     rd == rs
@@ -102,6 +134,129 @@ for instr in ['addiw']:
 for instr in ['sext.w']:
     instr2constraint[instr] = ((lambda rd, rs: rd == rs, 'c.addiw'), )
 
+# Registers addressable by the 3-bit register fields of the C extension
+# (x8-x15 and f8-f15), i.e. the names matched by is3BitReg()
+RVC_REGS = frozenset(['fp', 's0', 's1', 'a0', 'a1', 'a2', 'a3', 'a4', 'a5',
+                      'fs0', 'fs1', 'fa0', 'fa1', 'fa2', 'fa3', 'fa4', 'fa5'])
+
+# Compiled form of instr2constraint. Each entry is
+#   (operand names, variadic, [(condition, compressed instruction), ...])
+# Conditions are Python expressions over the operand names, with RVC_REGS
+# available for register classes. Operand names of None mean the operands are
+# not unpacked, and conditions can only test the operands list itself. A
+# variadic entry returns '' on an operand count mismatch instead of raising,
+# like the `*args` lambdas above.
+#
+# Immediates are parsed by _uimm()/_simm() where the condition first tests
+# them, after the register checks, as the lambdas do. _simm() sign-extends
+# hex immediates printed as a width-bit field. A rule that fails on a
+# register check never parses its immediate, so a non-numeric immediate only
+# raises, and reports an "Error Line", where the lambda would raise too.
+def _uimm(name, bits, align=1, base=10):
+    value = f"{name}Imm"
+    return f"0 <= ({value} := int({name}, {base})) < {1 << bits}" + \
+        (f" and {value} & {align - 1} == 0" if align > 1 else "")
+
+def _simm(name, bits, align=1, base=10, width=None):
+    value = f"{name}Imm"
+    parse = f"int({name}, {base})"
+    if width is not None:
+        sign = 1 << (width - 1)
+        parse = f"({parse} ^ {sign}) - {sign}"
+    return f"{-(1 << (bits - 1))} <= ({value} := {parse}) " \
+        f"< {1 << (bits - 1)}" + \
+        (f" and {value} & {align - 1} == 0" if align > 1 else "")
+
+constraintSpecs = {}
+for instr in ['nop', 'ebreak', 'mv']:
+    constraintSpecs[instr] = (None, True, [("True", 'c.' + instr)])
+for instr in ['lw', 'flw', 'sw', 'fsw']:
+    constraintSpecs[instr] = (('rd', 'offset', 'rs'), False, [
+        (f"rs == 'sp' and {_uimm('offset', 8, 4)}", 'c.' + instr + 'sp'),
+        (f"rd in RVC_REGS and rs in RVC_REGS and {_uimm('offset', 7, 4)}",
+         'c.' + instr)])
+for instr in ['ld', 'fld', 'sd', 'fsd']:
+    constraintSpecs[instr] = (('rd', 'offset', 'rs'), False, [
+        (f"rs == 'sp' and {_uimm('offset', 9, 8)}", 'c.' + instr + 'sp'),
+        (f"rd in RVC_REGS and rs in RVC_REGS and {_uimm('offset', 8, 8)}",
+         'c.' + instr)])
+for instr in ['jalr']:
+    constraintSpecs[instr] = (None, True, [
+        ("len(operands) == 1 or (len(operands) == 3 and operands[0] == 'ra' "
+         "and operands[1] == '0')", 'c.' + instr)])
+for instr in ['jr']:
+    constraintSpecs[instr] = (None, True, [
+        ("len(operands) == 1 or (len(operands) == 2 and operands[0] == '0')",
+         'c.' + instr)])
+for instr in ['ret']:
+    constraintSpecs[instr] = (None, True, [("True", 'c.jr')])
+for instr in ['j']:
+    constraintSpecs[instr] = (('offset',), True, [
+        (_simm('offset', 12, 2), 'c.' + instr)])
+for instr in ['beq', 'bne']:
+    constraintSpecs[instr] = (('rs1', 'rs2', 'offset'), False, [
+        (f"rs2 == 'zero_reg' and rs1 in RVC_REGS and {_simm('offset', 9, 2)}",
+         'c.' + instr)])
+for instr in ['and', 'or', 'xor', 'sub', 'subw']:
+    constraintSpecs[instr] = (('rd', 'rs1', 'rs2'), False, [
+        ("rd == rs1 and rd in RVC_REGS and rs2 in RVC_REGS", 'c.' + instr)])
+for instr in ['andi']:
+    constraintSpecs[instr] = (('rd', 'rs', 'imm'), False, [
+        (f"rd == rs and rd in RVC_REGS and "
+         f"{_simm('imm', 6, base=16, width=12)}",
+         'c.' + instr)])
+for instr in ['li']:
+    constraintSpecs[instr] = (('rd', 'imm'), False, [
+        (_simm('imm', 6), 'c.' + instr)])
+for instr in ['lui']:
+    constraintSpecs[instr] = (('rd', 'imm'), False, [
+        (f"rd != 'zero_reg' and rd != 'sp' and "
+         f"{_simm('imm', 6, base=16, width=20)} and immImm != 0",
+         'c.' + instr)])
+for instr in ['slli']:
+    constraintSpecs[instr] = (('rd', 'rs', 'shamt'), False, [
+        (f"rd == rs and {_uimm('shamt', 6)}", 'c.' + instr)])
+for instr in ['srli', 'srai']:
+    constraintSpecs[instr] = (('rd', 'rs', 'shamt'), False, [
+        (f"rd == rs and rd in RVC_REGS and {_uimm('shamt', 6)}",
+         'c.' + instr)])
+for instr in ['add']:
+    constraintSpecs[instr] = (('rd', 'rs1', 'rs2'), False, [
+        ("rd == rs1", 'c.' + instr)])
+for instr in ['addi']:
+    constraintSpecs[instr] = (('rd', 'rs', 'imm'), False, [
+        (f"rd == rs and {_simm('imm', 6)}", 'c.addi'),
+        (f"rd == rs and rd == 'sp' and {_simm('imm', 10, 16)}", 'c.addi16sp'),
+        (f"rd in RVC_REGS and rs == 'sp' and {_uimm('imm', 10, 4)}",
+         'c.addi4spn')])
+for instr in ['addiw']:
+    constraintSpecs[instr] = (('rd', 'rs', 'imm'), False, [
+        (f"rd == rs and {_simm('imm', 6)}", 'c.' + instr)])
+for instr in ['sext.w']:
+    constraintSpecs[instr] = (('rd', 'rs'), False, [
+        ("rd == rs", 'c.addiw')])
+
+# Generate a single predicate function for one mnemonic. The function takes
+# the operand list and returns the compressed instruction or ''.
+def compileConstraint(spec):
+    names, variadic, rules = spec
+    src = ["def check(operands):"]
+    if names is not None:
+        if variadic:
+            src.append(f"    if len(operands) != {len(names)}:")
+            src.append("        return ''")
+        src.append(f"    {', '.join(names)}, = operands")
+    for cond, cInstr in rules:
+        src.append(f"    if {cond}:")
+        src.append(f"        return {cInstr!r}")
+    src.append("    return ''")
+    scope = {'RVC_REGS': RVC_REGS}
+    exec('\n'.join(src), scope)
+    return scope['check']
+
+instr2predicate = {instr: compileConstraint(spec)
+                   for instr, spec in constraintSpecs.items()}
+
 class Instruction:
 
     def __init__(self, line, pc, insnHex, insn, operands, offset):
@@ -119,6 +274,13 @@ class Instruction:
         return fn(*self.operands)
 
     def compressTo(self):
+        predicate = instr2predicate.get(self.insn)
+        if predicate is None:
+            return ''
+        return predicate(self.operands)
+
+    # Evaluate the reference lambda table, for --benchmark
+    def compressToReference(self):
         if self.insn in instr2constraint:
             cons = instr2constraint[self.insn]
             for fn, cInstr in cons:
@@ -153,15 +315,15 @@ class Instruction:
         if pc is None or offset is None or insnHex is None:
             return None
 
-        insn = words[3]
+        insn = words[3].decode()
         operands = []
         for idx in range(4, len(words)):
             word = words[idx]
-            parts = re.split('[\(\)]', word)
+            parts = re.split(rb'[\(\)]', word)
             for part in parts:
                 if len(part) > 0:
-                    operands.append(part.strip(','))
-            if not word.endswith(','):
+                    operands.append(part.strip(b',').decode())
+            if not word.endswith(b','):
                 # This is the last operand
                 break
         return cls(line, pc, insnHex, insn, operands, offset) if insn != 'constant' else None
@@ -183,42 +345,222 @@ def printTable(lst):
         tbl.add_row(row)
     print(tbl)
 
+# Count all and convertible instructions in [start, end) of the log. Verbose
+# output is written to out as it is found.
+def collectRange(logfile, start=0, end=None, verbose=False, out=sys.stdout):
+    rawCounter = Counter()
+    convertibleCounter = Counter()
+    with TraceReader(logfile, start, end) as reader:
+        for line in reader:
+            insn = Instruction.fromLine(line)
+            if insn is not None and not insn.isShort():
+                rawCounter[insn.insn] += 1
+                try:
+                    cInstr = insn.compressTo()
+                    if cInstr:
+                        if verbose:
+                            print(line.decode(), end = '', file=out)
+                            print('    ====> ', cInstr, file=out)
+                        convertibleCounter[insn.insn] += 1
+                except BaseException:
+                    print("Error Line: ", line.decode(), end = '', file=out)
+    return rawCounter, convertibleCounter
+
+# Same as collectRange, but compressibility is decided by rvdecode on the
+# instruction words instead of the disassembly text. Lines are only split,
+# never tokenized into operands, and are checked in vectorized batches.
+def collectRangeDecoded(logfile, start=0, end=None, verbose=False,
+                        out=sys.stdout, batch=1 << 16):
+    import numpy as np
+    import rvdecode
+
+    rawCounter = Counter()
+    convertibleCounter = Counter()
+    lines = []
+    names = []
+    insnWords = array.array('I')
+
+    def flush():
+        forms = rvdecode.compressTo(np.frombuffer(insnWords, dtype=np.uint32))
+        for i, name in enumerate(names):
+            rawCounter[name] += 1
+            form = forms[i]
+            if form:
+                if verbose:
+                    print(lines[i].decode(), end = '', file=out)
+                    print('    ====> ', rvdecode.CFORMS[form], file=out)
+                convertibleCounter[name] += 1
+        del lines[:]
+        del names[:]
+        del insnWords[:]
+
+    with TraceReader(logfile, start, end) as reader:
+        for line in reader:
+            words = line.split()
+            if len(words) < 4:
+                continue
+            try:
+                int(words[0], 16)
+                int(words[1], 16)
+                insnHex = int(words[2], 16)
+            except ValueError:
+                continue
+            if insnHex & 0x3 != 0x3 or words[3] == b'constant':
+                continue
+            names.append(words[3])
+            insnWords.append(insnHex)
+            if verbose:
+                lines.append(line)
+            if len(names) >= batch:
+                flush()
+    if names:
+        flush()
+    # Decode the mnemonics once, keeping the first-seen key order
+    return Counter({k.decode(): v for k, v in rawCounter.items()}), \
+        Counter({k.decode(): v for k, v in convertibleCounter.items()})
+
+# Same counts as collectRangeDecoded, from the code dump columns of the
+# tracecache.py cache directory path instead of the text
+def collectCached(path):
+    import numpy as np
+    import rvdecode
+    import tracecache
+
+    cache = tracecache.loadDir(path)
+    ops = np.asarray(cache.code['op'])
+    insns = np.asarray(cache.code['insn'])
+    keep = (insns & 0x3) == 0x3
+    constant = cache.opcodeIds.get('constant')
+    if constant is not None:
+        keep &= ops != constant
+    ops = ops[keep]
+    forms = rvdecode.compressTo(insns[keep])
+    return cache.opcodeCounter(ops), cache.opcodeCounter(ops[forms != 0])
+
+# Process pool worker: returns the partial counters and the buffered verbose
+# output for one byte range
+def collectChunk(logfile, start, end, verbose, decode=False):
+    out = io.StringIO()
+    collect = collectRangeDecoded if decode else collectRange
+    rawCounter, convertibleCounter = collect(logfile, start, end, verbose, out)
+    return rawCounter, convertibleCounter, out.getvalue()
+
+def collectParallel(logfile, jobs, verbose, decode=False):
+    rawCounter = Counter()
+    convertibleCounter = Counter()
+    # Use a few chunks per worker so one slow range does not stall the pool
+    ranges = splitRanges(logfile, jobs * 4)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        chunks = pool.map(collectChunk, repeat(logfile), [r[0] for r in ranges],
+                          [r[1] for r in ranges], repeat(verbose),
+                          repeat(decode))
+        # map() yields in submission order, so merging here keeps both the
+        # verbose output and the Counter key order identical to a serial run
+        for raw, convertible, text in chunks:
+            rawCounter.update(raw)
+            convertibleCounter.update(convertible)
+            sys.stdout.write(text)
+    return rawCounter, convertibleCounter
+
+# Evaluate fn on every instruction, mapping exceptions to the "Error Line"
+# case of the main loop
+def evaluateAll(insns, fn):
+    results = []
+    for insn in insns:
+        try:
+            results.append(fn(insn))
+        except BaseException:
+            results.append(None)
+    return results
+
+# Microbenchmark the compiled predicates against the reference lambda table on
+# the instructions of BENCHMARK_CORPUS, each evaluated `repeat` times per run,
+# and check they agree on every instruction
+def benchmark(logfile=BENCHMARK_CORPUS, runs=5, repeat=100):
+    with TraceReader(logfile) as reader:
+        insns = [insn for insn in map(Instruction.fromLine, reader)
+                 if insn is not None and not insn.isShort()]
+    if len(insns) == 0:
+        print("---- No Generated Code ----")
+        return
+    corpus = insns
+    insns = insns * repeat
+
+    tbl = PrettyTable(["Evaluator", "Best Time", "Instr/s", "Speedup"])
+    baseline = None
+    expected = None
+    for name, fn in [("lambda table", Instruction.compressToReference),
+                     ("compiled", Instruction.compressTo)]:
+        best = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            results = evaluateAll(insns, fn)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if expected is None:
+            expected = results
+            baseline = best
+        else:
+            for insn, old, new in zip(corpus, expected, results):
+                if old != new:
+                    print(f"Mismatch: {insn.line.decode().strip()} "
+                          f"({old!r} != {new!r})")
+        tbl.add_row([name, "{:.3f}s".format(best),
+                     "{:,.0f}".format(len(insns) / best),
+                     "{:.2f}x".format(baseline / best)])
+    print(f"{len(corpus)} instructions of {logfile} x {repeat}, "
+          f"best of {runs} runs")
+    print(tbl)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', action='store_true', default=False,
                         dest='verbose', help='print all convertible instructions')
-    parser.add_argument('logfile', nargs=1)
+    parser.add_argument('-j', '--jobs', type=int, default=1, dest='jobs',
+                        help='number of worker processes to parse the log with')
+    parser.add_argument('--decode', action='store_true', default=False,
+                        dest='decode',
+                        help='decide compressibility by decoding the '
+                             'instruction words (requires NumPy)')
+    parser.add_argument('--cache', default=None, metavar='DIR',
+                        help='read the code dump from a tracecache.py cache '
+                             'directory instead of a log, deciding '
+                             'compressibility like --decode')
+    parser.add_argument('--benchmark', action='store_true', default=False,
+                        dest='benchmark',
+                        help='time the compiled constraint predicates against '
+                             'the reference lambda table on '
+                             'testdata/convertible.log')
+    parser.add_argument('logfile', nargs='?',
+                        help="Log file, or '-' to read from stdin")
     args = parser.parse_args()
 
+    if args.benchmark:
+        benchmark()
+        sys.exit(0)
+    if args.cache is not None and (args.logfile is not None or args.verbose):
+        parser.error('--cache replaces the logfile and keeps no text for '
+                     '--verbose')
+    if args.cache is None and args.logfile is None:
+        parser.error('the following arguments are required: logfile')
+
     startTime = time.time()
-    rawCounter = Counter()
-    convertibleCounter = Counter()
 
-    logfile = open(args.logfile[0])
-    nextLine = logfile.readline()
     if args.verbose:
         print("Convertible Instructions:")
-    while nextLine:
-        line = nextLine
-        nextLine = logfile.readline()
-
-        words = line.split()
-        if len(words) == 0:
-            continue
-
-        insn = Instruction.fromLine(line)
-        if insn is not None and not insn.isShort():
-            rawCounter[insn.insn] += 1
-            try:
-                cInstr = insn.compressTo()
-                if cInstr:
-                    if args.verbose:
-                        print(line, end = '')
-                        print('    ====> ', cInstr)
-                    convertibleCounter[insn.insn] += 1
-            except BaseException:
-                print("Error Line: ", line, end = '')
-    logfile.close()
+    if args.cache is not None:
+        try:
+            rawCounter, convertibleCounter = collectCached(args.cache)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.jobs > 1 and args.logfile != '-':
+        rawCounter, convertibleCounter = collectParallel(args.logfile,
+                                                         args.jobs, args.verbose,
+                                                         args.decode)
+    else:
+        collect = collectRangeDecoded if args.decode else collectRange
+        rawCounter, convertibleCounter = collect(args.logfile,
+                                                 verbose=args.verbose)
 
     result = [(x, rawCounter[x], convertibleCounter[x]) for x in convertibleCounter]
     result.sort(key=lambda x: -x[2])
@@ -0,0 +1,101 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Persistent fuzzing corpus for shortfruit.py.
+#
+#   <dir>/queue/<hash>.js   cases that produced new coverage
+#   <dir>/coverage.txt      one coverage signature per line:
+#                           arch <TAB> basic block shape <TAB> opcode
+#   <dir>/findings.txt      one finding signature per line
+#
+# Coverage is the set of (arch, basic block shape, opcode) triples in the
+# `--print-code` output of both architectures, where the shape is the block
+# label with its numbers masked. A case is added to the queue if it produced a
+# triple that was not seen before. Findings are deduplicated by a signature of
+# their regressed blocks, so the same codegen difference is only reported
+# once.
+#
+# The files are only appended to, so worker processes can share a corpus:
+# each keeps its own view and picks up what the others added with sync().
+
+import hashlib
+import os
+
+
+class Corpus:
+    def __init__(self, root):
+        self.root = root
+        self.queue_dir = os.path.join(root, 'queue')
+        os.makedirs(self.queue_dir, exist_ok=True)
+        self.coverage = set()
+        self.findings = set()
+        self.entries = []
+        self.offsets = {}
+        self.sync()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    # Read the lines the other workers appended to name since the last call
+    def _read_new(self, name):
+        path = self._path(name)
+        try:
+            with open(path) as f:
+                f.seek(self.offsets.get(name, 0))
+                data = f.read()
+        except OSError:
+            return []
+        # a partial last line is read again next time
+        end = data.rfind('\n') + 1
+        self.offsets[name] = self.offsets.get(name, 0) + len(data[:end].encode('utf-8'))
+        return data[:end].splitlines()
+
+    def _append(self, name, lines):
+        if not lines:
+            return
+        # a single O_APPEND write keeps concurrent appends from interleaving
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        fd = os.open(self._path(name), os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def sync(self):
+        for line in self._read_new('coverage.txt'):
+            self.coverage.add(tuple(line.split('\t')))
+        self.findings.update(self._read_new('findings.txt'))
+        self.entries = sorted(name for name in os.listdir(self.queue_dir)
+                              if name.endswith('.js'))
+
+    # Record the coverage of source; returns True and adds it to the queue
+    # if it covered something new
+    def add(self, source, signatures):
+        new = [sig for sig in signatures if sig not in self.coverage]
+        if not new:
+            return False
+        self.coverage.update(new)
+        self._append('coverage.txt', ['\t'.join(sig) for sig in sorted(new)])
+        name = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16] + '.js'
+        path = os.path.join(self.queue_dir, name)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, path)
+        if name not in self.entries:
+            self.entries.append(name)
+        return True
+
+    def read(self, name):
+        with open(os.path.join(self.queue_dir, name)) as f:
+            return f.read()
+
+    # Record a finding; returns False if one with the same signature was
+    # already reported
+    def add_finding(self, signature):
+        if signature in self.findings:
+            return False
+        self.findings.add(signature)
+        self._append('findings.txt', [signature])
+        return True
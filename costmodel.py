@@ -0,0 +1,133 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Per-instruction cost model for the `--print-code` output of shortfruit.py.
+#
+# The costs of each architecture live in costs/<arch>.ini: a [costs] section
+# with the cost of each instruction class, an [opcodes] section mapping
+# mnemonics to classes, an [li] section describing how load-immediate
+# pseudo instructions expand, and an [operands] section listing the stores,
+# whose first operand is read rather than written. Mnemonics are resolved to
+# their cost once when the file is loaded, so pricing an instruction is a
+# single dict lookup.
+#
+#   model = load_model('riscv')
+#   model.line_cost('0x7f5a1c0c0040     0  00008393       mv        t2, ra')
+
+import configparser
+import os
+import sys
+
+COSTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'costs')
+
+# used when neither the opcode nor the file's [costs] default is known
+DEFAULT_COST = 1
+
+
+def _sext(value, bits):
+    value &= (1 << bits) - 1
+    sign = 1 << (bits - 1)
+    return (value ^ sign) - sign
+
+
+# Number of instructions needed to materialize imm with an add-immediate of
+# imm_bits signed bits and an upper-immediate load shifted by upper_shift.
+# Values beyond 32 bits are built from the upper part, a shift and an add of
+# the low part, like the assembler's li expansion.
+def li_length(imm, imm_bits, upper_shift):
+    imm = _sext(imm, 64)
+    if -(1 << (imm_bits - 1)) <= imm < (1 << (imm_bits - 1)):
+        return 1
+    if -(1 << 31) <= imm < (1 << 31):
+        return 1 if imm & ((1 << upper_shift) - 1) == 0 else 2
+    lo = _sext(imm, imm_bits)
+    hi = (imm - lo) >> imm_bits
+    while hi & 1 == 0:
+        hi >>= 1
+    return li_length(hi, imm_bits, upper_shift) + 1 + (1 if lo else 0)
+
+
+def _parse_imm(operands):
+    try:
+        return int(operands.split(',')[-1].strip(), 0)
+    except ValueError:
+        return None
+
+
+class CostModel:
+    def __init__(self, arch, path=None):
+        self.arch = arch
+        self.path = path or os.path.join(COSTS_DIR, f'{arch}.ini')
+        config = configparser.ConfigParser()
+        if not config.read(self.path):
+            raise FileNotFoundError(f'no cost model for {arch}: {self.path}')
+
+        classes = {name: int(cost) for name, cost in config['costs'].items()}
+        self.default = classes.get('default', DEFAULT_COST)
+        self.costs = {}
+        self.classes = {}
+        for opcode, cls in config['opcodes'].items():
+            if cls not in classes:
+                raise ValueError(f'{self.path}: {opcode} has unknown class {cls}')
+            opcode = sys.intern(opcode)
+            self.costs[opcode] = classes[cls]
+            self.classes[opcode] = sys.intern(cls)
+
+        # mnemonics whose first operand is a source, not the destination
+        operands = config['operands'] if config.has_section('operands') else {}
+        self.stores = frozenset(operands.get('stores', '').split())
+
+        li = config['li'] if config.has_section('li') else None
+        self.li_opcodes = frozenset(li.get('opcodes', 'li').split()) if li else frozenset()
+        self.li_cost = classes[li.get('class', 'alu')] if li else 0
+        self.li_imm_bits = li.getint('imm_bits', 12) if li else 0
+        self.li_upper_shift = li.getint('upper_shift', 12) if li else 0
+
+        # mnemonics seen that are not in the table, priced at the default
+        self.unknown = set()
+
+    # Number of machine instructions mnemonic stands for: the length of the
+    # expansion of li, 1 otherwise
+    def expansion(self, mnemonic, operands=''):
+        if mnemonic in self.li_opcodes:
+            imm = _parse_imm(operands)
+            if imm is not None:
+                return li_length(imm, self.li_imm_bits, self.li_upper_shift)
+        return 1
+
+    # Cost of one instruction given its mnemonic and operand text
+    def instr_cost(self, mnemonic, operands=''):
+        if mnemonic in self.li_opcodes:
+            return self.li_cost * self.expansion(mnemonic, operands)
+        cost = self.costs.get(mnemonic)
+        if cost is None:
+            self.unknown.add(mnemonic)
+            return self.default
+        return cost
+
+    # Instruction class of mnemonic, 'default' if it is not in the table
+    def instr_class(self, mnemonic):
+        return self.classes.get(mnemonic, 'default')
+
+    # Cost of one instruction line of filter_asm():
+    #   0x7f5a1c0c0040     0  00008393       mv        t2, ra
+    # Lines that are not instructions cost nothing.
+    def line_cost(self, line):
+        # drop the code comment, if any
+        line = line.split(';;', 1)[0]
+        words = line.split(None, 4)
+        if len(words) < 4 or not words[0].startswith('0x'):
+            return 0
+        return self.instr_cost(words[3], words[4] if len(words) > 4 else '')
+
+
+_models = {}
+
+
+# Return the (shared) cost model of arch
+def load_model(arch):
+    model = _models.get(arch)
+    if model is None:
+        model = _models[arch] = CostModel(arch)
+    return model
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Content-addressed disk cache of d8 `--print-code` dumps for shortfruit.py.
+#
+# Entries are keyed by a hash of the normalized JS source, the identity of the
+# d8 binary (resolved path, size and mtime, so a rebuild invalidates it) and
+# the d8 flags. Each entry stores the code dump and the per-block costs
+# computed from it. Reading an entry refreshes its mtime, and the cache is
+# trimmed to a size cap by removing the least recently used entries.
+#
+#   $ d8cache.py stats
+#   $ d8cache.py evict --max-size 512
+#   $ d8cache.py clear
+
+import argparse
+import hashlib
+import json
+import os
+
+DEFAULT_DIR = '.shortfruit-cache'
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# trim the cache after this many insertions
+EVICT_INTERVAL = 64
+
+
+def normalize_source(source):
+    # whitespace differences do not change the generated code
+    lines = [line.strip() for line in source.splitlines()]
+    return '\n'.join(line for line in lines if line)
+
+
+def binary_identity(prog):
+    path = os.path.realpath(prog)
+    st = os.stat(path)
+    return f'{os.path.abspath(prog)}:{path}:{st.st_size}:{st.st_mtime_ns}'
+
+
+class CodeCache:
+    def __init__(self, root=DEFAULT_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self.puts = 0
+        self.identities = {}
+
+    def key(self, source, prog, opts):
+        if prog not in self.identities:
+            self.identities[prog] = binary_identity(prog)
+        h = hashlib.sha256()
+        for part in [normalize_source(source), self.identities[prog]] + list(opts):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], f'{key}.json')
+
+    # Return the stored entry ({'asm': ..., 'costs': ..., ...}) or None
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write privately and rename, so concurrent workers never read a
+        # partial entry
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+        self.puts += 1
+        if self.puts % EVICT_INTERVAL == 0:
+            self.evict()
+
+    def entries(self):
+        result = []
+        if not os.path.isdir(self.root):
+            return result
+        for sub in os.listdir(self.root):
+            subdir = os.path.join(self.root, sub)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                result.append((st.st_mtime, st.st_size, path))
+        return result
+
+    # Remove least recently used entries until the cache fits in max_size.
+    # Returns the number of entries removed.
+    def evict(self, max_size=None):
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['stats', 'evict', 'clear'])
+    parser.add_argument('--dir', default=DEFAULT_DIR, help='cache directory')
+    parser.add_argument('--max-size', type=int,
+                        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help='size cap in MB for evict')
+    args = parser.parse_args()
+
+    cache = CodeCache(args.dir, args.max_size * 1024 * 1024)
+    if args.command == 'evict':
+        print(f'removed {cache.evict()} entries')
+    elif args.command == 'clear':
+        print(f'removed {cache.evict(0)} entries')
+    entries = cache.entries()
+    total = sum(size for _, size, _ in entries)
+    print(f'{len(entries)} entries, {total / (1024 * 1024):.1f} MB in {args.dir}')
+
+if __name__ == '__main__':
+    main()
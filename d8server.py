@@ -0,0 +1,124 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Long-lived d8 processes for shortfruit.py.
+#
+# Starting d8 for every generated case pays for process startup and snapshot
+# deserialization each time. A D8Server instead starts d8 once with a small
+# JS driver that reads case paths from stdin, runs each case in a fresh Realm
+# and then prints a delimiter line, so the `--print-code` output of each case
+# can be cut out of the shared stdout stream. A process that crashes or does
+# not answer within the timeout is killed and restarted.
+
+import atexit
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+
+DELIMITER = '### shortfruit: end of case '
+
+# Printed by the driver, instead of failing, when a case throws
+EXCEPTION = 'Exception: '
+
+DRIVER = '''\
+// Reads case paths from stdin, one per line, runs each in a fresh realm and
+// prints a delimiter after it.
+function main() {
+  while (true) {
+    const path = readline();
+    if (!path) break;
+    try {
+      const realm = Realm.create();
+      Realm.eval(realm, read(path));
+      Realm.dispose(realm);
+    } catch (e) {
+      print('%s' + e);
+    }
+    print('%s' + path);
+  }
+}
+// Keep the driver itself out of the --print-code output
+%%NeverOptimizeFunction(main);
+main();
+''' % (EXCEPTION, DELIMITER)
+
+
+class D8Error(Exception):
+    pass
+
+
+class D8Server:
+    driver_path = None
+
+    def __init__(self, prog, opts, timeout=60):
+        self.prog = prog
+        self.opts = opts
+        self.timeout = timeout
+        self.proc = None
+        self.lines = None
+
+    @classmethod
+    def driver(cls):
+        if cls.driver_path is None:
+            fd, path = tempfile.mkstemp(prefix='shortfruit-driver-', suffix='.js')
+            with os.fdopen(fd, 'w') as f:
+                f.write(DRIVER)
+            atexit.register(os.remove, path)
+            cls.driver_path = path
+        return cls.driver_path
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            [self.prog] + self.opts + [self.driver()],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # a reader thread lets compile() wait with a timeout
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read, args=(self.proc, self.lines),
+                         daemon=True).start()
+
+    @staticmethod
+    def _read(proc, lines):
+        for line in proc.stdout:
+            lines.put(line.decode('utf-8', errors='replace'))
+        lines.put(None)
+
+    def close(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    # Run one case and return its output. Raises D8Error, after restarting
+    # the process, if d8 crashed or hung.
+    def compile(self, filename):
+        if self.proc is None or self.proc.poll() is not None:
+            self.restart()
+        path = os.path.abspath(filename)
+        end = f'{DELIMITER}{path}\n'
+        try:
+            self.proc.stdin.write(f'{path}\n'.encode('utf-8'))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.restart()
+            raise D8Error(f'{self.prog} exited before running {filename}')
+
+        out = []
+        while True:
+            try:
+                line = self.lines.get(timeout=self.timeout)
+            except queue.Empty:
+                self.restart()
+                raise D8Error(f'{self.prog} timed out on {filename}')
+            if line is None:
+                self.restart()
+                raise D8Error(f'{self.prog} crashed on {filename}')
+            if line == end:
+                return ''.join(out)
+            out.append(line)
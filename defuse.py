@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Register def-use index of a `--trace-sim` log.
+#
+# `analyze.py --defuse` records every register write it decodes, i.e. the
+# destination register of each traced instruction with a result, in compact
+# per-register columns next to the log:
+#
+#   <logfile>.defuse/
+#     meta.json             log size/mtime, format version, registers and
+#                           their number of writes
+#     <reg>.count.bin       instruction count of each write (uint64, sorted)
+#     <reg>.pc.bin          pc of the writing instruction (uint64)
+#     <reg>.value.bin       value written (uint64)
+#     <reg>.byvalue.bin     the values sorted (uint64)
+#     <reg>.order.bin       index of each sorted value in the columns above
+#                           (uint64)
+#
+# While the log is analyzed, writes are collected in array.array buffers and
+# appended to the column files in batches, so memory stays bounded. When the
+# index is closed, each register is sorted on disk: runs of SORT_ROWS rows are
+# sorted in memory and then merged block by block. The columns are
+# memory-mapped for queries, which are binary searches:
+#
+#   $ analyze.py --defuse out > /dev/null
+#   $ defuse.py last a3 123456789 out      # last write of a3 before 123456789
+#   $ defuse.py value 0x105 out            # all writes of 0x105
+#
+# This tool requires NumPy.
+
+import argparse
+import array
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+COLUMNS = ['count', 'pc', 'value']
+
+# Buffered writes over all registers before they are appended to the files
+FLUSH_ROWS = 1 << 20
+
+# Rows of a column sorted in memory at a time
+SORT_ROWS = 1 << 24
+
+
+def indexDir(logfile):
+    return logfile + '.defuse'
+
+
+def _logKey(logfile):
+    st = os.stat(logfile)
+    return {'size': st.st_size, 'mtime': st.st_mtime_ns}
+
+
+def _columnPath(path, reg, column):
+    return os.path.join(path, f'{reg}.{column}.bin')
+
+
+def _isSorted(data):
+    for start in range(0, len(data), SORT_ROWS):
+        chunk = data[start:start + SORT_ROWS + 1]
+        if np.any(chunk[1:] < chunk[:-1]):
+            return False
+    return True
+
+
+# Merge the sorted runs [start, end) of keys, ordered by (key, order). Every
+# row up to the smallest last buffered row of the runs with unread rows is
+# final, so the buffers are merged and written up to it, and the runs they
+# emptied are refilled.
+def _mergeRuns(keys, order, runs, keysPath, orderPath):
+    block = max(SORT_ROWS // len(runs), 1 << 12)
+    pos = [start for start, end in runs]
+    bufKeys = [keys[0:0]] * len(runs)
+    bufOrder = [order[0:0]] * len(runs)
+    with open(keysPath, 'wb') as keysFile, open(orderPath, 'wb') as orderFile:
+        while True:
+            for r, (start, end) in enumerate(runs):
+                if len(bufKeys[r]) == 0 and pos[r] < end:
+                    stop = min(pos[r] + block, end)
+                    bufKeys[r] = np.array(keys[pos[r]:stop])
+                    bufOrder[r] = np.array(order[pos[r]:stop])
+                    pos[r] = stop
+            live = [r for r in range(len(runs)) if len(bufKeys[r])]
+            if not live:
+                break
+            bound = min(((bufKeys[r][-1], bufOrder[r][-1]) for r in live
+                         if pos[r] < runs[r][1]), default=None)
+            outKeys = []
+            outOrder = []
+            for r in live:
+                n = len(bufKeys[r])
+                if bound is not None:
+                    key, last = bound
+                    lo = int(np.searchsorted(bufKeys[r], key, side='left'))
+                    hi = int(np.searchsorted(bufKeys[r], key, side='right'))
+                    n = lo + int(np.searchsorted(bufOrder[r][lo:hi], last,
+                                                 side='right'))
+                outKeys.append(bufKeys[r][:n])
+                outOrder.append(bufOrder[r][:n])
+                bufKeys[r] = bufKeys[r][n:]
+                bufOrder[r] = bufOrder[r][n:]
+            mergedKeys = np.concatenate(outKeys)
+            mergedOrder = np.concatenate(outOrder)
+            idx = np.lexsort((mergedOrder, mergedKeys))
+            mergedKeys[idx].tofile(keysFile)
+            mergedOrder[idx].tofile(orderFile)
+
+
+# Sort the column of reg by value, writing the sorted values to the column
+# keysColumn and the index of each of them to orderColumn. Equal values keep
+# their order. At most SORT_ROWS rows are sorted in memory at a time.
+def _sortColumn(path, reg, column, keysColumn, orderColumn):
+    data = np.memmap(_columnPath(path, reg, column), dtype=np.uint64, mode='r')
+    rows = len(data)
+    keysPath = _columnPath(path, reg, keysColumn)
+    orderPath = _columnPath(path, reg, orderColumn)
+    if rows <= SORT_ROWS:
+        keys = np.array(data)
+        order = np.argsort(keys, kind='stable').astype(np.uint64)
+        keys[order].tofile(keysPath)
+        order.tofile(orderPath)
+        return
+    runKeysPath = _columnPath(path, reg, 'runkeys')
+    runOrderPath = _columnPath(path, reg, 'runorder')
+    runs = []
+    with open(runKeysPath, 'wb') as keysFile, \
+            open(runOrderPath, 'wb') as orderFile:
+        for start in range(0, rows, SORT_ROWS):
+            keys = np.array(data[start:start + SORT_ROWS])
+            order = np.argsort(keys, kind='stable')
+            keys[order].tofile(keysFile)
+            (order + start).astype(np.uint64).tofile(orderFile)
+            runs.append((start, start + len(keys)))
+    _mergeRuns(np.memmap(runKeysPath, dtype=np.uint64, mode='r'),
+               np.memmap(runOrderPath, dtype=np.uint64, mode='r'),
+               runs, keysPath, orderPath)
+    os.remove(runKeysPath)
+    os.remove(runOrderPath)
+
+
+class DefUseWriter:
+    # registers is the RegisterFile whose indexes are passed to add()
+    def __init__(self, logfile, registers, path=None):
+        self.logfile = logfile
+        self.registers = registers
+        self.path = path or indexDir(logfile)
+        os.makedirs(self.path, exist_ok=True)
+        # an interrupted run leaves the index invalid rather than half-written
+        metaFile = os.path.join(self.path, 'meta.json')
+        if os.path.exists(metaFile):
+            os.remove(metaFile)
+        for name in os.listdir(self.path):
+            if name.endswith('.bin'):
+                os.remove(os.path.join(self.path, name))
+        # per register index: (counts, pcs, values)
+        self.buffers = []
+        self.buffered = 0
+
+    def add(self, reg, count, pc, value):
+        buffers = self.buffers
+        if reg >= len(buffers):
+            buffers.extend((array.array('Q'), array.array('Q'),
+                            array.array('Q'))
+                           for _ in range(reg + 1 - len(buffers)))
+        counts, pcs, values = buffers[reg]
+        counts.append(count)
+        pcs.append(pc)
+        values.append(value)
+        self.buffered += 1
+        if self.buffered >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        names = {idx: name for name, idx in self.registers.names.items()}
+        for idx, columns in enumerate(self.buffers):
+            if len(columns[0]) == 0:
+                continue
+            name = names[idx]
+            for column, values in zip(COLUMNS, columns):
+                with open(_columnPath(self.path, name, column), 'ab') as f:
+                    values.tofile(f)
+                del values[:]
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        rows = {}
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith('.count.bin'):
+                reg = name[:-len('.count.bin')]
+                rows[reg] = self.__sortRegister(reg)
+        meta = _logKey(self.logfile)
+        meta['version'] = FORMAT_VERSION
+        meta['log'] = os.path.abspath(self.logfile)
+        meta['registers'] = rows
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    # Order the writes of reg by count, if the log did not, and write its
+    # value index. Returns the number of writes.
+    def __sortRegister(self, reg):
+        path = self.path
+        counts = np.memmap(_columnPath(path, reg, 'count'), dtype=np.uint64,
+                           mode='r')
+        rows = len(counts)
+        if not _isSorted(counts):
+            del counts
+            _sortColumn(path, reg, 'count', 'count.sorted', 'count.order')
+            order = np.memmap(_columnPath(path, reg, 'count.order'),
+                              dtype=np.uint64, mode='r')
+            for column in ['pc', 'value']:
+                data = np.memmap(_columnPath(path, reg, column),
+                                 dtype=np.uint64, mode='r')
+                with open(_columnPath(path, reg, column + '.sorted'), 'wb') as f:
+                    for start in range(0, rows, SORT_ROWS):
+                        data[order[start:start + SORT_ROWS]].tofile(f)
+                del data
+            del order
+            os.remove(_columnPath(path, reg, 'count.order'))
+            for column in COLUMNS:
+                os.replace(_columnPath(path, reg, column + '.sorted'),
+                           _columnPath(path, reg, column))
+        _sortColumn(path, reg, 'value', 'byvalue', 'order')
+        return rows
+
+
+class DefUseIndex:
+    def __init__(self, logfile, path=None):
+        self.path = path or indexDir(logfile)
+        try:
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            raise ValueError(f'no def-use index for {logfile}; run '
+                             'analyze.py --defuse first')
+        key = _logKey(logfile)
+        if self.meta.get('version') != FORMAT_VERSION or \
+                self.meta.get('size') != key['size'] or \
+                self.meta.get('mtime') != key['mtime']:
+            raise ValueError(f'{self.path} does not match {logfile}; rerun '
+                             'analyze.py --defuse')
+        self.columns = {}
+
+    def registers(self):
+        return sorted(self.meta['registers'])
+
+    # Memory-mapped column of reg
+    def column(self, reg, column):
+        key = (reg, column)
+        data = self.columns.get(key)
+        if data is None:
+            if self.meta['registers'].get(reg, 0) == 0:
+                data = np.zeros(0, dtype=np.uint64)
+            else:
+                data = np.memmap(_columnPath(self.path, reg, column),
+                                 dtype=np.uint64, mode='r')
+            self.columns[key] = data
+        return data
+
+    # (count, pc, value) of the last write of reg before instruction count,
+    # or None
+    def lastWrite(self, reg, count):
+        counts = self.column(reg, 'count')
+        idx = int(np.searchsorted(counts, count, side='left')) - 1
+        if idx < 0:
+            return None
+        return (int(counts[idx]), int(self.column(reg, 'pc')[idx]),
+                int(self.column(reg, 'value')[idx]))
+
+    # (count, reg, pc) of every write of value, in count order
+    def writesOfValue(self, value):
+        result = []
+        for reg in self.meta['registers']:
+            byValue = self.column(reg, 'byvalue')
+            lo = int(np.searchsorted(byValue, value, side='left'))
+            hi = int(np.searchsorted(byValue, value, side='right'))
+            if lo == hi:
+                continue
+            idx = np.sort(self.column(reg, 'order')[lo:hi])
+            counts = self.column(reg, 'count')[idx]
+            pcs = self.column(reg, 'pc')[idx]
+            result.extend((int(c), reg, int(p)) for c, p in zip(counts, pcs))
+        result.sort()
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+    last = sub.add_parser('last', help='last write of a register before an '
+                                       'instruction count')
+    last.add_argument('register')
+    last.add_argument('count', type=int)
+    last.add_argument('logfile')
+    value = sub.add_parser('value', help='all writes of a value')
+    value.add_argument('value', type=lambda v: int(v, 0))
+    value.add_argument('--limit', type=int, default=100,
+                       help='print at most this many writes')
+    value.add_argument('logfile')
+    info = sub.add_parser('info', help='number of writes per register')
+    info.add_argument('logfile')
+    args = parser.parse_args()
+
+    try:
+        index = DefUseIndex(args.logfile)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.command == 'last':
+        write = index.lastWrite(args.register, args.count)
+        if write is None:
+            print(f"{args.register} is not written before {args.count}")
+        else:
+            count, pc, value = write
+            print(f"{args.register} = {value:#x} written by {pc:#x} at {count}")
+    elif args.command == 'value':
+        writes = index.writesOfValue(args.value)
+        print(f"{len(writes)} writes of {args.value:#x}")
+        for count, reg, pc in writes[:args.limit]:
+            print(f"  {count}: {reg} written by {pc:#x}")
+    else:
+        for reg in index.registers():
+            print(f"{reg}: {index.meta['registers'][reg]} writes")
@@ -0,0 +1,233 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Test case reducer for the JavaScript generated by shortfruit.py.
+#
+# The generator emits one statement per line and puts the body of each
+# function and loop between a line ending in `{` and a line starting with
+# `}`. The reducer parses that into a tree of statements and repeats, until
+# nothing changes:
+#
+#   - delta debugging (ddmin) over the statements at each nesting depth,
+#     outermost first, so a removed loop takes its body with it
+#   - unwrapping loops into their body
+#   - replacing the expression of `var v = e;` / `v = e;` by `0` or by one of
+#     its operands, the shapes gen_expr_* produces
+#
+# All candidates of a step are tested in parallel in a process pool, and
+# the verdicts are memoized by the hash of the whitespace-normalized source,
+# so a candidate is never tested twice. The predicate must be a picklable
+# function taking the source text and returning True if it is interesting.
+# The pool processes are forked, so an initializer can reset state of the
+# caller that must not be shared with them, such as open pipes.
+#
+#   reduced = reduce_source(source, is_interesting, jobs=8)
+
+import hashlib
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from d8cache import normalize_source
+
+_ASSIGN = re.compile(r'^(\s*(?:var\s+)?\w+\s*=\s*)(.*?);\s*$')
+_LITERAL = re.compile(r'^-?[0-9.e+]+$')
+
+
+class Stmt:
+    __slots__ = ['start', 'end', 'depth', 'children']
+
+    def __init__(self, start, depth):
+        self.start = start
+        self.end = start
+        self.depth = depth
+        self.children = []
+
+    def is_block(self):
+        return self.end > self.start
+
+
+# Parse lines into a flat list of statements in source order. A statement
+# spans lines start..end inclusive; blocks include their closing line.
+def parse(lines):
+    stmts = []
+    stack = []
+    for i, line in enumerate(lines):
+        s = line.strip()
+        if not s:
+            continue
+        if s.startswith('}') and stack:
+            stack.pop().end = i
+            continue
+        stmt = Stmt(i, len(stack))
+        if stack:
+            stack[-1].children.append(stmt)
+        stmts.append(stmt)
+        if s.endswith('{'):
+            stack.append(stmt)
+    return stmts
+
+
+def _render(lines, removed=(), replaced=None):
+    drop = set()
+    for stmt in removed:
+        drop.update(range(stmt.start, stmt.end + 1))
+    out = []
+    for i, line in enumerate(lines):
+        if i in drop:
+            continue
+        if replaced and i in replaced:
+            line = replaced[i]
+            if line is None:
+                continue
+        out.append(line)
+    return '\n'.join(out)
+
+
+# Simpler expressions to try in place of expr, simplest first
+def _simpler_exprs(expr):
+    expr = expr.strip()
+    candidates = []
+    if expr != '0':
+        candidates.append('0')
+    if _LITERAL.match(expr):
+        return candidates
+    m = re.match(r'^(\S+) \? (\S+) : (\S+)$', expr)
+    if m:
+        return candidates + list(m.groups())
+    m = re.match(r'^(\S+) \S+ (\S+)$', expr)
+    if m:
+        return candidates + list(m.groups())
+    m = re.match(r'^(?:\+\+|--|[-~!])(\w+)$', expr)
+    if m:
+        return candidates + [m.group(1)]
+    return candidates
+
+
+def source_key(source):
+    return hashlib.sha256(normalize_source(source).encode('utf-8')).hexdigest()
+
+
+class Reducer:
+    def __init__(self, predicate, jobs=1, initializer=None):
+        self.predicate = predicate
+        self.jobs = jobs
+        self.pool = ProcessPoolExecutor(jobs, initializer=initializer) \
+            if jobs > 1 else None
+        self.memo = {}
+        self.tests = 0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    # Verdicts for sources, tested in parallel and memoized
+    def test_all(self, sources):
+        keys = [source_key(s) for s in sources]
+        todo = {}
+        for key, source in zip(keys, sources):
+            if key not in self.memo and key not in todo:
+                todo[key] = source
+        if todo:
+            self.tests += len(todo)
+            if self.pool is not None:
+                results = self.pool.map(self.predicate, todo.values())
+            else:
+                results = map(self.predicate, todo.values())
+            for key, result in zip(todo, results):
+                self.memo[key] = bool(result)
+        return [self.memo[key] for key in keys]
+
+    # Return the first interesting source among candidates, or None
+    def first(self, candidates):
+        for source, ok in zip(candidates, self.test_all(candidates)):
+            if ok:
+                return source
+        return None
+
+    # ddmin over the statements at depth; returns the reduced source or None
+    def reduce_depth(self, source, depth):
+        lines = source.split('\n')
+        items = [s for s in parse(lines) if s.depth == depth]
+        if not items:
+            return None
+        keep = items
+        n = 2
+        changed = False
+        while keep:
+            size = max(1, len(keep) // n)
+            chunks = [keep[i:i + size] for i in range(0, len(keep), size)]
+            removed = [s for s in items if s not in keep]
+            # keeping only one chunk first, then dropping one chunk
+            subsets = [chunk for chunk in chunks if len(chunk) < len(keep)]
+            complements = [[s for s in keep if s not in chunk]
+                           for chunk in chunks]
+            candidates = subsets + complements
+            sources = [_render(lines, removed + [s for s in keep if s not in c])
+                       for c in candidates]
+            found = None
+            for c, ok in zip(candidates, self.test_all(sources)):
+                if ok:
+                    found = c
+                    break
+            if found is not None:
+                n = 2 if found in subsets else max(n - 1, 2)
+                keep = found
+                changed = True
+                if not keep:
+                    break
+            elif n >= len(keep):
+                break
+            else:
+                n = min(2 * n, len(keep))
+        if not changed:
+            return None
+        return _render(lines, [s for s in items if s not in keep])
+
+    # Try unwrapping each loop and simplifying each assigned expression
+    def simplify(self, source):
+        lines = source.split('\n')
+        candidates = []
+        for stmt in parse(lines):
+            header = lines[stmt.start].strip()
+            if stmt.is_block() and header.startswith('for'):
+                candidates.append(_render(lines, replaced={stmt.start: None,
+                                                           stmt.end: None}))
+                continue
+            m = _ASSIGN.match(lines[stmt.start])
+            if m is None:
+                continue
+            for expr in _simpler_exprs(m.group(2)):
+                candidates.append(_render(
+                    lines, replaced={stmt.start: f'{m.group(1)}{expr};'}))
+        return self.first(candidates)
+
+    def reduce(self, source):
+        while True:
+            changed = False
+            depth = 0
+            while True:
+                lines = source.split('\n')
+                if not any(s.depth == depth for s in parse(lines)):
+                    break
+                reduced = self.reduce_depth(source, depth)
+                if reduced is not None:
+                    source = reduced
+                    changed = True
+                depth += 1
+            while True:
+                simpler = self.simplify(source)
+                if simpler is None:
+                    break
+                source = simpler
+                changed = True
+            if not changed:
+                return source
+
+
+def reduce_source(source, predicate, jobs=1, initializer=None):
+    reducer = Reducer(predicate, jobs, initializer)
+    try:
+        return reducer.reduce(source)
+    finally:
+        reducer.close()
@@ -0,0 +1,71 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Instruction classes of the mnemonics in a `--trace-sim` log, and the layout
+# of a traced instruction line, shared by analyze.py and tracecache.py so
+# both agree on which words are operands and which instructions have a
+# result:
+#
+#   0x00a0caf43be0   00000e37       lui       t3, 0x0   0000000000000000    (71)
+#   <pc>             <word>         <insn>    <operands> [-> <target>] [<result>] (<count>)
+
+
+def isStore(s):
+    if s in ["sd", "sw", "sh", "sb", "fsd", "fsw"]:
+        return True
+    return False
+
+
+def isBranch(s):
+    if s[0] == 'b':
+        return True
+    return False
+
+
+def isJump(s):
+    if s == "j" or s == "jr":
+        return True
+    return False
+
+
+def isJumpAndLink(s):
+    if s[0:3] == "jal" or s == "bal":
+        return True
+    return False
+
+
+def isControlFlow(s):
+    return isBranch(s) or isJump(s) or isJumpAndLink(s) or s == 'ecall'
+
+
+# Whether the simulator prints a result after the operands of insn
+def hasResult(insn):
+    return insn != 'ret' and insn != 'ecall' and \
+        not isStore(insn) and not isBranch(insn)
+
+
+# The operand words of a split trace line
+def operandWords(words):
+    insn = words[2]
+    if insn == b'ret' or insn == b'ecall':  # No operands
+        return []
+    result = []
+    for word in words[3:]:
+        result.append(word)
+        # Check for end of operands with special case for the rounding mode
+        if not word.startswith(b'[') and not word.endswith(b','):
+            # This is the last operand
+            break
+    return result
+
+
+# Index of the result word of a split trace line with numOperands operand
+# words, after the optional `-> target`. The word is absent if the index is
+# past the end or the word is the `(count)`.
+def resultIndex(words, numOperands):
+    idx = 3 + numOperands
+    # Skip over the branch/jump destination
+    if idx + 1 < len(words) and words[idx] == b'->':
+        idx += 2
+    return idx
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Vectorized opcode statistics over the columns written by tracecache.py.
+#
+# Histograms are computed with np.bincount over the interned opcode ids, and
+# the 16- vs 32-bit split uses the same `insn & 0x3` test as
+# Instruction.insnSize() in collect-convertible.py, applied to whole columns
+# at once. Per-instruction predicates such as convertibility are
+# evaluated once per distinct instruction word (np.unique) and broadcast back
+# through the inverse index, so their cost depends on the number of distinct
+# words, not on the length of the trace.
+#
+#   $ opstats.py out.log          # executed instructions (--trace-sim)
+#   $ opstats.py --code out.log   # disassembled instructions (--print-all-code)
+
+import argparse
+import time
+
+import numpy as np
+from prettytable import PrettyTable
+
+import rvdecode
+import tracecache
+
+
+# Number of occurrences of each opcode id
+def opcodeHistogram(ops, numOpcodes=0):
+    return np.bincount(ops, minlength=numOpcodes)
+
+
+# Boolean mask of the 16-bit (compressed) instruction words
+def shortMask(insns):
+    return (insns & 0x3) != 0x3
+
+
+# Per-opcode histograms of the 32-bit and the 16-bit instructions in one
+# pass. Each entry is keyed as (op << 1) | is32Bit so a single bincount
+# produces both, and the columns are processed in cache-sized chunks with
+# reused buffers so no full-length temporaries are allocated.
+def sizeHistograms(ops, insns, numOpcodes=0, chunk=1 << 20):
+    numOpcodes = max(numOpcodes, int(ops.max()) + 1 if len(ops) else 0)
+    hist = np.zeros(2 * numOpcodes, dtype=np.int64)
+    key = np.empty(min(chunk, len(ops)), dtype=np.intp)
+    tmp = np.empty(len(key), dtype=np.uint32)
+    for start in range(0, len(ops), chunk):
+        o = ops[start:start + chunk]
+        k = key[:len(o)]
+        t = tmp[:len(o)]
+        np.bitwise_and(insns[start:start + chunk], 0x3, out=t)
+        np.equal(t, 0x3, out=t)
+        k[...] = o
+        k <<= 1
+        k |= t
+        hist += np.bincount(k, minlength=len(hist))
+    hist = hist.reshape(numOpcodes, 2)
+    return hist[:, 1], hist[:, 0]
+
+
+# Per-opcode histogram restricted to the entries selected by mask
+def maskedHistogram(ops, mask, numOpcodes=0):
+    return np.bincount(ops[mask], minlength=numOpcodes)
+
+
+# Evaluate predicate on each distinct instruction word and return a boolean
+# mask over all of insns. predicate takes an array of unique words and returns
+# a boolean array of the same length.
+def uniqueMask(insns, predicate):
+    words, inverse = np.unique(insns, return_inverse=True)
+    return np.asarray(predicate(words), dtype=bool)[inverse.reshape(-1)]
+
+
+# Mask of the 32-bit words that have a C-extension equivalent
+def convertibleMask(insns):
+    return uniqueMask(insns, rvdecode.isCompressible)
+
+
+class OpcodeStats:
+    def __init__(self, ops, insns, opcodes, convertible=False):
+        self.opcodes = opcodes
+        self.total = len(ops)
+        longHistogram, self.shortHistogram = \
+            sizeHistograms(ops, insns, len(opcodes))
+        self.histogram = longHistogram + self.shortHistogram
+        self.numShort = int(self.shortHistogram.sum())
+        self.convertibleHistogram = None
+        if convertible:
+            self.convertibleHistogram = maskedHistogram(
+                ops, convertibleMask(insns), len(self.histogram))
+
+    # (mnemonic, count, short count, convertible count) rows ordered by
+    # decreasing count. The convertible count is None unless requested.
+    def rows(self):
+        order = np.argsort(-self.histogram, kind='stable')
+        conv = self.convertibleHistogram
+        return [(self.opcodes[i], int(self.histogram[i]),
+                 int(self.shortHistogram[i]),
+                 int(conv[i]) if conv is not None else None)
+                for i in order if self.histogram[i] > 0]
+
+
+def printStats(stats, top):
+    if stats.total == 0:
+        print("---- No Instructions ----")
+        return
+
+    summary = PrettyTable(["Summary", "All Instr", "16-bit", "32-bit", "16-bit Ratio"])
+    summary.add_row(["", stats.total, stats.numShort,
+                     stats.total - stats.numShort,
+                     "{:.2%}".format(float(stats.numShort) / stats.total)])
+    print(summary)
+
+    header = ["Instruction", "Count", "Ratio", "16-bit"]
+    if stats.convertibleHistogram is not None:
+        header.extend(["Convertible", "Conv. Ratio"])
+    tbl = PrettyTable(header)
+    for name, count, short, convertible in stats.rows()[:top]:
+        row = [name, count, "{:.2%}".format(float(count) / stats.total), short]
+        if convertible is not None:
+            row.extend([convertible,
+                        "{:.2%}".format(float(convertible) / count)])
+        tbl.add_row(row)
+    print(tbl)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--code', action='store_true', default=False,
+                        help='statistics over the disassembled code objects '
+                             'instead of the executed instructions')
+    parser.add_argument('--convertible', action='store_true', default=False,
+                        help='also count the 32-bit instructions that have a '
+                             'C-extension equivalent')
+    parser.add_argument('--top', type=int, default=50,
+                        help='number of opcodes to list')
+    parser.add_argument('logfile', nargs=1)
+    args = parser.parse_args()
+
+    cache = tracecache.load(args.logfile[0])
+    table = cache.code if args.code else cache.trace
+
+    startTime = time.time()
+    stats = OpcodeStats(table['op'], table['insn'], cache.opcodes,
+                        args.convertible)
+    elapsed = time.time() - startTime
+
+    printStats(stats, args.top)
+    rate = stats.total / elapsed if elapsed > 0 else float('inf')
+    print('time cost -- {:.2f}s ({:,.0f} instr/s)'.format(elapsed, rate))
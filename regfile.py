@@ -0,0 +1,88 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Register file of the simulated core, as tracked by analyze.py.
+#
+# Values live in a flat list indexed by register number, with None for
+# registers whose value has not been seen yet. Register names are interned
+# to their index once, when an instruction is first decoded, so recording
+# the result of a traced instruction is a single list store instead of a
+# dict update keyed by a freshly decoded string. Names that are not known in
+# advance get the next free index.
+#
+#   registers = RegisterFile()
+#   sp = registers.index('sp')
+#   registers.values[sp] = 0x7ff000
+#   registers['sp']  # 0x7ff000
+
+RISCV_REGISTERS = (
+    ['zero_reg', 'ra', 'sp', 'gp', 'tp', 't0', 't1', 't2', 'fp', 's1'] +
+    [f'a{i}' for i in range(8)] + [f's{i}' for i in range(2, 12)] +
+    [f't{i}' for i in range(3, 7)] +
+    [f'ft{i}' for i in range(8)] + ['fs0', 'fs1'] +
+    [f'fa{i}' for i in range(8)] + [f'fs{i}' for i in range(2, 12)] +
+    [f'ft{i}' for i in range(8, 12)])
+
+MIPS_REGISTERS = (
+    ['zero_reg', 'at', 'v0', 'v1'] + [f'a{i}' for i in range(4)] +
+    [f't{i}' for i in range(10)] + [f's{i}' for i in range(8)] +
+    ['k0', 'k1', 'gp', 'sp', 'fp', 'ra'] + [f'f{i}' for i in range(32)])
+
+
+class RegisterFile:
+    __slots__ = ['names', 'values']
+
+    def __init__(self):
+        self.names = {}
+        for name in RISCV_REGISTERS + MIPS_REGISTERS:
+            self.names.setdefault(name, len(self.names))
+        self.values = [None] * len(self.names)
+
+    # Index of register name, allocating one if it is new
+    def index(self, name):
+        idx = self.names.get(name)
+        if idx is None:
+            idx = len(self.names)
+            self.names[name] = idx
+            self.values.append(None)
+        return idx
+
+    # Value of the register at idx; raises KeyError if it is not known yet
+    def read(self, idx):
+        value = self.values[idx]
+        if value is None:
+            raise KeyError(self.__name(idx))
+        return value
+
+    def __name(self, idx):
+        for name, i in self.names.items():
+            if i == idx:
+                return name
+        return None
+
+    def __getitem__(self, name):
+        idx = self.names.get(name)
+        if idx is None or self.values[idx] is None:
+            raise KeyError(name)
+        return self.values[idx]
+
+    def __setitem__(self, name, value):
+        self.values[self.index(name)] = value
+
+    def __contains__(self, name):
+        idx = self.names.get(name)
+        return idx is not None and self.values[idx] is not None
+
+    # Forget all values, keeping the interned indexes
+    def clear(self):
+        self.values = [None] * len(self.names)
+
+    # Known registers as a {name: value} dict, e.g. for checkpoints
+    def toDict(self):
+        return {name: self.values[idx] for name, idx in self.names.items()
+                if self.values[idx] is not None}
+
+    def update(self, registers):
+        for name, value in registers.items():
+            self[name] = value
@@ -0,0 +1,215 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# RV64GC instruction word decoder and C-extension compressibility checker.
+#
+# Everything here operates on NumPy arrays of 32-bit instruction words, so a
+# whole column of a trace or code dump is decoded with a handful of bit
+# operations instead of splitting disassembly text. Scalars work too; wrap
+# them with np.asarray().
+#
+# Immediates are always decoded from the instruction word, so e.g. `andi`,
+# `lui` and `li` are compared against their real signed values regardless of
+# how the disassembler happened to print them (hex or decimal).
+#
+#   f = decode(words)
+#   forms = compressTo(words)        # index into CFORMS, 0 if not compressible
+#   names = CFORMS_ARRAY[forms]
+
+import numpy as np
+
+# Register numbers
+ZERO = 0
+RA = 1
+SP = 2
+
+# Major opcodes
+OP_LOAD = 0x03
+OP_LOAD_FP = 0x07
+OP_IMM = 0x13
+OP_IMM_32 = 0x1b
+OP_STORE = 0x23
+OP_STORE_FP = 0x27
+OP = 0x33
+OP_LUI = 0x37
+OP_32 = 0x3b
+OP_BRANCH = 0x63
+OP_JALR = 0x67
+OP_JAL = 0x6f
+OP_SYSTEM = 0x73
+
+EBREAK = 0x00100073
+
+# Mnemonics as printed by the V8 disassembler for the instructions the checker
+# knows about. Pseudo-instructions (mv, li, nop, j, jr, sext.w) are resolved
+# the same way the disassembler does.
+MNEMONICS = ['', 'lw', 'flw', 'sw', 'fsw', 'ld', 'fld', 'sd', 'fsd', 'jalr',
+             'jr', 'j', 'beq', 'bne', 'and', 'or', 'xor', 'sub', 'subw',
+             'andi', 'li', 'lui', 'slli', 'srli', 'srai', 'add', 'addi',
+             'addiw', 'sext.w', 'mv', 'nop', 'ebreak']
+MNEMONIC_IDS = {name: i for i, name in enumerate(MNEMONICS)}
+MNEMONICS_ARRAY = np.array(MNEMONICS, dtype=object)
+
+CFORMS = ['', 'c.lwsp', 'c.lw', 'c.flwsp', 'c.flw', 'c.swsp', 'c.sw',
+          'c.fswsp', 'c.fsw', 'c.ldsp', 'c.ld', 'c.fldsp', 'c.fld', 'c.sdsp',
+          'c.sd', 'c.fsdsp', 'c.fsd', 'c.jalr', 'c.jr', 'c.j', 'c.beq', 'c.bne',
+          'c.and', 'c.or', 'c.xor', 'c.sub', 'c.subw', 'c.andi', 'c.li',
+          'c.lui', 'c.slli', 'c.srli', 'c.srai', 'c.add', 'c.addi',
+          'c.addi16sp', 'c.addi4spn', 'c.addiw', 'c.mv', 'c.nop', 'c.ebreak']
+CFORM_IDS = {name: i for i, name in enumerate(CFORMS)}
+CFORMS_ARRAY = np.array(CFORMS, dtype=object)
+
+
+def _sext(value, bits):
+    value = value.astype(np.int64)
+    sign = np.int64(1) << (bits - 1)
+    return (value ^ sign) - sign
+
+
+class Fields:
+    def __init__(self, words):
+        w = np.asarray(words, dtype=np.uint32).astype(np.int64)
+        self.word = w
+        self.opcode = w & 0x7f
+        self.rd = (w >> 7) & 0x1f
+        self.funct3 = (w >> 12) & 0x7
+        self.rs1 = (w >> 15) & 0x1f
+        self.rs2 = (w >> 20) & 0x1f
+        self.funct7 = w >> 25
+        self.immI = _sext(w >> 20, 12)
+        self.immS = _sext(((w >> 25) << 5) | ((w >> 7) & 0x1f), 12)
+        self.immB = _sext((((w >> 31) & 0x1) << 12) | (((w >> 7) & 0x1) << 11) |
+                          (((w >> 25) & 0x3f) << 5) | (((w >> 8) & 0xf) << 1), 13)
+        self.immJ = _sext((((w >> 31) & 0x1) << 20) | (((w >> 12) & 0xff) << 12) |
+                          (((w >> 20) & 0x1) << 11) | (((w >> 21) & 0x3ff) << 1), 21)
+        # The 20-bit upper immediate field as printed for lui
+        self.immU = (w >> 12) & 0xfffff
+        self.shamt = (w >> 20) & 0x3f
+
+
+def decode(words):
+    return Fields(words)
+
+
+# Return the mnemonic id (index into MNEMONICS) of every word, 0 for
+# instructions the checker does not handle
+def mnemonics(words, f=None):
+    f = f if f is not None else decode(words)
+    op, f3, f7 = f.opcode, f.funct3, f.funct7
+    isAddi = (op == OP_IMM) & (f3 == 0)
+    isAddiw = (op == OP_IMM_32) & (f3 == 0)
+    isJalr = (op == OP_JALR) & (f3 == 0)
+    conds = [
+        (op == OP_LOAD) & (f3 == 2),
+        (op == OP_LOAD_FP) & (f3 == 2),
+        (op == OP_STORE) & (f3 == 2),
+        (op == OP_STORE_FP) & (f3 == 2),
+        (op == OP_LOAD) & (f3 == 3),
+        (op == OP_LOAD_FP) & (f3 == 3),
+        (op == OP_STORE) & (f3 == 3),
+        (op == OP_STORE_FP) & (f3 == 3),
+        isJalr & (f.rd == ZERO) & (f.immI == 0),
+        isJalr,
+        (op == OP_JAL) & (f.rd == ZERO),
+        (op == OP_BRANCH) & (f3 == 0),
+        (op == OP_BRANCH) & (f3 == 1),
+        (op == OP) & (f3 == 7) & (f7 == 0),
+        (op == OP) & (f3 == 6) & (f7 == 0),
+        (op == OP) & (f3 == 4) & (f7 == 0),
+        (op == OP) & (f3 == 0) & (f7 == 0x20),
+        (op == OP_32) & (f3 == 0) & (f7 == 0x20),
+        (op == OP_IMM) & (f3 == 7),
+        isAddi & (f.rd == ZERO) & (f.rs1 == ZERO) & (f.immI == 0),
+        isAddi & (f.rs1 == ZERO),
+        isAddi & (f.immI == 0),
+        isAddi,
+        op == OP_LUI,
+        (op == OP_IMM) & (f3 == 1) & ((f7 >> 1) == 0),
+        (op == OP_IMM) & (f3 == 5) & ((f7 >> 1) == 0),
+        (op == OP_IMM) & (f3 == 5) & ((f7 >> 1) == 0x10),
+        (op == OP) & (f3 == 0) & (f7 == 0),
+        isAddiw & (f.immI == 0),
+        isAddiw,
+        f.word == EBREAK,
+    ]
+    names = ['lw', 'flw', 'sw', 'fsw', 'ld', 'fld', 'sd', 'fsd', 'jr', 'jalr',
+             'j', 'beq', 'bne', 'and', 'or', 'xor', 'sub', 'subw', 'andi',
+             'nop', 'li', 'mv', 'addi', 'lui', 'slli', 'srli', 'srai', 'add',
+             'sext.w', 'addiw', 'ebreak']
+    return np.select(conds, [MNEMONIC_IDS[n] for n in names], 0)
+
+
+def _uimm(value, bits, align=1):
+    return (value >= 0) & (value < (1 << bits)) & ((value & (align - 1)) == 0)
+
+
+def _simm(value, bits, align=1):
+    return (value >= -(1 << (bits - 1))) & (value < (1 << (bits - 1))) & \
+        ((value & (align - 1)) == 0)
+
+
+def _isRvcReg(reg):
+    # x8-x15 / f8-f15, addressable by the 3-bit register fields
+    return (reg >= 8) & (reg < 16)
+
+
+# Return the compressed form id (index into CFORMS) of every word, 0 if it
+# has no C-extension equivalent. The rules follow constraintSpecs in
+# collect-convertible.py, evaluated on decoded fields; `ret` is decoded as
+# `jr ra`, and like constraintSpecs there is no `andw`, which RV64 lacks.
+def compressTo(words, f=None):
+    f = f if f is not None else decode(words)
+    mn = mnemonics(words, f)
+    rd, rs1, rs2 = f.rd, f.rs1, f.rs2
+    rdC, rs1C, rs2C = _isRvcReg(rd), _isRvcReg(rs1), _isRvcReg(rs2)
+    rules = []
+
+    def rule(mnemonic, cond, cform):
+        rules.append(((mn == MNEMONIC_IDS[mnemonic]) & cond, CFORM_IDS[cform]))
+
+    # Loads use rd as the data register, stores rs2
+    for name, imm, data in [('lw', f.immI, rd), ('flw', f.immI, rd),
+                            ('sw', f.immS, rs2), ('fsw', f.immS, rs2)]:
+        rule(name, (rs1 == SP) & _uimm(imm, 8, 4), 'c.' + name + 'sp')
+        rule(name, _isRvcReg(data) & rs1C & _uimm(imm, 7, 4), 'c.' + name)
+    for name, imm, data in [('ld', f.immI, rd), ('fld', f.immI, rd),
+                            ('sd', f.immS, rs2), ('fsd', f.immS, rs2)]:
+        rule(name, (rs1 == SP) & _uimm(imm, 9, 8), 'c.' + name + 'sp')
+        rule(name, _isRvcReg(data) & rs1C & _uimm(imm, 8, 8), 'c.' + name)
+    # c.jalr/c.jr only exist with a zero offset and rd of ra/zero_reg
+    rule('jalr', (rd == RA) & (f.immI == 0) & (rs1 != ZERO), 'c.jalr')
+    rule('jr', rs1 != ZERO, 'c.jr')
+    rule('j', _simm(f.immJ, 12, 2), 'c.j')
+    for name in ['beq', 'bne']:
+        rule(name, (rs2 == ZERO) & rs1C & _simm(f.immB, 9, 2), 'c.' + name)
+    for name in ['and', 'or', 'xor', 'sub', 'subw']:
+        rule(name, (rd == rs1) & rdC & rs2C, 'c.' + name)
+    rule('andi', (rd == rs1) & rdC & _simm(f.immI, 6), 'c.andi')
+    rule('li', _simm(f.immI, 6), 'c.li')
+    # c.lui takes a non-zero 6-bit signed immediate for bits [17:12]
+    luiImm = _sext(f.immU, 20)
+    rule('lui', (rd != ZERO) & (rd != SP) & _simm(luiImm, 6) & (luiImm != 0),
+         'c.lui')
+    rule('slli', (rd == rs1), 'c.slli')
+    for name in ['srli', 'srai']:
+        rule(name, (rd == rs1) & rdC, 'c.' + name)
+    rule('add', rd == rs1, 'c.add')
+    rule('addi', (rd == rs1) & _simm(f.immI, 6), 'c.addi')
+    rule('addi', (rd == SP) & (rs1 == SP) & _simm(f.immI, 10, 16), 'c.addi16sp')
+    rule('addi', rdC & (rs1 == SP) & _uimm(f.immI, 10, 4), 'c.addi4spn')
+    rule('addiw', (rd == rs1) & _simm(f.immI, 6), 'c.addiw')
+    rule('sext.w', rd == rs1, 'c.addiw')
+    rule('mv', True, 'c.mv')
+    rule('nop', True, 'c.nop')
+    rule('ebreak', True, 'c.ebreak')
+
+    forms = np.select([cond for cond, _ in rules],
+                      [form for _, form in rules], 0)
+    # Already compressed words stay as they are
+    return np.where((f.word & 0x3) == 0x3, forms, 0)
+
+
+# Boolean mask of the words that have a compressed equivalent
+def isCompressible(words):
+    return compressTo(words) != 0
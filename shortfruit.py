@@ -1,14 +1,29 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
 from random import choice, choices, expovariate, randint, randrange, shuffle, uniform
+import argparse
 import configparser
+import hashlib
+import multiprocessing
 import os
+import random
 import re
 import string
 import subprocess
 import sys
+import tempfile
+import threading
 from prettytable import PrettyTable
 
+from bbalign import diff_blocks
+from corpus import Corpus
+from costmodel import load_model
+from d8cache import DEFAULT_MAX_SIZE, CodeCache
+from d8server import EXCEPTION, D8Error, D8Server
+from jsreduce import parse, reduce_source
+from uarch import block_cycles, load_core
+
 PATH_TO_V8_RISCV = '../../out/mips64el_debug/d8'
 PATH_TO_V8_MIPS = '../../out/riscv64.sim/d8'
 
@@ -22,6 +37,18 @@ def random_id():
         string.ascii_lowercase +
         string.digits, k=8))
 
+def new_case_id():
+    # reserve the id by creating its source file exclusively, so concurrent
+    # workers can never pick the same case
+    while True:
+        id = random_id()
+        try:
+            fd = os.open(f'case-{id}.js', os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return id
+
 def filter_asm(asm):
     in_instr_block = False
 
@@ -47,201 +74,139 @@ def filter_asm(asm):
 
         yield line
 
-def instr_cost(line):
-    # TODO: more specific cost estimation for riscv & mips
-    return 1
-
-    parts = re.split('[ \t,]', line)
-    instr = parts[0]
-    cost_load_store = 2
-    cost_fpu_load_store = cost_load_store
-    cost_alu = 1
-    cost_fpu = 1
-    cost_branch = 3
-    cost_mul = cost_branch
-    cost_div = 8    # TODO: clang generates long instr. sequences instead of div
-    cost_call = 20  # TODO: builtins
-    cost_ret = 2
-    cost_ebreak = 0 # should be unreachable if no undef. behavior is generated
-
-    if instr == 'li':
-        imm = int(parts[-1])
-        if imm >= -2048 and imm < 2048: # addi
-            return cost_alu
-        elif (imm & 0xFFF) == 0:        # lui
-            return cost_alu
-        else:                           # lui + addi
-            return cost_alu * 2
-
-    return {
-        'add': cost_alu,
-        'addi': cost_alu,
-        'addiw': cost_alu,
-        'addw': cost_alu,
-        'and': cost_alu,
-        'andi': cost_alu,
-        'beq': cost_branch,
-        'beqz': cost_branch,
-        'bge': cost_branch,
-        'bgeu': cost_branch,
-        'bgez': cost_branch,
-        'bgt': cost_branch,
-        'bgtu': cost_branch,
-        'bgtz': cost_branch,
-        'ble': cost_branch,
-        'bleu': cost_branch,
-        'blez': cost_branch,
-        'blt': cost_branch,
-        'bltu': cost_branch,
-        'bltz': cost_branch,
-        'bne': cost_branch,
-        'bnez': cost_branch,
-        'call': cost_call,
-        'div': cost_div,
-        'divu': cost_div,
-        'divuw': cost_div,
-        'divw': cost_div,
-        'ebreak': cost_ebreak,
-        'fadd.d': cost_fpu,
-        'fadd.s': cost_fpu,
-        'fcvt.d.l': cost_fpu,
-        'fcvt.d.lu': cost_fpu,
-        'fcvt.d.s': cost_fpu,
-        'fcvt.d.w': cost_fpu,
-        'fcvt.d.wu': cost_fpu,
-        'fcvt.l.d': cost_fpu,
-        'fcvt.l.s': cost_fpu,
-        'fcvt.lu.d': cost_fpu,
-        'fcvt.lu.s': cost_fpu,
-        'fcvt.s.d': cost_fpu,
-        'fcvt.s.l': cost_fpu,
-        'fcvt.s.lu': cost_fpu,
-        'fcvt.s.w': cost_fpu,
-        'fcvt.s.wu': cost_fpu,
-        'fcvt.w.d': cost_fpu,
-        'fcvt.w.s': cost_fpu,
-        'fcvt.wu.d': cost_fpu,
-        'fcvt.wu.s': cost_fpu,
-        'fdiv.d': cost_fpu,
-        'fdiv.s': cost_fpu,
-        'feq.d': cost_fpu,
-        'feq.s': cost_fpu,
-        'fge.d': cost_fpu,
-        'fge.s': cost_fpu,
-        'fgt.d': cost_fpu,
-        'fgt.s': cost_fpu,
-        'fld': cost_fpu_load_store,
-        'fle.d': cost_fpu,
-        'fle.s': cost_fpu,
-        'flt.d': cost_fpu,
-        'flt.s': cost_fpu,
-        'flw': cost_fpu_load_store,
-        'fmadd.d': cost_fpu,
-        'fmadd.s': cost_fpu,
-        'fmul.d': cost_fpu,
-        'fmul.s': cost_fpu,
-        'fmv.d': cost_fpu,
-        'fmv.d.x': cost_fpu,
-        'fmv.s': cost_fpu,
-        'fmv.s.x': cost_fpu,
-        'fmv.w.x': cost_fpu,
-        'fmv.x.s': cost_fpu,
-        'fneg.d': cost_fpu,
-        'fneg.s': cost_fpu,
-        #'fnmsub.s': cost_fpu, # not found yet
-        'fnmsub.d': cost_fpu,
-        'fsd': cost_fpu_load_store,
-        'fsub.d': cost_fpu,
-        'fsub.s': cost_fpu,
-        'fsw': cost_fpu_load_store,
-        'j': cost_branch,
-        'jr': cost_branch,
-        'lb': cost_load_store,
-        'lbu': cost_load_store,
-        'ld': cost_load_store,
-        'lh': cost_load_store,
-        'lhu': cost_load_store,
-        'lui': cost_alu,
-        'lw': cost_load_store,
-        'lwu': cost_load_store,
-        'mul': cost_mul,
-        'mulh': cost_mul,
-        'mulhu': cost_mul,
-        'mulw': cost_mul,
-        'mv': cost_alu,
-        'neg': cost_alu,
-        'negw': cost_alu,
-        'nop': cost_alu,
-        'not': cost_alu,
-        'or': cost_alu,
-        'ori': cost_alu,
-        'rem': cost_div,
-        'remu': cost_div,
-        'remuw': cost_div,
-        'remw': cost_div,
-        'ret': cost_ret,
-        'sb': cost_load_store,
-        'sd': cost_load_store,
-        'seqz': cost_alu,
-        'sext': cost_alu,
-        'sext.w': cost_alu,
-        'sgt': cost_alu,
-        'sgtu': cost_alu,
-        'sgtz': cost_alu,
-        'sh': cost_load_store,
-        'sll': cost_alu,
-        'slli': cost_alu,
-        'slliw': cost_alu,
-        'sllw': cost_alu,
-        'slt': cost_alu,
-        'slti': cost_alu,
-        'sltiu': cost_alu,
-        'sltu': cost_alu,
-        'snez': cost_alu,
-        'sra': cost_alu,
-        'srai': cost_alu,
-        'sraiw': cost_alu,
-        'sraw': cost_alu,
-        'srl': cost_alu,
-        'srli': cost_alu,
-        'srliw': cost_alu,
-        'srlw': cost_alu,
-        'sub': cost_alu,
-        'subw': cost_alu,
-        'sw': cost_load_store,
-        'xor': cost_alu,
-        'xori': cost_alu,
-    }[instr]
-
-def compile(arch, filename):
+def instr_cost(line, arch='riscv'):
+    return load_model(arch).line_cost(line)
+
+D8_OPTS = [
+    '--allow-natives-syntax',
+    '--print-code',
+    '--code-comments',
+]
+
+# long-lived d8 processes per arch, when running with --server; None for an
+# arch whose server does not compile like a one-shot d8
+d8_servers = None
+
+# arches whose d8 server has compiled a case like a one-shot d8
+checked_servers = set()
+
+# on-disk cache of code dumps and costs, when running with --cache
+code_cache = None
+
+# bump when get_cost() changes, so cached costs are recomputed
+COST_VERSION = 3
+
+# core model to estimate block cycles with, when running with --core;
+# otherwise blocks cost the sum of their instruction costs
+core_model = None
+
+# cost_version() per arch, for the loaded cost table and core model
+cost_versions = {}
+
+# Version of the costs get_cost() computes for arch. It includes a hash of
+# the cost table and core model files, so cached costs are recomputed when
+# either is edited.
+def cost_version(arch):
+    version = cost_versions.get(arch)
+    if version is None:
+        paths = [load_model(arch).path]
+        if core_model is not None:
+            paths.append(core_model.path)
+        h = hashlib.sha256()
+        for path in paths:
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        core = f'{core_model.name}:' if core_model is not None else ''
+        version = f'{COST_VERSION}:{core}{h.hexdigest()[:16]}'
+        cost_versions[arch] = version
+    return version
+
+def d8_path(arch):
     if arch == 'riscv':
-        prog = PATH_TO_V8_RISCV
+        return PATH_TO_V8_RISCV
     elif arch == 'mips':
-        prog = PATH_TO_V8_MIPS
+        return PATH_TO_V8_MIPS
     else:
         assert False, 'unsupported arch'
 
-    opts = [
-        '--allow-natives-syntax',
-        '--print-code',
-        '--code-comments',
-        filename
-    ]
-
-    res = subprocess.check_output([prog] + opts).decode('utf-8')
+def compile(arch, filename):
+    prog = d8_path(arch)
+
+    if d8_servers is not None:
+        if arch not in d8_servers:
+            d8_servers[arch] = D8Server(prog, D8_OPTS)
+        server = d8_servers[arch]
+        if server is not None:
+            try:
+                res = server.compile(filename)
+                if arch in checked_servers or threw(res):
+                    return res
+                return check_server(arch, filename, res)
+            except D8Error as e:
+                # the server has been restarted; reproduce the failure (or not)
+                # with a one-shot d8 so it is reported as before
+                print(f'{e}, retrying with a new process', file=sys.stderr)
+
+    res = subprocess.check_output([prog] + D8_OPTS + [filename]).decode('utf-8')
     return res
 
-def get_cost(asm):
+# A case runs in a Realm of a d8 server that has already run other cases, so
+# its code could differ from that of a one-shot d8. The first case of each
+# server that does not throw is also compiled by a one-shot d8; if the block
+# costs differ, the server is dropped for that arch. Returns the output of
+# the one-shot d8.
+def check_server(arch, filename, res):
+    prog = d8_path(arch)
+    try:
+        expected = subprocess.check_output(
+            [prog] + D8_OPTS + [filename]).decode('utf-8')
+    except subprocess.CalledProcessError:
+        expected = None
+    if expected is not None and get_cost(res, arch) == get_cost(expected, arch):
+        checked_servers.add(arch)
+        return expected
+    print(f'{prog} compiles {filename} differently in a --server Realm '
+          'than in a one-shot d8; not using --server for it', file=sys.stderr)
+    d8_servers[arch].close()
+    d8_servers[arch] = None
+    if expected is None:
+        # raises the error of the one-shot d8
+        return compile(arch, filename)
+    return expected
+
+def compile_and_cost(arch, filename):
+    if code_cache is None:
+        asm = compile(arch, filename)
+        return asm, get_cost(asm, arch)
+
+    key = code_cache.key(read_file(filename), d8_path(arch), D8_OPTS)
+    entry = code_cache.get(key)
+    if entry is None:
+        asm = compile(arch, filename)
+    else:
+        asm = entry['asm']
+        if entry.get('cost_version') == cost_version(arch):
+            return asm, entry['costs']
+    costs = get_cost(asm, arch)
+    code_cache.put(key, {'asm': asm, 'costs': costs,
+                         'cost_version': cost_version(arch)})
+    return asm, costs
+
+def get_cost(asm, arch='riscv'):
+    if core_model is not None:
+        return block_cycles(filter_asm(asm), arch, core_model)
+
+    model = load_model(arch)
     bb_cost = {}
     cur_bb = ''
     for line in filter_asm(asm):
         if line.startswith('--'):
             cur_bb = line
-            bb_cost[cur_bb] = 0
+            bb_cost.setdefault(cur_bb, 0)
             continue
 
-        cost = instr_cost(line)
-        bb_cost[cur_bb] += cost
+        cost = model.line_cost(line)
+        bb_cost[cur_bb] = bb_cost.get(cur_bb, 0) + cost
     return bb_cost
 
 class Context:
@@ -454,20 +419,161 @@ def gen_test(filename):
         ctx = Context()
         print(gen_unit(ctx), file=f)
 
-def compare_bb_cost(c1, c2):
+def source_context(source):
+    # the variables a generated source declares, so new statements can
+    # refer to them
+    ctx = Context()
+    names = set(re.findall(r'\b[vi][0-9]+\b', source))
+    ctx.vars = sorted(v for v in names if v[0] == 'v')
+    ctx.var_counter = max([int(v[1:]) for v in names] + [-1]) + 1
+    return ctx
+
+def mutate_insert(lines, stmts, ctx):
+    body = [st for st in stmts if st.depth > 0]
+    if not body or not ctx.vars:
+        return None
+    at = choice(body).start
+    return lines[:at] + gen_stmt(ctx, choice([True, False])).splitlines() + lines[at:]
+
+def mutate_delete(lines, stmts, ctx):
+    body = [st for st in stmts if st.depth > 0 and not st.is_block()
+            and not lines[st.start].startswith('return')]
+    if not body:
+        return None
+    at = choice(body).start
+    return lines[:at] + lines[at + 1:]
+
+def mutate_expr(lines, stmts, ctx):
+    assigns = [st.start for st in stmts
+               if re.match(r'^(var )?v[0-9]+ = .*;$', lines[st.start])]
+    if not assigns or not ctx.vars:
+        return None
+    at = choice(assigns)
+    lhs = lines[at].split('=', 1)[0]
+    return lines[:at] + [f'{lhs}= {gen_expr(ctx)};'] + lines[at + 1:]
+
+def mutate_literal(lines, stmts, ctx):
+    literals = [(i, m) for i, line in enumerate(lines)
+                # keep loop bounds small
+                if not line.startswith('%') and not line.startswith('for')
+                for m in re.finditer(r'(?<![\w.])-?[0-9][0-9.e+]*(?![\w.])', line)]
+    if not literals:
+        return None
+    i, m = choice(literals)
+    line = lines[i]
+    line = f'{line[:m.start()]}{gen_expr_literal()}{line[m.end():]}'
+    return lines[:i] + [line] + lines[i + 1:]
+
+def mutate(source):
+    lines = source.split('\n')
+    for _ in range(georand(0.7) + 1):
+        ctx = source_context('\n'.join(lines))
+        mutator = choice([mutate_insert, mutate_delete, mutate_expr,
+                          mutate_literal])
+        mutated = mutator(lines, parse(lines), ctx)
+        if mutated is not None:
+            lines = mutated
+    return '\n'.join(lines)
+
+def block_classes(asm, arch):
+    model = load_model(arch)
+    classes = {}
+    cur_bb = ''
+    for line in filter_asm(asm):
+        if line.startswith('--'):
+            cur_bb = line
+            classes.setdefault(cur_bb, [])
+            continue
+        words = line.split(None, 4)
+        if len(words) >= 4:
+            classes.setdefault(cur_bb, []).append(model.instr_class(words[3]))
+    return classes
+
+# Match the basic blocks of both dumps (see bbalign.py). Without the code
+# dumps, blocks are matched by label alone and resized means a changed cost.
+def align_blocks(cost_riscv, cost_mips, asm_riscv=None, asm_mips=None):
+    labels1 = list(cost_riscv)
+    labels2 = list(cost_mips)
+    if asm_riscv is None or asm_mips is None:
+        return diff_blocks(labels1, labels2,
+                           [cost_riscv[bb] for bb in labels1],
+                           [cost_mips[bb] for bb in labels2])
+    classes1 = block_classes(asm_riscv, 'riscv')
+    classes2 = block_classes(asm_mips, 'mips')
+    contents1 = [classes1.get(bb, []) for bb in labels1]
+    contents2 = [classes2.get(bb, []) for bb in labels2]
+    return diff_blocks(labels1, labels2,
+                       [len(c) for c in contents1], [len(c) for c in contents2],
+                       contents1, contents2)
+
+def compare_bb_cost(c1, c2, blocks=None):
+    if blocks is None:
+        blocks = align_blocks(c1, c2)
     total_diff = 0
-    for bb in c1:
-        # print(bb, c1[bb] - c2[bb])
-        total_diff += max(c1[bb] - c2[bb], 0)
+    for pair in blocks:
+        if pair.first is None:
+            continue
+        # a block only RISC-V has counts in full
+        other = c2[pair.second] if pair.second is not None else 0
+        total_diff += max(c1[pair.first] - other, 0)
     return total_diff
 
-def print_cost_table(cost_riscv, cost_mips, f=sys.stdout):
-    x = PrettyTable(["Basic Block","RISCV64 cost","MIPS64 cost", "Difference"])
+def block_opcodes(asm):
+    opcodes = {}
+    cur_bb = ''
+    for line in filter_asm(asm):
+        if line.startswith('--'):
+            cur_bb = line
+            opcodes.setdefault(cur_bb, set())
+            continue
+        words = line.split(None, 4)
+        if len(words) >= 4:
+            opcodes.setdefault(cur_bb, set()).add(words[3])
+    return opcodes
+
+# A basic block label with its numbers masked, so block numbers and source
+# positions such as `<not inlined:47>` do not make blocks distinct
+def block_shape(label):
+    return re.sub(r'[0-9]+', 'N', label)
+
+# The (arch, basic block shape, opcode) triples of both code dumps
+def coverage_signatures(asm_riscv, asm_mips):
+    signatures = set()
+    for arch, asm in [('riscv', asm_riscv), ('mips', asm_mips)]:
+        for bb, opcodes in block_opcodes(asm).items():
+            signatures.update((arch, block_shape(bb), op) for op in opcodes)
+    return signatures
+
+# Findings with the same signature regress the same kinds of blocks with the
+# same RISC-V instructions. Block numbers are ignored.
+def finding_signature(cost_riscv, cost_mips, asm_riscv, blocks):
+    opcodes = block_opcodes(asm_riscv)
+    parts = sorted(set(
+        block_shape(pair.first) + ':' +
+        ','.join(sorted(opcodes.get(pair.first, ())))
+        for pair in blocks if pair.first is not None and
+        cost_riscv[pair.first] > (cost_mips[pair.second]
+                                  if pair.second is not None else 0)))
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+def print_cost_table(cost_riscv, cost_mips, f=sys.stdout, blocks=None):
+    if blocks is None:
+        blocks = align_blocks(cost_riscv, cost_mips)
+    x = PrettyTable(["Basic Block","RISCV64 cost","MIPS64 cost", "Difference",
+                     "Change"])
     x._max_width = {"Basic Block" : 30}
-    for bb in cost_riscv:
-        diff = cost_riscv[bb] - cost_mips[bb]
-        bb_prefix = bb[3:-3]
-        x.add_row([bb_prefix, cost_riscv[bb], cost_mips[bb], diff])
+    for pair in blocks:
+        c1 = cost_riscv[pair.first] if pair.first is not None else 0
+        c2 = cost_mips[pair.second] if pair.second is not None else 0
+        bb_prefix = pair.label()[3:-3]
+        if pair.first is not None and pair.second is not None \
+                and pair.first != pair.second:
+            bb_prefix = f'{bb_prefix} / {pair.second[3:-3]}'
+        x.add_row([bb_prefix,
+                   c1 if pair.first is not None else '-',
+                   c2 if pair.second is not None else '-',
+                   c1 - c2,
+                   '' if pair.status == 'same' else pair.status])
     print(x, file=f)
 
 
@@ -492,8 +598,11 @@ def write_config(filename, cost1, cost2):
         '--print-code',
         '--code-comments',
         filename])
-    with open('scenario.ini', 'w') as f:
+    # write to a private file first so readers never see a partial file
+    tmp = f'scenario.ini.{os.getpid()}'
+    with open(tmp, 'w') as f:
         config.write(f)
+    os.replace(tmp, 'scenario.ini')
     return config
 
 def write_result(f, config, asm_riscv, asm_mips):
@@ -504,45 +613,203 @@ def write_result(f, config, asm_riscv, asm_mips):
     print(f'\n### V8 MIPS64:\n{asm_mips}', file=f)
 
 def run_test(filename):
-    asm1 = compile('riscv', filename)
-    c1 = get_cost(asm1)
-    asm2 = compile('mips', filename)
-    c2 = get_cost(asm2)
+    # both d8 processes run at the same time
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        riscv = pool.submit(compile_and_cost, 'riscv', filename)
+        mips = pool.submit(compile_and_cost, 'mips', filename)
+        asm1, c1 = riscv.result()
+        asm2, c2 = mips.result()
     return c1, c2, asm1, asm2
 
-def reduce_case(filename):
-    subprocess.check_output(['creduce', 'test.py', filename])
-
-def main():
-    cnt = 0
-    while True:
-        id = random_id()
-        source_file = f'case-{id}.js'
-        case_file = f'case-{id}.txt'
+# Whether a case threw when it ran. A one-shot d8 exits with an error, which
+# compile() raises as CalledProcessError, but the --server driver catches
+# the exception and prints it instead.
+def threw(asm):
+    return any(line.startswith(EXCEPTION) for line in asm.splitlines())
+
+# A reduction candidate is interesting if it still has a block that costs
+# more on RISC-V. Sources d8 rejects are not.
+def is_interesting(source):
+    fd, filename = tempfile.mkstemp(prefix='reduce-', suffix='.js', dir='.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(source)
+        try:
+            c1, c2, asm1, asm2 = run_test(filename)
+        except subprocess.CalledProcessError:
+            return False
+        if threw(asm1) or threw(asm2):
+            return False
+        return compare_bb_cost(c1, c2, align_blocks(c1, c2, asm1, asm2)) > 0
+    finally:
+        os.remove(filename)
+
+# Runs in each forked reducer process. The d8 servers inherited from the
+# reducing worker share its pipes but not its reader threads, so the reducer
+# processes start their own.
+def reducer_init():
+    global d8_servers
+    if d8_servers is not None:
+        d8_servers = {arch: None for arch, server in d8_servers.items()
+                      if server is None}
+
+# Reduce the case in place, keeping the original as case-<id>.orig.js
+def reduce_case(filename, jobs):
+    source = read_file(filename)
+    reduced = reduce_source(source, is_interesting, jobs, reducer_init)
+    os.replace(filename, filename[:-len('.js')] + '.orig.js')
+    with open(filename, 'w') as f:
+        f.write(reduced)
+
+# how many cases a corpus worker runs before picking up the other workers'
+# additions
+CORPUS_SYNC_INTERVAL = 16
+
+# share of corpus mode cases that mutate a corpus entry instead of being
+# generated from scratch
+MUTATE_RATIO = 0.8
+
+def test_case(cnt, lock, reduce_jobs=0, corpus=None):
+    id = new_case_id()
+    source_file = f'case-{id}.js'
+    case_file = f'case-{id}.txt'
+    if corpus is not None and corpus.entries and random.random() < MUTATE_RATIO:
+        parent = choice(corpus.entries)
+        with open(source_file, 'w') as f:
+            f.write(mutate(corpus.read(parent)))
+        origin = f'mutated from {parent}'
+    else:
         gen_test(source_file)
-        passed = False
-
-        cnt += 1
-        print(f"test case {cnt} : {source_file}")
-
-        cost_riscv, cost_mips, asm_riscv, asm_mips = run_test(source_file)
-        if compare_bb_cost(cost_riscv, cost_mips) > 0:
-            print_cost_table(cost_riscv, cost_mips)
-            passed = True
+        origin = 'generated'
+
+    with lock:
+        print(f"test case {cnt} : {source_file}"
+              f"{f' ({origin})' if corpus is not None else ''}", flush=True)
+
+    cost_riscv, cost_mips, asm_riscv, asm_mips = run_test(source_file)
+    if corpus is not None:
+        if cnt % CORPUS_SYNC_INTERVAL == 0:
+            corpus.sync()
+        corpus.add(read_file(source_file),
+                   coverage_signatures(asm_riscv, asm_mips))
+    blocks = align_blocks(cost_riscv, cost_mips, asm_riscv, asm_mips)
+    if compare_bb_cost(cost_riscv, cost_mips, blocks) > 0:
+        if corpus is not None and not corpus.add_finding(
+                finding_signature(cost_riscv, cost_mips, asm_riscv, blocks)):
+            with lock:
+                print(f'{source_file}: already found', flush=True)
+            os.remove(source_file)
+            return False
+
+        if reduce_jobs > 0:
+            with lock:
+                print(f'reducing {source_file}', flush=True)
+            reduce_case(source_file, reduce_jobs)
+            cost_riscv, cost_mips, asm_riscv, asm_mips = run_test(source_file)
+            blocks = align_blocks(cost_riscv, cost_mips, asm_riscv, asm_mips)
+
+        # serialize reporting so concurrent findings do not interleave
+        with lock:
+            print_cost_table(cost_riscv, cost_mips, blocks=blocks)
             config = write_config(source_file, cost_riscv, cost_mips)
 
-            # print('reducing')
-            # reduce_case(source_file)
-            # c1, c2, asm1, asm2 = run_test(source_file, arch, abi)
-
             # write_result(sys.stdout, config, asm_riscv, asm_mips)
-            print_cost_table(cost_riscv, cost_mips, open(case_file, 'w'))
-            write_result(open(case_file, 'a'), config, asm_riscv, asm_mips)
-            break
+            with open(case_file, 'w') as f:
+                print_cost_table(cost_riscv, cost_mips, f, blocks)
+                write_result(f, config, asm_riscv, asm_mips)
+            sys.stdout.flush()
+        return True
+
+    os.remove(source_file)
+    return False
+
+def worker(counter, found, lock, reduce_jobs, corpus_dir):
+    # forked workers inherit the parent's random state; reseed from the OS
+    random.seed()
+    corpus = Corpus(corpus_dir) if corpus_dir is not None else None
+    while not found.is_set():
+        with counter.get_lock():
+            counter.value += 1
+            cnt = counter.value
+        # in corpus mode, keep going after a finding
+        if test_case(cnt, lock, reduce_jobs, corpus) and corpus is None:
+            found.set()
 
-        if not passed:
-            os.remove(source_file)
-        # break
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of cases to generate and evaluate concurrently')
+    parser.add_argument('--server', action='store_true', default=False,
+                        help='compile cases in long-lived d8 processes instead '
+                             'of starting d8 for every case')
+    parser.add_argument('--cache', metavar='DIR', default=None,
+                        help='reuse code dumps and costs of previously compiled '
+                             'sources from this directory')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                        help='size cap of the cache in MB')
+    parser.add_argument('--core', default=None,
+                        help='compare estimated cycles on this core model '
+                             '(cores/<core>.ini) instead of summed '
+                             'instruction costs')
+    parser.add_argument('--no-reduce', dest='reduce', action='store_false',
+                        default=True,
+                        help='report findings without reducing them')
+    parser.add_argument('--reduce-jobs', type=int, default=None,
+                        help='number of candidates to test in parallel '
+                             'while reducing a finding (default: the CPUs '
+                             'per --jobs worker)')
+    parser.add_argument('--corpus', metavar='DIR', default=None,
+                        help='keep cases with new coverage in DIR, mutate '
+                             'them, and run until interrupted, reporting '
+                             'each distinct finding once')
+    args = parser.parse_args()
+    reduce_jobs = args.reduce_jobs
+    if reduce_jobs is None:
+        # every worker may be reducing at the same time
+        reduce_jobs = max(multiprocessing.cpu_count() // max(args.jobs, 1), 1)
+    if not args.reduce:
+        reduce_jobs = 0
+
+    if args.core is not None:
+        global core_model
+        core_model = load_core(args.core)
+
+    if args.cache is not None:
+        global code_cache
+        code_cache = CodeCache(args.cache, args.cache_size * 1024 * 1024)
+
+    if args.server:
+        global d8_servers
+        d8_servers = {}
+        # create the driver before forking so workers share one file
+        D8Server.driver()
+
+    if args.jobs <= 1:
+        corpus = Corpus(args.corpus) if args.corpus is not None else None
+        cnt = 0
+        lock = threading.Lock()
+        while True:
+            cnt += 1
+            if test_case(cnt, lock, reduce_jobs, corpus) and corpus is None:
+                break
+        return
+
+    counter = multiprocessing.Value('L', 0)
+    found = multiprocessing.Event()
+    lock = multiprocessing.Lock()
+    workers = [multiprocessing.Process(target=worker,
+                                       args=(counter, found, lock, reduce_jobs,
+                                             args.corpus))
+               for _ in range(args.jobs)]
+    for w in workers:
+        w.start()
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        for w in workers:
+            w.terminate()
 
 if __name__ == '__main__':
     main()
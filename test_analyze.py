@@ -0,0 +1,196 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Checks the call trace printed by analyze.py, that analyze.py --jobs
+# prints the same output as a serial run, that queries resumed from
+# checkpoints print the same output as a full replay, and that the trace line
+# tokenizer reads lines like the one it replaced.
+#
+#   $ python3 -m unittest test_analyze
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import bench_tokenizer
+
+ANALYZE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analyze.py')
+
+
+# A code object of four instructions at start; header is the line before it,
+# if any
+def codeDump(header, name, start, kind='TURBOFAN'):
+    lines = [header] if header is not None else []
+    lines += [f"kind = {kind}", f"name = {name}", "compiler = turbofan",
+              f"address = 0x{start - 0x40:x}", "", "Instructions (size = 16)"]
+    for i, insn in enumerate(["00a50533       add       a0, a0, a1",
+                              "000f80e7       jalr      t6",
+                              "00a50533       add       a0, a0, a1",
+                              "00008067       ret"]):
+        lines.append(f"0x{start + 4 * i:x}   {4 * i:3x}  {insn}")
+    lines += ["", "Safepoints (size = 8)", f"0x{start:x}     8  slots (sp->fp)",
+              "RelocInfo (size = 3)", f"0x{start:x}  code target", ""]
+    return lines
+
+
+# A CallImpl of the code object at entry that calls callee once, which
+# returns with ret, and then, if tail is true, jumps to the entry of callee.
+# Returns its lines and the next instruction count.
+def callImpl(entry, callee, count, adds=200, ret='ret', tail=False):
+    lines = [f"CallImpl: reg_arg_count = 6 entry-pc (JSEntry) = 0x{entry:x} "
+             "a0 (Isolate) = 0x1 a1 (x) = 0x2 a2 (y) = 0x3 a3 (z) = 0x4 "
+             "a4 (w) = 0x5 a5 (v) = 0x6"]
+    trace = [(entry, f"ff010113       addi      sp, sp, -16           {0x7ff000:016x}"),
+             (entry, f"00010413       mv        fp, sp                {0x7ff000:016x}"),
+             (entry, f"00000fb7       lui       t6, 0x0               {callee:016x}")]
+    trace += [(entry, f"00a50533       add       a0, a0, a1            {k:016x}")
+              for k in range(adds)]
+    trace += [(entry + 4, f"000f80e7       jalr      t6   -> 0x{callee:012x}  {entry + 8:016x}"),
+              (callee + 12, f"00008067       {ret:<9} -> 0x{entry + 8:012x} ")]
+    if tail:
+        trace += [(entry + 8, f"000f8067       jr        t6   -> 0x{callee:012x} "),
+                  (callee + 8, f"00a50533       add       a0, a0, a1            {0:016x}")]
+    trace += [(entry + 12, "00008067       ret       -> 0xfffffffffffffffe ")]
+    for pc, text in trace:
+        lines.append(f"  0x{pc:012x}   {text}    ({count})")
+        count += 1
+    lines.append("---")
+    return lines, count
+
+
+def analyze(*args):
+    return subprocess.run([sys.executable, ANALYZE] + list(args),
+                          check=True, stdout=subprocess.PIPE).stdout
+
+
+# Analyze the log of lines
+def analyzeLines(lines, *args):
+    with tempfile.TemporaryDirectory() as tmp:
+        logfile = os.path.join(tmp, 'out')
+        with open(logfile, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return analyze(*args, logfile)
+
+
+class JumpTest(unittest.TestCase):
+    def testReturnIsNotAJump(self):
+        a, b = 0x55a1aa300000, 0x55a1aa301000
+        lines = codeDump("--- Code ---", "A", a) + codeDump("--- Code ---", "B", b)
+        for ret in ['ret', 'jr ra']:
+            trace, count = callImpl(b, a, 1, adds=2, ret=ret)
+            out = analyzeLines(lines + trace)
+            self.assertIn(b'Return from A', out)
+            self.assertNotIn(b'Jump to', out)
+
+    def testJumpToEntry(self):
+        a, b = 0x55a1aa300000, 0x55a1aa301000
+        lines = codeDump("--- Code ---", "A", a) + codeDump("--- Code ---", "B", b)
+        trace, count = callImpl(b, a, 1, adds=2, tail=True)
+        out = analyzeLines(lines + trace)
+        self.assertEqual(out.count(b'Jump to A'), 1)
+
+
+class JobsTest(unittest.TestCase):
+    def checkJobs(self, lines):
+        with tempfile.TemporaryDirectory() as tmp:
+            logfile = os.path.join(tmp, 'out')
+            with open(logfile, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            serial = analyze(logfile)
+            self.assertNotIn(b'unknown', serial)
+            for jobs in ['2', '4']:
+                self.assertEqual(analyze('-j', jobs, logfile), serial)
+
+    def testCodeHeaders(self):
+        a, b, c = 0x55a1aa300000, 0x55a1aa301000, 0x55a1aa302000
+        lines = codeDump("--- Code ---", "A", a)
+        trace, count = callImpl(a, a, 1)
+        lines += trace
+        lines += codeDump("--- Optimized code ---", "B", b)
+        trace, count = callImpl(b, a, count)
+        lines += trace
+        # a builtin dumped without a header line
+        lines += codeDump(None, "C", c, kind='BUILTIN')
+        trace, count = callImpl(c, b, count)
+        lines += trace
+        self.checkJobs(lines)
+
+
+class CheckpointTest(unittest.TestCase):
+    def testResume(self):
+        a, b, c = 0x55a1aa300000, 0x55a1aa301000, 0x55a1aa302000
+        lines = codeDump("--- Code ---", "A", a) + codeDump("--- Code ---", "B", b)
+        count = 1
+        for entry, callee in [(a, a), (b, a), (b, b)]:
+            trace, count = callImpl(entry, callee, count, adds=100)
+            lines += trace
+        lines += codeDump("--- Code ---", "C", c)
+        trace, count = callImpl(c, b, count, adds=100, tail=True)
+        lines += trace
+
+        with tempfile.TemporaryDirectory() as tmp:
+            logfile = os.path.join(tmp, 'out')
+            with open(logfile, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            def query(*args):
+                return subprocess.run([sys.executable, ANALYZE, *args, logfile],
+                                      check=True, stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE)
+
+            queries = [['--at', '150'], ['--at', '390'],
+                       ['--range', '120:210'], ['--range', '260:330']]
+            # without checkpoints, every query replays the whole log
+            replayed = [query(*args).stdout for args in queries]
+            analyze('--checkpoint', '--checkpoint-interval', '50', logfile)
+            for args, expected in zip(queries, replayed):
+                self.assertIn(b'###', expected)
+                resumed = query(*args)
+                self.assertEqual(resumed.stderr, b'')
+                self.assertEqual(resumed.stdout, expected)
+
+
+class MaxDepthTest(unittest.TestCase):
+    # A CallImpl of the code object at entry that calls itself depth times
+    # through a, which returns depth times, followed by a plain CallImpl
+    def deepLog(self, depth):
+        a, b = 0x55a1aa300000, 0x55a1aa301000
+        lines = codeDump("--- Code ---", "A", a) + codeDump("--- Code ---", "B", b)
+        trace, count = callImpl(b, a, 1, adds=0)
+        call, ret = trace[4], trace[5]
+        lines += trace[:4] + [call] * depth + [ret] * depth + trace[6:]
+        trace, count = callImpl(b, a, count, adds=0)
+        return lines + trace
+
+    def testClampIndentation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            logfile = os.path.join(tmp, 'out')
+            with open(logfile, 'w') as f:
+                f.write('\n'.join(self.deepLog(8)) + '\n')
+            result = subprocess.run(
+                [sys.executable, ANALYZE, '--max-depth', '3', logfile],
+                check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(result.stderr.count(b'WARNING'), 1)
+        out = result.stdout.decode().splitlines()
+        calls = [line for line in out if 'Call A' in line]
+        returns = [line for line in out if 'Return from A' in line]
+        self.assertEqual(len(calls), 9)
+        self.assertEqual(len(returns), 4)
+        indents = [len(line) - len(line.lstrip('# ')) for line in calls]
+        self.assertEqual(max(indents), 4 + 2 * 3)
+        # the next CallImpl is indented as without --max-depth
+        self.assertEqual(indents[-1], 4 + 2)
+
+    def testSameAsBaseline(self):
+        a, b = 0x55a1aa300000, 0x55a1aa301000
+        lines = codeDump("--- Code ---", "A", a) + codeDump("--- Code ---", "B", b)
+        trace, count = callImpl(b, a, 1, adds=2)
+        lines += trace
+        sample = [line.encode() for line in lines]
+        self.assertEqual(list(bench_tokenizer.mismatches(sample)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
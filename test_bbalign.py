@@ -0,0 +1,67 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Checks the block alignment of bbalign.py on both ways of pairing unmatched
+# runs: the optimal pairing and, for runs over MAX_DP_CELLS, the greedy one.
+#
+#   $ python3 -m unittest test_bbalign
+
+import unittest
+
+import bbalign
+
+# Blocks that are not identical on both sides and whose labels are
+# renumbered, so every block is left to the unmatched run pairing
+LABELS1 = ['B1', 'B2', 'B3', 'B4']
+LABELS2 = ['B11', 'B12', 'B13', 'B14']
+CONTENTS1 = [['alu', 'alu', 'load'], ['load', 'store', 'branch'],
+             ['mul', 'mul', 'alu', 'alu'], ['call', 'alu', 'jump']]
+CONTENTS2 = [['alu', 'alu', 'load', 'alu'], ['load', 'store', 'alu', 'branch'],
+             ['mul', 'mul', 'alu'], ['call', 'jump']]
+# A block of another label shape with nothing in common with the others
+EXTRA_LABEL = 'Deopt'
+EXTRA_CONTENTS = ['fcvt', 'fmadd', 'fsqrt']
+
+
+class AlignTest(unittest.TestCase):
+    def checkAlignment(self):
+        # a block only in the first dump
+        labels1 = LABELS1[:2] + [EXTRA_LABEL] + LABELS1[2:]
+        contents1 = CONTENTS1[:2] + [EXTRA_CONTENTS] + CONTENTS1[2:]
+        self.assertEqual(bbalign.align(labels1, LABELS2, contents1, CONTENTS2),
+                         [(0, 0), (1, 1), (2, None), (3, 2), (4, 3)])
+        # a block only in the second dump
+        labels2 = LABELS2[:1] + [EXTRA_LABEL] + LABELS2[1:]
+        contents2 = CONTENTS2[:1] + [EXTRA_CONTENTS] + CONTENTS2[1:]
+        self.assertEqual(bbalign.align(LABELS1, labels2, CONTENTS1, contents2),
+                         [(0, 0), (None, 1), (1, 2), (2, 3), (3, 4)])
+        statuses = [pair.status for pair in bbalign.diff_blocks(
+            LABELS1, labels2, [3, 3, 4, 3], [4, 3, 3, 3, 2],
+            CONTENTS1, contents2)]
+        self.assertEqual(statuses,
+                         ['resized', 'removed', 'same', 'resized', 'resized'])
+
+    def testOptimal(self):
+        self.checkAlignment()
+
+    def testGreedy(self):
+        saved = bbalign.MAX_DP_CELLS
+        bbalign.MAX_DP_CELLS = 0
+        try:
+            self.checkAlignment()
+        finally:
+            bbalign.MAX_DP_CELLS = saved
+
+    def testIdenticalBlocksFirst(self):
+        # the inserted block shifts the numbers of the blocks after it
+        labels1 = ['B1', 'B2', 'B3']
+        labels2 = ['B1', 'B2', 'B3', 'B4']
+        contents1 = [['alu'], ['load'], ['store']]
+        contents2 = [['alu'], ['mul', 'mul'], ['load'], ['store']]
+        self.assertEqual(bbalign.align(labels1, labels2, contents1, contents2),
+                         [(0, 0), (None, 1), (1, 2), (2, 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
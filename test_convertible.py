@@ -0,0 +1,49 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Checks that collect-convertible.py --decode counts the same convertible
+# instructions as the constraint table on testdata/convertible.log.
+#
+#   $ python3 -m unittest test_convertible
+
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+spec = importlib.util.spec_from_file_location(
+    'collect_convertible', os.path.join(HERE, 'collect-convertible.py'))
+convertible = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(convertible)
+
+
+class DecodeTest(unittest.TestCase):
+    def testSameCounts(self):
+        corpus = convertible.BENCHMARK_CORPUS
+        out = io.StringIO()
+        raw, text = convertible.collectRange(corpus, out=out)
+        decodedRaw, decoded = convertible.collectRangeDecoded(corpus)
+        self.assertEqual(decodedRaw, raw)
+
+        # The constraint table cannot parse the hex immediates of the last
+        # lines of the corpus and reports them instead of counting them
+        errors = {line[len("Error Line:  "):]
+                  for line in out.getvalue().splitlines(keepends=True)}
+        self.assertEqual(len(errors), 8)
+        self.assertTrue(all(line.startswith('0x55a1aa3ff') for line in errors))
+        with tempfile.TemporaryDirectory() as tmp:
+            logfile = os.path.join(tmp, 'out')
+            with open(corpus) as src, open(logfile, 'w') as dst:
+                dst.writelines(line for line in src if line not in errors)
+            raw, text = convertible.collectRange(logfile)
+            decodedRaw, decoded = convertible.collectRangeDecoded(logfile)
+        self.assertEqual(decodedRaw, raw)
+        self.assertEqual(decoded, text)
+
+
+if __name__ == "__main__":
+    unittest.main()
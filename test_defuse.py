@@ -0,0 +1,94 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Checks the queries of the def-use index against a scan of the writes, with
+# flush and sort sizes small enough that the columns are sorted in several
+# runs and merged, and the counts analyze.py --defuse records.
+#
+#   $ python3 -m unittest test_defuse
+
+import os
+import random
+import re
+import tempfile
+import unittest
+
+import defuse
+from regfile import RegisterFile
+from test_analyze import analyze, callImpl, codeDump
+
+
+class SortTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = defuse.FLUSH_ROWS, defuse.SORT_ROWS
+        defuse.FLUSH_ROWS = 1000
+        defuse.SORT_ROWS = 10000
+
+    def tearDown(self):
+        defuse.FLUSH_ROWS, defuse.SORT_ROWS = self.saved
+
+    def testQueries(self):
+        rng = random.Random(1)
+        registers = RegisterFile()
+        a0, a1, t0 = (registers.index(name) for name in ['a0', 'a1', 't0'])
+        # a0 is written in count order, a1 out of order and t0 rarely; the
+        # values repeat so equal keys span the runs
+        writes = []
+        counts = list(range(1, 3 * 25000, 3))
+        rng.shuffle(counts)
+        for i in range(60000):
+            writes.append((a0, 2 * i + 2, 0x1000 + i, rng.randrange(50)))
+        for count in counts:
+            writes.append((a1, count, 0x2000 + count, rng.randrange(50)))
+        for i in range(0, 60000, 1000):
+            writes.append((t0, 2 * i + 1, 0x3000 + i, rng.randrange(50)))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            logfile = os.path.join(tmp, 'out')
+            with open(logfile, 'w') as f:
+                f.write('\n')
+            writer = defuse.DefUseWriter(logfile, registers)
+            for reg, count, pc, value in writes:
+                writer.add(reg, count, pc, value)
+            writer.close()
+            index = defuse.DefUseIndex(logfile)
+
+            byReg = {'a0': a0, 'a1': a1, 't0': t0}
+            self.assertEqual(index.registers(), sorted(byReg))
+            for name, reg in byReg.items():
+                mine = sorted((count, pc, value)
+                              for r, count, pc, value in writes if r == reg)
+                self.assertEqual(index.meta['registers'][name], len(mine))
+                for count in [0, 1, 2, 3, 1001, 50000, 74999, 200000] + \
+                        [rng.randrange(150000) for _ in range(50)]:
+                    before = [w for w in mine if w[0] < count]
+                    self.assertEqual(index.lastWrite(name, count),
+                                     before[-1] if before else None)
+            names = {reg: name for name, reg in byReg.items()}
+            for value in [0, 7, 49, 50]:
+                expected = sorted((count, names[reg], pc)
+                                  for reg, count, pc, v in writes
+                                  if v == value)
+                self.assertEqual(index.writesOfValue(value), expected)
+
+
+class CountTest(unittest.TestCase):
+    def testWriteWithoutCount(self):
+        a, b = 0x55a1aa300000, 0x55a1aa301000
+        lines = codeDump("--- Code ---", "A", a) + codeDump("--- Code ---", "B", b)
+        trace, count = callImpl(b, a, 1, adds=2)
+        # the call is the sixth instruction and prints no count
+        lines += [re.sub(r'\(6\)$', '', line) for line in trace]
+        with tempfile.TemporaryDirectory() as tmp:
+            logfile = os.path.join(tmp, 'out')
+            with open(logfile, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            analyze('--defuse', logfile)
+            index = defuse.DefUseIndex(logfile)
+            self.assertIsNone(index.lastWrite('ra', 6))
+            self.assertEqual(index.lastWrite('ra', 7), (6, b + 4, b + 8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Checks that jsreduce.py reduces a generated-style case to the statements
+# the predicate needs, and that verdicts are memoized.
+#
+#   $ python3 -m unittest test_jsreduce
+
+import unittest
+
+import jsreduce
+
+SOURCE = '''var a = 1;
+var b = a + 2;
+function f(x) {
+  var c = x * 3;
+  for (var i = 0; i < 4; i++) {
+    c = c + b;
+    a = -c;
+  }
+  return c;
+}
+var d = f(b) ? a : b;
+print(d);
+print(a);'''
+
+
+# Interesting while b is computed from a and printed through d
+def needs_b(source):
+    lines = [line.strip() for line in source.split('\n')]
+    return 'var b = a + 2;' in lines and 'print(d);' in lines and \
+        any(line.startswith('var d =') and 'b' in line for line in lines)
+
+
+class ReduceTest(unittest.TestCase):
+    def testKeepsNeededStatements(self):
+        reduced = jsreduce.reduce_source(SOURCE, needs_b)
+        self.assertEqual(reduced.split('\n'),
+                         ['var b = a + 2;', 'var d = f(b);', 'print(d);'])
+
+    def testUnwrapsLoops(self):
+        def needs_loop_body(source):
+            return 'c = c + b;' in source and 'print(a);' in source
+        reduced = jsreduce.reduce_source(SOURCE, needs_loop_body)
+        self.assertEqual([line.strip() for line in reduced.split('\n')],
+                         ['function f(x) {', 'c = c + b;', '}', 'print(a);'])
+
+    def testMemo(self):
+        tested = []
+
+        def predicate(source):
+            tested.append(source)
+            return 'print' in source
+
+        reducer = jsreduce.Reducer(predicate)
+        spaced = SOURCE.replace('\n', '\n\n  ')
+        self.assertEqual(reducer.test_all([SOURCE, spaced, 'var a = 1;']),
+                         [True, True, False])
+        self.assertEqual(reducer.test_all(['  var a = 1;', SOURCE]),
+                         [False, True])
+        self.assertEqual(tested, [SOURCE, 'var a = 1;'])
+        self.assertEqual(reducer.tests, 2)
+        reducer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
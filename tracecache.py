@@ -0,0 +1,318 @@
+#!/usr/bin/python3
+
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Binary columnar cache of a parsed `--print-all-code` / `--trace-sim` log.
+#
+# Parsing a multi-GB text log dominates every analysis, so `ingest` parses it
+# once and stores the records as raw NumPy columns next to the log:
+#
+#   <logfile>.tracecache/
+#     meta.json         log size/mtime, format version, interned opcodes and
+#                       the number of rows of each table
+#     trace.<col>.bin   one row per executed instruction (--trace-sim)
+#     code.<col>.bin    one row per disassembled instruction (--print-all-code)
+#
+# Trace columns: pc (uint64), insn (uint32 instruction word), op (uint16
+# opcode id), result (uint64), hasResult (bool), count (int64, -1 if the
+# simulator printed none). Code columns: pc, offset (uint32), insn, op.
+# Opcode ids index TraceCache.opcodes. Whether an instruction has a result
+# follows the same rule as analyze.py (see mnemonics.py).
+#
+# Rows are collected in array.array buffers and appended to the column files
+# every FLUSH_ROWS rows, so ingesting takes bounded memory. Columns are
+# loaded with np.memmap. The cache is keyed on the size and mtime of the log,
+# and load() rebuilds it automatically when they change.
+#
+# Code and trace lines are told apart with isCodeLine() and isTraceLine() of
+# codeindex.py. opstats.py reads the cache, and collect-convertible.py and
+# CountInstr.py read it with --cache instead of parsing the text:
+#
+#   $ tracecache.py ingest out.log
+#   $ tracecache.py info out.log
+#   $ collect-convertible.py --cache out.log.tracecache
+
+import argparse
+import array
+import json
+import os
+import re
+import time
+from collections import Counter
+
+import numpy as np
+
+from codeindex import isCodeLine, isTraceLine
+from mnemonics import hasResult, operandWords, resultIndex
+from tracereader import TraceReader
+
+FORMAT_VERSION = 2
+
+# Rows buffered per table before they are appended to the column files
+FLUSH_ROWS = 1 << 20
+
+TRACE_COLUMNS = {
+    'pc': np.uint64,
+    'insn': np.uint32,
+    'op': np.uint16,
+    'result': np.uint64,
+    'hasResult': np.bool_,
+    'count': np.int64,
+}
+
+CODE_COLUMNS = {
+    'pc': np.uint64,
+    'offset': np.uint32,
+    'insn': np.uint32,
+    'op': np.uint16,
+}
+
+# array.array typecodes used while collecting each column
+_TYPECODES = {
+    np.uint64: 'Q',
+    np.uint32: 'I',
+    np.uint16: 'H',
+    np.bool_: 'B',
+    np.int64: 'q',
+}
+
+_COUNT = re.compile(rb'\(([1-9][0-9]*) *\)')
+
+
+def cacheDir(logfile):
+    return logfile + '.tracecache'
+
+
+def _columnPath(path, table, name):
+    return os.path.join(path, f'{table}.{name}.bin')
+
+
+class TraceCache:
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.opcodes = meta['opcodes']
+        self.opcodeIds = {op: i for i, op in enumerate(self.opcodes)}
+        self.trace = self.__loadTable('trace', TRACE_COLUMNS, meta['traceRows'])
+        self.code = self.__loadTable('code', CODE_COLUMNS, meta['codeRows'])
+
+    # Counter of the opcode ids in ops, e.g. a slice of an op column, keyed by
+    # mnemonic in the order the opcodes first occur, like a Counter filled
+    # while parsing the text
+    def opcodeCounter(self, ops, chunk=1 << 20):
+        counts = np.zeros(len(self.opcodes), dtype=np.int64)
+        order = []
+        for start in range(0, len(ops), chunk):
+            part = np.asarray(ops[start:start + chunk])
+            hist = np.bincount(part, minlength=len(counts))
+            new = np.flatnonzero((hist > 0) & (counts == 0))
+            if len(new):
+                first = [int(np.argmax(part == op)) for op in new]
+                order.extend(int(new[i]) for i in np.argsort(first))
+            counts += hist
+        return Counter({self.opcodes[op]: int(counts[op]) for op in order})
+
+    def __loadTable(self, table, columns, rows):
+        arrays = {}
+        for name, dtype in columns.items():
+            if rows == 0:
+                # an empty file cannot be mapped
+                arrays[name] = np.zeros(0, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(_columnPath(self.path, table, name),
+                                         dtype=dtype, mode='r', shape=(rows,))
+        return arrays
+
+    # Map an opcode id array back to mnemonics
+    def opcodeNames(self, ids):
+        names = np.array(self.opcodes, dtype=object)
+        return names[ids]
+
+
+class _Table:
+    def __init__(self, path, table, columns):
+        self.files = {name: open(_columnPath(path, table, name), 'wb')
+                      for name in columns}
+        self.columns = {name: array.array(_TYPECODES[dtype])
+                        for name, dtype in columns.items()}
+        self.rows = 0
+
+    # Append the buffered rows to the column files
+    def flush(self):
+        self.rows += len(self.columns['pc'])
+        for name, values in self.columns.items():
+            values.tofile(self.files[name])
+            del values[:]
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+
+def _logKey(logfile):
+    st = os.stat(logfile)
+    return {'size': st.st_size, 'mtime': st.st_mtime_ns}
+
+
+# Parse logfile and write its cache directory. Returns the loaded TraceCache.
+def ingest(logfile, path=None):
+    path = path or cacheDir(logfile)
+    key = _logKey(logfile)
+    # meta.json is removed first and written last, so an interrupted ingest
+    # leaves the cache invalid rather than half-written
+    os.makedirs(path, exist_ok=True)
+    metaFile = os.path.join(path, 'meta.json')
+    if os.path.exists(metaFile):
+        os.remove(metaFile)
+    for name in os.listdir(path):
+        if name.endswith('.npy'):
+            # columns of an older format version
+            os.remove(os.path.join(path, name))
+    opcodeIds = {}
+    # whether each mnemonic has a result, by its bytes
+    resultOps = {}
+    trace = _Table(path, 'trace', TRACE_COLUMNS)
+    code = _Table(path, 'code', CODE_COLUMNS)
+    tRows = trace.columns['pc']
+    cRows = code.columns['pc']
+
+    tPc = trace.columns['pc'].append
+    tInsn = trace.columns['insn'].append
+    tOp = trace.columns['op'].append
+    tResult = trace.columns['result'].append
+    tHasResult = trace.columns['hasResult'].append
+    tCount = trace.columns['count'].append
+    cPc = code.columns['pc'].append
+    cOffset = code.columns['offset'].append
+    cInsn = code.columns['insn'].append
+    cOp = code.columns['op'].append
+
+    with TraceReader(logfile) as reader:
+        for line in reader:
+            words = line.split()
+            if len(words) < 3 or not words[0].startswith(b'0x'):
+                continue
+            try:
+                pc = int(words[0], 16)
+            except ValueError:
+                continue
+            if isCodeLine(words):
+                # Code dump: 0x55a1aa324b38   178  00008393   mv   t2, ra
+                try:
+                    offset = int(words[1], 16)
+                except ValueError:
+                    continue
+                mnemonic = words[3]
+                op = opcodeIds.setdefault(mnemonic, len(opcodeIds))
+                cPc(pc)
+                cOffset(offset)
+                cInsn(int(words[2], 16))
+                cOp(op)
+                if len(cRows) >= FLUSH_ROWS:
+                    code.flush()
+            elif isTraceLine(words):
+                # Trace: 0x00a0caf43be0   00000e37   lui   t3, 0x0   0000000000000000    (71)
+                mnemonic = words[2]
+                op = opcodeIds.setdefault(mnemonic, len(opcodeIds))
+                withResult = resultOps.get(mnemonic)
+                if withResult is None:
+                    withResult = resultOps[mnemonic] = hasResult(mnemonic.decode())
+                result = 0
+                hasValue = False
+                if withResult:
+                    idx = resultIndex(words, len(operandWords(words)))
+                    if idx < len(words) and words[idx][:1] != b'(':
+                        try:
+                            result = int(words[idx], 16)
+                            hasValue = True
+                        except ValueError:
+                            pass
+                countRes = _COUNT.search(line)
+                tPc(pc)
+                tInsn(int(words[1], 16))
+                tOp(op)
+                tResult(result)
+                tHasResult(hasValue)
+                tCount(int(countRes.group(1)) if countRes is not None else -1)
+                if len(tRows) >= FLUSH_ROWS:
+                    trace.flush()
+
+    trace.close()
+    code.close()
+    meta = dict(key)
+    meta['version'] = FORMAT_VERSION
+    meta['log'] = os.path.abspath(logfile)
+    meta['opcodes'] = [op.decode() for op in opcodeIds]
+    meta['traceRows'] = trace.rows
+    meta['codeRows'] = code.rows
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, metaFile)
+    return TraceCache(path, meta)
+
+
+# Return the cached meta data if the cache at path is valid for logfile
+def _validMeta(logfile, path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    key = _logKey(logfile)
+    if meta.get('version') != FORMAT_VERSION or meta.get('size') != key['size'] \
+            or meta.get('mtime') != key['mtime']:
+        return None
+    return meta
+
+
+# Load the cache for logfile, ingesting it first if it is missing or stale
+def load(logfile, path=None):
+    path = path or cacheDir(logfile)
+    meta = _validMeta(logfile, path)
+    if meta is None:
+        return ingest(logfile, path)
+    return TraceCache(path, meta)
+
+
+# Load the cache directory path by itself, re-ingesting the log it was built
+# from if that log still exists and has changed. Raises ValueError if path is
+# not a cache.
+def loadDir(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise ValueError(f'{path} is not a trace cache; run tracecache.py '
+                         'ingest first')
+    if meta.get('version') != FORMAT_VERSION:
+        raise ValueError(f'{path} has an old format; rerun tracecache.py '
+                         'ingest')
+    if os.path.exists(meta['log']):
+        return load(meta['log'], path)
+    return TraceCache(path, meta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['ingest', 'info'],
+                        help="ingest: (re)build the cache; info: describe it, "
+                             "building it first if it is stale")
+    parser.add_argument('logfile', nargs=1)
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None,
+                        help="Cache directory (default: <logfile>.tracecache)")
+    args = parser.parse_args()
+
+    startTime = time.time()
+    if args.command == 'ingest':
+        cache = ingest(args.logfile[0], args.cache_dir)
+    else:
+        cache = load(args.logfile[0], args.cache_dir)
+    print(f"cache: {cache.path}")
+    print(f"trace records: {cache.meta['traceRows']}")
+    print(f"code records: {cache.meta['codeRows']}")
+    print(f"opcodes: {len(cache.opcodes)}")
+    print('time cost -- {:.2f}s'.format(time.time() - startTime))
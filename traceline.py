@@ -0,0 +1,260 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Tokenizer for the instruction lines of a `--trace-sim` log, as used by
+# analyze.py.
+#
+# The part of a line that only depends on its pc and instruction word is
+# decoded once into a DecodedInstruction and shared by every later execution
+# of that pc, so InstructionTrace.fromLine() only reads the result and the
+# `(count)` of each line. Register operands are interned to indexes of
+# `registers`, which also holds the values that jump and call targets are
+# computed from.
+#
+#   traceline.target = 'mips'
+#   insn = InstructionTrace.fromLine(line)
+#   insn.callTarget()
+
+import re
+
+from mnemonics import (hasResult, isBranch, isControlFlow, isJump,
+                       isJumpAndLink, isStore, operandWords)
+from regfile import RegisterFile
+
+# Target architecture of the trace, 'riscv' or 'mips'
+target = 'riscv'
+
+# Register file that operands are interned to and that jump and call targets
+# are read from
+registers = RegisterFile()
+
+
+# The parts of a traced instruction that only depend on its pc and encoding:
+# decoded once per distinct instruction and shared by all its executions,
+# with register operands interned to RegisterFile indexes
+class DecodedInstruction:
+    __slots__ = ['pc', 'word', 'insn', 'operands', 'resIdx', 'hasResult',
+                 'linkResult', 'controlFlow', 'dest', 'isCall', 'isReturn',
+                 'callReg', 'jumpBase', 'jumpReg']
+
+    # word is the text of the instruction word, operandWords the words of the
+    # operand list, e.g. [b't3,', b'0x0']
+    def __init__(self, pc, word, insn, operandWords):
+        operands = []
+        if insn == 'ret' or insn == 'ecall':  # No operands
+            pass
+        else:
+            for operand in operandWords:
+                parts = re.split(rb'[\(\)]', operand)
+                for part in parts:
+                    if len(part) > 0:
+                        operands.append(part.strip(b',').decode())
+
+        self.pc = pc
+        self.word = word
+        self.insn = insn
+        self.operands = operands
+        # The result is the next word after the operands
+        self.resIdx = 3 + len(operandWords)
+        self.hasResult = hasResult(insn)
+        self.linkResult = None
+        if target == 'mips' and (insn == 'bal' or insn == 'jalr'):
+            self.linkResult = pc + 8
+        self.controlFlow = isControlFlow(insn)
+
+        dest = self.getDestinationReg()
+        self.dest = registers.index(dest) if dest is not None else None
+        self.isCall = self.getIsCall()
+        self.isReturn = insn == 'ret' or (insn == 'jr' and operands[0] == 'ra')
+        self.callReg = None
+        if self.isCall:
+            if target == 'riscv' and len(operands) != 1:
+                # jalr xM, xN and jalr M(xN)
+                self.callReg = registers.index(operands[1])
+            else:
+                # jalr xN
+                self.callReg = registers.index(operands[0])
+
+        # The jump target is jumpBase, plus the value of jumpReg if not None
+        self.jumpBase = None
+        self.jumpReg = None
+        if insn == 'j':             # j  4
+            self.jumpBase = pc + int(operands[0])
+        elif insn == 'jal' and len(operands) == 2 and operands[0] == 'zero_reg':
+            self.jumpBase = pc + int(operands[1])
+        elif insn == 'jr':
+            if len(operands) == 2:  # jr 4(t4)
+                self.jumpBase = int(operands[0])
+                self.jumpReg = registers.index(operands[1])
+            else:                   # jr t4
+                self.jumpBase = 0
+                self.jumpReg = registers.index(operands[0])
+        elif insn == 'jalr' and len(operands) == 3 and operands[0] == 'zero_reg':
+            self.jumpBase = int(operands[1])
+            self.jumpReg = registers.index(operands[2])
+
+    def getIsCall(self):
+        if self.insn == 'jalr' and \
+                ((target == 'riscv' and
+                  (self.operands[0] == 'ra' or len(self.operands) == 1)) or
+                 (target == 'mips' and self.operands[1] == 'ra')):
+            return True
+        return False
+
+    def getDestinationReg(self):
+        if len(self.operands) == 0:
+            return None
+        if isStore(self.insn):
+            return None
+        elif isBranch(self.insn):
+            return None
+        elif isJump(self.insn):
+            return None
+        elif isJumpAndLink(self.insn):
+            if len(self.operands) == 1:  # Implicit ra
+                return 'ra'
+            elif target == 'riscv':
+                return self.operands[0]
+            elif target == 'mips':
+                return self.operands[1]
+        return self.operands[0]
+
+
+# Bound on the number of distinct instructions kept decoded; the cache is
+# dropped and refilled when it is reached, so memory stays flat even when
+# code is generated and thrown away for the whole run
+MAX_DECODED = 1 << 20
+
+# Decoded instructions by the text of their pc
+decodedInstructions = {}
+
+COUNT_RE = re.compile(rb'\(([1-9][0-9]* *)\)')
+
+
+class InstructionTrace:
+    __slots__ = ['line', 'decoded', 'result', 'count']
+
+    def __init__(self, line, decoded, result, count):
+        self.line = line
+        self.decoded = decoded
+        self.result = result
+        self.count = count
+
+    @property
+    def pc(self):
+        return self.decoded.pc
+
+    @property
+    def insn(self):
+        return self.decoded.insn
+
+    @property
+    def operands(self):
+        return self.decoded.operands
+
+    def __repr__(self):
+        return f"{hex(self.pc)}\t{self.insn} {','.join(self.operands)}\t({self.count})"
+
+    # Create an InstructionTrace from a line of the simulator trace, or if it
+    # does not look like an instruction, return None. words is line.split(),
+    # if the caller already has it.
+    # A normal instruction looks like:
+    #   0x00a0caf43be0   00000e37       lui       t3, 0x0               0000000000000000    (71)    int64:0       uint64:0
+    #
+    # The words are scanned in a single pass: everything up to the end of the
+    # operands comes from the decoded instruction of this pc, the optional
+    # `-> target` is skipped, and the result and the `(count)` are read at
+    # the position that follows. Only lines where the count is not at its usual place are
+    # searched for it.
+    @classmethod
+    def fromLine(cls, line, words=None):
+        if words is None:
+            words = line.split()
+        if len(words) < 3:
+            return None
+        pcText = words[0]
+        if pcText[:2] != b'0x' or len(words[1]) != 8:
+            return None
+
+        decoded = decodedInstructions.get(pcText)
+        if decoded is None or decoded.word != words[1]:
+            try:
+                pc = int(pcText, 16)
+                int(words[1], 16)
+            except ValueError:
+                return None
+            if len(decodedInstructions) >= MAX_DECODED:
+                decodedInstructions.clear()
+            decoded = DecodedInstruction(pc, words[1], words[2].decode(),
+                                         operandWords(words))
+            decodedInstructions[pcText] = decoded
+
+        n = len(words)
+        idx = decoded.resIdx
+        # Skip over the branch/jump destination
+        if idx + 1 < n and words[idx] == b'->':
+            idx += 2
+        result = None
+        if idx < n:
+            word = words[idx]
+            if word[:1] == b'(':
+                resultText = None
+            else:
+                resultText = word
+                idx += 1
+            if decoded.hasResult and resultText is not None:
+                result = int(resultText, 16)
+        if decoded.linkResult is not None:
+            result = decoded.linkResult
+
+        count = None
+        if idx < n:
+            word = words[idx]
+            if word[:1] == b'(' and word[-1:] == b')' and word[1:2] != b'0':
+                try:
+                    count = int(word[1:-1])
+                except ValueError:
+                    pass
+        if count is None:
+            countRes = COUNT_RE.search(line)
+            if countRes is not None:
+                count = int(countRes.group(1))
+            elif decoded.controlFlow:
+                count = -1
+            else:
+                return None
+
+        return cls(line, decoded, result, count)
+
+    def isStore(self):
+        return isStore(self.insn)
+
+    def isBranch(self):
+        return isBranch(self.insn)
+
+    def isJump(self):
+        return isJump(self.insn)
+
+    def isJumpAndLink(self):
+        return isJumpAndLink(self.insn)
+
+    def isCall(self):
+        return self.decoded.isCall
+
+    def isReturn(self):
+        return self.decoded.isReturn
+
+    def jumpTarget(self):
+        decoded = self.decoded
+        if decoded.jumpReg is not None:
+            return decoded.jumpBase + registers.read(decoded.jumpReg)
+        return decoded.jumpBase
+
+    def callTarget(self):
+        if not self.decoded.isCall:
+            return None
+        return registers.read(self.decoded.callReg)
+
+    def getDestinationReg(self):
+        return self.decoded.getDestinationReg()
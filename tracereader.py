@@ -0,0 +1,179 @@
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Shared line reader for the `--print-all-code` / `--trace-sim` logs consumed
+# by analyze.py, CountInstr.py and collect-convertible.py.
+#
+# Regular files are memory-mapped and split with mmap.readline(), so each line
+# is a single bytes object sliced straight out of the page cache, with no
+# decode or strip. Pipes, stdin (`-`) and already-open binary streams are read
+# through their buffered readline() instead. Callers work on the raw bytes and
+# only decode the few fields they actually print.
+#
+#   with TraceReader('out.log') as reader:
+#       for line in reader:
+#           words = line.split()
+#
+# With follow=True the source is always read as a stream, and a regular file
+# is followed like `tail -f`: at its end the reader waits for more lines until
+# stop() is called, e.g. from a SIGINT handler. Pipes end when the writer
+# closes them, or when stop() interrupts a readline() waiting on them.
+
+import mmap
+import os
+import stat
+import sys
+import time
+
+# Seconds to wait for a followed file to grow
+FOLLOW_INTERVAL = 0.2
+
+
+class TraceReader:
+    # source is a path, '-' for stdin, or a binary file object (e.g. the
+    # stdout pipe of a subprocess). start/end restrict reading to a byte
+    # range of a regular file; start must be at the beginning of a line.
+    def __init__(self, source, start=0, end=None, follow=False):
+        self.file = None
+        self.map = None
+        self.ownsFile = False
+        self.start = start
+        self.end = end
+        self.pos = start
+        self.follow = follow
+        self.stopped = False
+        # whether a stream is blocked in readline()
+        self.waiting = False
+
+        if source == '-':
+            self.file = sys.stdin.buffer
+        elif isinstance(source, (str, bytes, os.PathLike)):
+            self.file = open(source, 'rb')
+            self.ownsFile = True
+        else:
+            self.file = source
+
+        try:
+            st = os.fstat(self.file.fileno())
+            size = st.st_size
+            seekable = self.file.seekable()
+            self.regular = stat.S_ISREG(st.st_mode)
+        except (AttributeError, OSError, ValueError):
+            size = 0
+            seekable = False
+            self.regular = False
+        if follow:
+            if start != 0:
+                self.file.seek(start)
+        elif seekable and size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.end is None or self.end > size:
+                self.end = size
+            self.map.seek(start)
+        elif start != 0:
+            raise ValueError('byte ranges are only supported on regular files')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        if self.map is not None:
+            return self.__mappedLines()
+        if self.follow and self.regular:
+            return self.__followLines()
+        return self.__streamLines()
+
+    def __mappedLines(self):
+        readline = self.map.readline
+        end = self.end
+        pos = self.pos
+        while pos < end:
+            line = readline()
+            pos += len(line)
+            self.pos = pos
+            yield line
+
+    def __streamLines(self):
+        readline = self.file.readline
+        while not self.stopped:
+            self.waiting = True
+            try:
+                line = readline()
+            except KeyboardInterrupt:
+                # raised by stop()
+                return
+            finally:
+                self.waiting = False
+            if not line:
+                return
+            self.pos += len(line)
+            yield line
+
+    def __followLines(self):
+        readline = self.file.readline
+        partial = b''
+        while not self.stopped:
+            line = readline()
+            if not line.endswith(b'\n'):
+                # wait for the writer to finish the line
+                partial += line
+                time.sleep(FOLLOW_INTERVAL)
+                continue
+            if partial:
+                line = partial + line
+                partial = b''
+            self.pos += len(line)
+            yield line
+
+    # Make a followed reader return at the next line. A readline() blocked on
+    # a quiet pipe is retried after a signal handler returns, so when called
+    # from one, stop() interrupts it with KeyboardInterrupt instead.
+    def stop(self):
+        self.stopped = True
+        if self.waiting:
+            raise KeyboardInterrupt
+
+    # Byte offset of the next line to be returned
+    def tell(self):
+        return self.pos
+
+    # Total size of the underlying file, or None when streaming
+    def size(self):
+        return len(self.map) if self.map is not None else None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.ownsFile:
+            self.file.close()
+        self.file = None
+
+
+# Split a regular file into at most count byte ranges of roughly equal size,
+# each starting at the beginning of a line and ending just after a newline (or
+# at the end of the file). Returns a list of (start, end) tuples in file order.
+def splitRanges(path, count):
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, count):
+            pos = size * i // count
+            if pos <= bounds[-1]:
+                continue
+            # Reading from pos - 1 keeps pos itself when it already starts a
+            # line
+            f.seek(pos - 1)
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)
+            if bounds[i] < bounds[i + 1]]
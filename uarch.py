@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+# Cycle estimates for the basic blocks of a d8 `--print-code` dump.
+#
+# Each instruction is classified with the cost tables of costmodel.py and its
+# register operands are read from the disassembly, giving the dependency
+# graph of the block. A core model from cores/<name>.ini gives the latency
+# and throughput of each instruction class and the issue width. For every
+# block this computes:
+#
+#   latency     the critical path through the register dependencies
+#   throughput  the bound from issue width and functional unit occupancy
+#   cycles      in-order cores: the cycle the last result is ready when
+#               instructions issue in program order; out-of-order cores:
+#               max(latency, throughput)
+#
+# Stores and loads are ordered through memory as if they all aliased, and a
+# call waits for all earlier results and delays all later ones.
+#
+#   $ uarch.py --arch riscv --core inorder dump.txt
+
+import argparse
+import configparser
+import math
+import os
+import re
+import sys
+
+from prettytable import PrettyTable
+
+from costmodel import load_model
+
+CORES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cores')
+
+# registers that are never a real dependency
+ZERO_REGS = frozenset(['zero_reg', 'zero', 'x0'])
+
+# pseudo register for memory dependencies
+MEM = 'mem'
+
+_OPERAND_SPLIT = re.compile(r'[\s,()]+')
+_REGISTER = re.compile(r'[a-z_][a-z0-9_]*$')
+
+
+class CoreModel:
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path or os.path.join(CORES_DIR, f'{name}.ini')
+        config = configparser.ConfigParser()
+        if not config.read(self.path):
+            raise FileNotFoundError(f'no core model {name}: {self.path}')
+        self.issue_width = config['core'].getint('issue_width', 1)
+        self.out_of_order = config['core'].getboolean('out_of_order', False)
+        self.latency = {cls: int(v) for cls, v in config['latency'].items()}
+        self.throughput = {cls: float(v)
+                           for cls, v in config['throughput'].items()}
+
+    def class_latency(self, cls):
+        return self.latency.get(cls, self.latency.get('default', 1))
+
+    def class_throughput(self, cls):
+        return self.throughput.get(cls, self.throughput.get('default', 1))
+
+    # (number of units, cycles each instruction keeps a unit busy)
+    def units(self, cls):
+        recip = self.class_throughput(cls)
+        if recip < 1:
+            return max(1, round(1 / recip)), 1
+        return 1, math.ceil(recip)
+
+
+_cores = {}
+
+
+# Return the (shared) core model called name
+def load_core(name):
+    core = _cores.get(name)
+    if core is None:
+        core = _cores[name] = CoreModel(name)
+    return core
+
+
+# One disassembled instruction. count is the number of machine instructions
+# it stands for (the expansion of li), each dependent on the previous one.
+class Instr:
+    __slots__ = ['mnemonic', 'cls', 'dests', 'srcs', 'count']
+
+    def __init__(self, mnemonic, cls, dests, srcs, count=1):
+        self.mnemonic = mnemonic
+        self.cls = cls
+        self.dests = dests
+        self.srcs = srcs
+        self.count = count
+
+
+# Parse one instruction line of the dump:
+#   0x7f5a1c0c0040     0  00008393       mv        t2, ra
+# Returns None for lines that are not instructions.
+def parse_instr(model, line):
+    line = line.split(';;', 1)[0]
+    words = line.split(None, 4)
+    if len(words) < 4 or not words[0].startswith('0x'):
+        return None
+    mnemonic = words[3]
+    operands = words[4] if len(words) > 4 else ''
+    # branch targets are printed as "offset -> address"
+    operands = operands.split('->', 1)[0]
+    regs = [r for r in _OPERAND_SPLIT.split(operands)
+            if _REGISTER.match(r) and r not in ZERO_REGS]
+    cls = model.instr_class(mnemonic)
+    if mnemonic in model.stores:
+        dests, srcs = [MEM], regs
+    elif cls in ('branch', 'call', 'ret', 'ebreak'):
+        dests, srcs = [], regs
+    else:
+        dests, srcs = regs[:1], regs[1:]
+        if cls in ('load_store', 'fpu_load_store'):
+            srcs.append(MEM)
+    return Instr(mnemonic, cls, dests, srcs,
+                 model.expansion(mnemonic, operands))
+
+
+class BlockEstimate:
+    def __init__(self, label, instrs, latency, throughput, cycles):
+        self.label = label
+        self.instrs = instrs
+        self.latency = latency
+        self.throughput = throughput
+        self.cycles = cycles
+
+
+# Length of the longest register dependency chain of instrs
+def critical_path(instrs, core):
+    ready = {}
+    barrier = 0
+    end = 0
+    for instr in instrs:
+        start = max([barrier] + [ready.get(r, 0) for r in instr.srcs])
+        if instr.cls == 'call':
+            start = max(start, end)
+        finish = start + core.class_latency(instr.cls) * instr.count
+        for r in instr.dests:
+            ready[r] = finish
+        if instr.cls == 'call':
+            barrier = finish
+        end = max(end, finish)
+    return end
+
+
+# Lower bound on the cycles needed to issue instrs, from the issue width and
+# the busiest functional unit class
+def throughput_bound(instrs, core):
+    if not instrs:
+        return 0
+    occupancy = {}
+    for instr in instrs:
+        occupancy[instr.cls] = occupancy.get(instr.cls, 0) + \
+            core.class_throughput(instr.cls) * instr.count
+    issued = sum(instr.count for instr in instrs)
+    return max([issued / core.issue_width] + list(occupancy.values()))
+
+
+# Cycle the last result of instrs is ready on an in-order core, issuing up to
+# issue_width instructions per cycle in program order
+def in_order_cycles(instrs, core):
+    ready = {}
+    units = {}
+    barrier = 0
+    cycle = 0
+    slots = 0
+    end = 0
+    for instr in instrs:
+        if instr.cls not in units:
+            count, busy = core.units(instr.cls)
+            units[instr.cls] = ([0] * count, busy)
+        free, busy = units[instr.cls]
+        unit = free.index(min(free))
+        start = max([cycle, barrier, free[unit]] +
+                    [ready.get(r, 0) for r in instr.srcs])
+        if instr.cls == 'call':
+            start = max(start, end)
+        start = math.ceil(start)
+        if start > cycle:
+            cycle = start
+            slots = 0
+        elif slots == core.issue_width:
+            cycle += 1
+            slots = 0
+            start = cycle
+        # the instructions of an expansion issue back to back, each waiting
+        # for the previous one
+        latency = core.class_latency(instr.cls)
+        last = start + latency * (instr.count - 1)
+        if last > cycle:
+            cycle = last
+            slots = 0
+        slots += 1
+        free[unit] = last + busy
+        finish = last + latency
+        for r in instr.dests:
+            ready[r] = finish
+        if instr.cls == 'call':
+            barrier = finish
+        end = max(end, finish)
+    return end
+
+
+# Whole cycles from an estimate that may be fractional, e.g. a throughput
+# bound; rounding to 6 places first keeps float noise from adding a cycle
+def whole_cycles(cycles):
+    return int(math.ceil(round(cycles, 6)))
+
+
+def estimate_block(label, instrs, core):
+    latency = critical_path(instrs, core)
+    throughput = throughput_bound(instrs, core)
+    if core.out_of_order:
+        cycles = whole_cycles(max(latency, throughput))
+    else:
+        cycles = whole_cycles(in_order_cycles(instrs, core))
+    return BlockEstimate(label, len(instrs), latency, round(throughput, 2),
+                         cycles)
+
+
+# Split the lines of one code object (as yielded by filter_asm in
+# shortfruit.py) into (label, [Instr]) per basic block
+def split_blocks(lines, model):
+    label = ''
+    instrs = []
+    for line in lines:
+        if line.startswith('--'):
+            if instrs or label:
+                yield label, instrs
+            label = line
+            instrs = []
+            continue
+        instr = parse_instr(model, line)
+        if instr is not None:
+            instrs.append(instr)
+    if instrs or label:
+        yield label, instrs
+
+
+def estimate(lines, arch, core):
+    model = load_model(arch)
+    return [estimate_block(label, instrs, core)
+            for label, instrs in split_blocks(lines, model)]
+
+
+# Estimated cycles per basic block label, the shape of get_cost() in
+# shortfruit.py
+def block_cycles(lines, arch, core):
+    cycles = {}
+    for block in estimate(lines, arch, core):
+        cycles[block.label] = cycles.get(block.label, 0) + block.cycles
+    return cycles
+
+
+# Yield the stripped instruction and block lines of each code object in a
+# `--print-code` dump, as one list per object
+def code_objects(lines):
+    current = None
+    for line in lines:
+        if line.startswith('Instructions'):
+            current = []
+            continue
+        if current is None:
+            continue
+        line = line.strip()
+        if not line:
+            yield current
+            current = None
+        elif line.startswith('0x') or line.startswith('--'):
+            current.append(line)
+    if current:
+        yield current
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--arch', default='riscv',
+                        help='architecture of the dump (costs/<arch>.ini)')
+    parser.add_argument('--core', default='inorder',
+                        help='core model (cores/<core>.ini)')
+    parser.add_argument('dump', nargs='?', default='-',
+                        help="d8 --print-code output, or '-' to read from stdin")
+    args = parser.parse_args()
+
+    core = load_core(args.core)
+    f = sys.stdin if args.dump == '-' else open(args.dump)
+    with f:
+        objects = list(code_objects(f))
+
+    x = PrettyTable(['Code', 'Basic Block', 'Instructions', 'Latency',
+                     'Throughput', 'Cycles'])
+    x._max_width = {'Basic Block': 30}
+    total = 0
+    for i, lines in enumerate(objects):
+        for block in estimate(lines, args.arch, core):
+            x.add_row([i, block.label[3:-3], block.instrs, block.latency,
+                       block.throughput, block.cycles])
+            total += block.cycles
+    print(x)
+    print(f'total: {total} cycles on {core.name} '
+          f'({"out-of-order" if core.out_of_order else "in-order"}, '
+          f'{core.issue_width}-wide)')
+
+if __name__ == '__main__':
+    main()